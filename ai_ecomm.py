@@ -17,7 +17,7 @@ def create_app(config_class=Config):
     
     # Import models and create tables
     with app.app_context():
-        from models import Category, SKU, SKUImage, SKUVariant, SyncLog, AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics
+        from models import Category, SKU, SKUImage, SKUVariant, SyncLog, AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics, BackgroundJob, ImageEmbedding, AgentAnalyticsRollup, AgentProductRollup, AnalyticsWatermark, ProductCooccurrence, CooccurrenceSession, ProductNeighborList
         from models.sku import ProductOption
         db.create_all()
     
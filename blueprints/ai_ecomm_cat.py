@@ -3,9 +3,14 @@ from flask_restful import Api, Resource
 from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
-import threading
 import json
 
+from services.job_queue import JobQueue, JobCancelled, register_job_handler, ensure_embedded_worker
+from services.popularity import get_popularity_index
+from services.product_query import ProductFilterSpec, ProductQueryEngine, SORT_ORDERS
+# Registers the vector_neighbors job handler and schedule
+import services.vector_neighbors
+
 
 ai_ecomm_cat_bp = Blueprint('ai_ecomm_cat', __name__)
 api = Api(ai_ecomm_cat_bp)
@@ -14,8 +19,13 @@ api = Api(ai_ecomm_cat_bp)
 weaviate_service = None
 shopify_service = None
 
-# Global task status storage (use Redis for production)
-_task_statuses = {}
+# Background jobs (sync, reindex) are persisted in the background_jobs table
+job_queue = JobQueue()
+
+@ai_ecomm_cat_bp.before_app_request
+def start_job_worker():
+    """Start the in-process job worker on the first request served by this process"""
+    ensure_embedded_worker(current_app._get_current_object())
 
 def get_services():
     global weaviate_service, shopify_service
@@ -35,6 +45,9 @@ def get_models():
     from models.sku import ProductOption
     return SKU, Category, SKUImage, SKUVariant, SyncLog, ProductOption
 
+# Search result sources whose distances come from a real Weaviate search
+VECTOR_RESULT_SOURCES = ('vector', 'vector_image', 'vector_text_image', 'text_fallback', 'image_fallback')
+
 # Helper functions
 def allowed_file(filename):
     from config.config import Config
@@ -548,83 +561,9 @@ class SearchResource(Resource):
             print(f"Error parsing filters: {e}, filters_json: {filters_json}")
             catalog_filters = {}
         
-        def apply_catalog_filters(search_results, filters):
-            """Apply catalog-style filters to search results"""
-            if not filters:
-                return search_results
-            
-            db = get_db()
-            filtered_ids = []
-            
-            # Start with all product IDs from search results
-            search_ids = [r.get('product_id') for r in search_results if r.get('product_id')]
-            if not search_ids:
-                return search_results
-            
-            # Build query with filters
-            query = SKU.query.filter(SKU.id.in_(search_ids))
-            
-            # Apply category filter
-            if filters.get('categories'):
-                categories = [c for c in filters['categories'] if c]
-                if categories:
-                    try:
-                        category_ids = [int(c) for c in categories]
-                        query = query.join(SKU.categories).filter(Category.id.in_(category_ids))
-                    except ValueError:
-                        pass
-            
-            # Apply vendor filter
-            if filters.get('vendors'):
-                vendors = [v for v in filters['vendors'] if v]
-                if vendors:
-                    query = query.filter(SKU.vendor.in_(vendors))
-            
-            # Apply product type filter
-            if filters.get('productTypes'):
-                product_types = [pt for pt in filters['productTypes'] if pt]
-                if product_types:
-                    query = query.filter(SKU.product_type.in_(product_types))
-            
-            # Apply price range filters
-            if filters.get('minPrice'):
-                try:
-                    min_price = float(filters['minPrice'])
-                    query = query.filter(SKU.price >= min_price)
-                except (ValueError, TypeError):
-                    pass
-                    
-            if filters.get('maxPrice'):
-                try:
-                    max_price = float(filters['maxPrice'])
-                    query = query.filter(SKU.price <= max_price)
-                except (ValueError, TypeError):
-                    pass
-            
-            # Apply stock filters
-            if not filters.get('inStock', True) and filters.get('outOfStock', False):
-                query = query.filter(SKU.quantity == 0)
-            elif filters.get('inStock', True) and not filters.get('outOfStock', False):
-                query = query.filter(SKU.quantity > 0)
-            
-            # Apply option filters
-            options = filters.get('options', {})
-            for option_name, option_values in options.items():
-                if option_values:
-                    # Join with ProductOption and filter by option values
-                    option_skus = db.session.query(ProductOption.sku_id).filter(
-                        ProductOption.name == option_name
-                    ).all()
-                    option_sku_ids = [o[0] for o in option_skus]
-                    if option_sku_ids:
-                        query = query.filter(SKU.id.in_(option_sku_ids))
-            
-            # Get filtered SKU IDs
-            filtered_skus = query.all()
-            filtered_ids = [sku.id for sku in filtered_skus]
-            
-            # Return only search results that pass the filters
-            return [r for r in search_results if r.get('product_id') in filtered_ids]
+        # One spec drives the vector pushdown, the SQL filters and the final check
+        filter_spec = ProductFilterSpec.from_search_filters(catalog_filters)
+        product_query = ProductQueryEngine()
         
         if search_type == 'text':
             if not query:
@@ -637,7 +576,7 @@ class SearchResource(Resource):
             # First, try vector search through Weaviate
             vector_results = []
             try:
-                weaviate_results = weaviate_service.search_by_text(query, limit=5)
+                weaviate_results = product_query.vector_search(weaviate_service, query, filter_spec, limit=5)
                 for result in weaviate_results:
                     product_id = result.get('product_id')
                     if product_id:
@@ -673,7 +612,8 @@ class SearchResource(Resource):
                 ])
             
             # Primary search: exact phrase match (higher relevance)
-            exact_skus = SKU.query.filter(
+            filtered_skus = product_query.apply(SKU.query, filter_spec)
+            exact_skus = filtered_skus.filter(
                 or_(
                     SKU.title.ilike(search_pattern),
                     SKU.description.ilike(search_pattern),
@@ -686,7 +626,7 @@ class SearchResource(Resource):
             
             # Secondary search: individual terms (if we need more results)
             if len(exact_skus) < 5 and len(search_terms) > 1:
-                term_skus = SKU.query.filter(or_(*conditions)).limit(7).all()
+                term_skus = filtered_skus.filter(or_(*conditions)).limit(7).all()
                 # Combine results, avoiding duplicates
                 all_skus = exact_skus + [sku for sku in term_skus if sku not in exact_skus]
             else:
@@ -733,7 +673,7 @@ class SearchResource(Resource):
             results = combined_results[:10]
             
             # Apply catalog filters to results
-            results = apply_catalog_filters(results, catalog_filters)
+            results = product_query.filter_results(results, filter_spec)
         
         elif search_type == 'image':
             if 'image' not in request.files:
@@ -804,7 +744,7 @@ class SearchResource(Resource):
                 return {'error': 'Invalid file type'}, 400
             
             # Apply catalog filters to image search results
-            results = apply_catalog_filters(results, catalog_filters)
+            results = product_query.filter_results(results, filter_spec)
         
         elif search_type == 'text_image':
             # Combined text and image search
@@ -928,16 +868,23 @@ class SearchResource(Resource):
             print(f"Combined search final result count: {len(results)}")
             
             # Apply catalog filters to combined search results
-            results = apply_catalog_filters(results, catalog_filters)
+            results = product_query.filter_results(results, filter_spec)
         else:
             return {'error': 'Invalid search type. Use: text, image, or text_image'}, 400
         
+        # Blend click-through popularity into the similarity order of each vector search's results;
+        # keyword and fallback hits have synthetic distances and keep their positions
+        results = get_popularity_index(current_app._get_current_object()).rerank(
+            results, sources=VECTOR_RESULT_SOURCES
+        )
+        
         # Enrich results with database data
+        skus = product_query.fetch(result.get('product_id') for result in results)
         enriched_results = []
         for result in results:
             product_id = result.get('product_id')
             if product_id:
-                sku = SKU.query.get(product_id)
+                sku = skus.get(product_id)
                 if sku:
                     product_data = sku.to_dict()
                     product_data['similarity_score'] = 1 - result.get('_additional', {}).get('distance', 1)
@@ -980,17 +927,12 @@ class ShopifySyncResource(Resource):
         db.session.add(sync_log)
         db.session.commit()
         
-        # Start sync in background - pass the current app instance
-        from flask import current_app
-        thread = threading.Thread(
-            target=self._sync_products,
-            args=(sync_log.id, current_app._get_current_object(), test_mode)
-        )
-        thread.start()
+        # Queue sync for a background job worker
+        job = job_queue.enqueue('shopify_sync', {'sync_log_id': sync_log.id, 'test_mode': test_mode})
         
-        return {'message': 'Sync started', 'sync_id': sync_log.id}, 202
+        return {'message': 'Sync started', 'sync_id': sync_log.id, 'task_id': job.id}, 202
     
-    def _sync_products(self, sync_log_id, app, test_mode=False):
+    def _sync_products(self, sync_log_id, app, test_mode=False, job=None):
         """Background task to sync products"""
         with app.app_context():
             db = get_db()
@@ -1026,8 +968,11 @@ class ShopifySyncResource(Resource):
                 return
             
             try:
+                # A restarted job resumes from the page after the last one it finished
+                checkpoint = job.checkpoint if job else {}
+                
                 # Sync collections first
-                collections = shopify_service.get_collections()
+                collections = shopify_service.get_collections() if not checkpoint else []
                 
                 for collection in collections:
                     transformed = shopify_service.transform_collection(collection)
@@ -1044,11 +989,11 @@ class ShopifySyncResource(Resource):
                 db.session.commit()
                 
                 # For incremental sync, find the last successful sync
-                updated_at_min = None
-                new_products = 0
-                updated_products = 0
+                updated_at_min = checkpoint.get('updated_at_min')
+                new_products = checkpoint.get('new', 0)
+                updated_products = checkpoint.get('updated', 0)
                 
-                if sync_log.sync_type == 'incremental':
+                if sync_log.sync_type == 'incremental' and not checkpoint:
                     last_sync = SyncLog.query.filter(
                         SyncLog.status == 'completed',
                         SyncLog.sync_type.in_(['full', 'incremental']),
@@ -1067,12 +1012,16 @@ class ShopifySyncResource(Resource):
                         sync_log.sync_type = 'full'
                 
                 # Sync products
-                page_info = None
-                total_products = 0
-                processed_products = 0
-                failed_products = 0
+                page_info = checkpoint.get('page_info')
+                total_products = checkpoint.get('total', 0)
+                processed_products = checkpoint.get('processed', 0)
+                failed_products = checkpoint.get('failed', 0)
+                # A checkpoint without a next page means the last page was already synced
+                pages_done = bool(checkpoint) and not page_info
+                if checkpoint:
+                    print(f"Resuming sync {sync_log_id} after {total_products} products")
                 
-                while True:
+                while not pages_done:
                     result = shopify_service.get_products(
                         page_info=page_info,
                         updated_at_min=updated_at_min if sync_log.sync_type == 'incremental' else None
@@ -1085,7 +1034,21 @@ class ShopifySyncResource(Resource):
                     
                     total_products += len(products)
                     
+                    # Start fetching this page's images while products are written to the database
+                    image_futures = weaviate_service.image_pipeline.prefetch(
+                        product['images'][0].get('src') for product in products if product.get('images')
+                    )
+                    
                     for product in products:
+                        if job:
+                            # Throttled, so a long page still heartbeats and isn't requeued as stale
+                            job.update_progress(
+                                processed=processed_products,
+                                total=total_products,
+                                failed=failed_products,
+                                operation=f'Synced {processed_products} of {total_products} products'
+                            )
+                            job.raise_if_cancelled()
                         try:
                             transformed = shopify_service.transform_product(product)
                             
@@ -1140,10 +1103,15 @@ class ShopifySyncResource(Resource):
                             db.session.commit()
                             
                             # Add to Weaviate
+                            product_data = sku.to_dict()
+                            image_base64 = None
+                            if product_data.get('images') and product_data['images'][0]['url'] in image_futures:
+                                image_base64 = image_futures[product_data['images'][0]['url']].result()
+                            
                             if sku.weaviate_id:
-                                weaviate_service.update_product(sku.weaviate_id, sku.to_dict())
+                                weaviate_service.update_product(sku.weaviate_id, product_data, image_base64=image_base64)
                             else:
-                                weaviate_id = weaviate_service.add_product(sku.to_dict())
+                                weaviate_id = weaviate_service.add_product(product_data, image_base64=image_base64)
                                 if weaviate_id:
                                     sku.weaviate_id = weaviate_id
                                     db.session.commit()
@@ -1161,6 +1129,24 @@ class ShopifySyncResource(Resource):
                     sync_log.failed_items = failed_products
                     db.session.commit()
                     
+                    if job:
+                        job.save_checkpoint({
+                            'page_info': page_info,
+                            'updated_at_min': updated_at_min,
+                            'total': total_products,
+                            'processed': processed_products,
+                            'failed': failed_products,
+                            'new': new_products,
+                            'updated': updated_products
+                        })
+                        job.update_progress(
+                            processed=processed_products,
+                            total=total_products,
+                            failed=failed_products,
+                            operation=f'Synced {processed_products} of {total_products} products',
+                            force=True
+                        )
+                    
                     if not page_info:
                         break
                 
@@ -1176,6 +1162,15 @@ class ShopifySyncResource(Resource):
                 db.session.commit()
                 print(f"Sync completed successfully. Total products: {total_products}")
                 
+            except JobCancelled:
+                db.session.rollback()
+                sync_log = SyncLog.query.get(sync_log_id)
+                if sync_log and sync_log.status in ['started', 'in_progress']:
+                    sync_log.status = 'cancelled'
+                    sync_log.error_message = 'Cancelled by user'
+                    sync_log.completed_at = datetime.utcnow()
+                    db.session.commit()
+                raise
             except Exception as e:
                 print(f"Sync error: {e}")
                 import traceback
@@ -1192,6 +1187,18 @@ class ShopifySyncResource(Resource):
                         db.session.commit()
                 except Exception as log_error:
                     print(f"Failed to update sync log with error: {log_error}")
+                raise
+
+
+@register_job_handler('shopify_sync')
+def run_shopify_sync_job(job):
+    """Job handler: Shopify product sync"""
+    ShopifySyncResource()._sync_products(
+        job.payload['sync_log_id'],
+        current_app._get_current_object(),
+        job.payload.get('test_mode', False),
+        job=job
+    )
 
 class SyncStatusResource(Resource):
     def get(self, sync_id):
@@ -1199,14 +1206,23 @@ class SyncStatusResource(Resource):
         SKU, Category, SKUImage, SKUVariant, SyncLog, ProductOption = get_models()
         sync_log = SyncLog.query.get_or_404(sync_id)
         
-        # Check if sync has been running too long (more than 10 minutes)
+        # A sync is only lost when no job is working on it any more; long or resumed syncs keep running
         if sync_log.status in ['started', 'in_progress']:
             from datetime import datetime, timedelta
-            if sync_log.started_at and (datetime.utcnow() - sync_log.started_at) > timedelta(minutes=10):
-                # Mark as failed due to timeout
+            from models.job import BackgroundJob
+            job = BackgroundJob.get_active_for('shopify_sync', sync_log_id=sync_log.id)
+            stale_after = timedelta(seconds=current_app.config.get('JOB_HEARTBEAT_TIMEOUT', 300))
+            if job is None:
+                lost = True
+            elif job.status == 'running':
+                lost = job.heartbeat_at is None or datetime.utcnow() - job.heartbeat_at > stale_after
+            else:
+                lost = False  # Queued behind other jobs
+            
+            if lost:
                 db = get_db()
                 sync_log.status = 'failed'
-                sync_log.error_message = 'Sync timed out after 10 minutes'
+                sync_log.error_message = 'Sync job stopped without finishing'
                 sync_log.completed_at = datetime.utcnow()
                 db.session.commit()
         
@@ -1223,6 +1239,12 @@ class SyncStatusResource(Resource):
             sync_log.error_message = 'Cancelled by user'
             sync_log.completed_at = datetime.utcnow()
             db.session.commit()
+            
+            # Stop the worker running this sync
+            from models.job import BackgroundJob
+            active_job = BackgroundJob.get_active_for('shopify_sync', sync_log_id=sync_log.id)
+            if active_job:
+                job_queue.request_cancel(active_job.id)
             return {'message': 'Sync cancelled successfully'}
         else:
             return {'message': f'Sync is already {sync_log.status}'}
@@ -1777,7 +1799,9 @@ class VectorSchemaResource(Resource):
             return {
                 'schema_exists': len(classes) > 0,
                 'class_count': len(classes),
-                'classes': [cls['class'] for cls in classes]
+                'classes': [cls['class'] for cls in classes],
+                'active_class': weaviate_service.class_name,
+                'building_class': weaviate_service.building_class_name
             }
             
         except Exception as e:
@@ -1820,129 +1844,186 @@ class VectorStatsResource(Resource):
 class VectorReindexResource(Resource):
     def post(self):
         """Start reindexing all products"""
-        from flask import current_app
-        import threading
-        import uuid
+        from models.job import BackgroundJob
         
-        task_id = str(uuid.uuid4())
+        # Only one reindex at a time - hand back the one already in flight
+        active_job = BackgroundJob.get_active('vector_reindex')
+        if active_job:
+            return {'message': 'Reindexing already in progress', 'task_id': active_job.id}, 202
         
-        # Start reindexing in background
-        thread = threading.Thread(
-            target=self._reindex_products,
-            args=(task_id, current_app._get_current_object())
-        )
-        thread.start()
+        # 'rebuild' builds a new class next to the live one and switches over when done;
+        # 'in_place' overwrites objects in the live class
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', 'rebuild')
+        if mode not in ['rebuild', 'in_place']:
+            return {'error': "Invalid mode. Use 'rebuild' or 'in_place'"}, 400
         
-        return {'message': 'Reindexing started', 'task_id': task_id}, 202
+        job = job_queue.enqueue('vector_reindex', {'mode': mode})
+        
+        return {'message': 'Reindexing started', 'task_id': job.id, 'mode': mode}, 202
     
-    def _reindex_products(self, task_id, app):
-        """Background task to reindex all products"""
-        with app.app_context():
-            try:
-                # Store task status in a simple way (could use Redis for production)
-                self._update_task_status(task_id, {
-                    'status': 'running',
-                    'processed': 0,
-                    'total': 0,
-                    'current_operation': 'Starting...',
-                    'log_entries': ['Reindexing started']
-                })
+    def _reindex_products(self, job, batch_size=100):
+        """Background task to reindex all products
+        
+        SKUs are streamed in primary-key order, one batch at a time, and the last
+        committed id is checkpointed after every batch. If the worker dies the job
+        is re-queued and continues after that id instead of starting over.
+        
+        In 'rebuild' mode the products are written to a fresh Product_vN class
+        while searches keep using the live class; the pointer is switched once
+        the new class is complete and the old class is dropped afterwards.
+        """
+        from sqlalchemy.orm import selectinload
+        import time
+        from services.weaviate_service import CLASS_POINTER_TTL
+        
+        db = get_db()
+        SKU, Category, SKUImage, SKUVariant, SyncLog, ProductOption = get_models()
+        weaviate_service, _ = get_services()
+        
+        checkpoint = job.checkpoint
+        last_id = checkpoint.get('last_id', 0)
+        processed = checkpoint.get('processed', 0)
+        failed = checkpoint.get('failed', 0)
+        total = SKU.query.count()
+        
+        rebuild = job.payload.get('mode', 'rebuild') == 'rebuild'
+        target_class = checkpoint.get('target_class')
+        if rebuild and not target_class:
+            target_class = weaviate_service.create_versioned_class()
+            weaviate_service.begin_rebuild(target_class)
+            job.save_checkpoint({'last_id': 0, 'processed': 0, 'failed': 0, 'target_class': target_class})
+            job.update_progress(log=f'Building new index class {target_class}', force=True)
+        
+        # Set once search has switched to target_class; the build loop must not run (or abort) again
+        activated = rebuild and 'previous_class' in checkpoint
+        
+        if job.is_resumed:
+            job.update_progress(processed=processed, total=total, failed=failed,
+                                operation=f'Resuming after product {last_id}...',
+                                log=f'Resuming reindex after product ID {last_id}', force=True)
+        else:
+            job.update_progress(processed=0, total=total, operation=f'Processing {total} products...',
+                                log=f'Found {total} products to index', force=True)
+        
+        sku_query = SKU.query.options(
+            selectinload(SKU.images),
+            selectinload(SKU.variants),
+            selectinload(SKU.options),
+            selectinload(SKU.categories)
+        ).order_by(SKU.id)
+        
+        try:
+            while not activated:
+                job.raise_if_cancelled()
                 
-                db = get_db()
-                SKU, Category, SKUImage, SKUVariant, SyncLog, ProductOption = get_models()
-                weaviate_service, _ = get_services()
+                batch = sku_query.filter(SKU.id > last_id).limit(batch_size).all()
+                if not batch:
+                    break
                 
-                # Get all SKUs
-                skus = SKU.query.all()
-                total = len(skus)
+                processed, failed = self._index_batch(job, batch, target_class, processed, failed, total)
                 
-                self._update_task_status(task_id, {
-                    'status': 'running',
-                    'processed': 0,
-                    'total': total,
-                    'current_operation': f'Processing {total} products...',
-                    'log_entries': [f'Found {total} products to index']
-                })
+                # Commit the batch, then record how far we got
+                last_id = batch[-1].id
+                db.session.commit()
+                job.save_checkpoint({'last_id': last_id, 'processed': processed, 'failed': failed,
+                                     'target_class': target_class})
                 
-                processed = 0
-                failed = 0
+                # Drop the batch from the identity map so memory stays flat
+                db.session.expunge_all()
+        except Exception:
+            # Cancelled or failed (the job is not retried): searches never left the live class,
+            # so discard the partial build and stop mirroring writes into it
+            if rebuild:
+                weaviate_service.abort_rebuild(target_class)
+            raise
+        
+        if rebuild:
+            if activated:
+                previous_class = checkpoint['previous_class']
+            else:
+                if total > 0 and processed == 0:
+                    weaviate_service.abort_rebuild(target_class)
+                    raise Exception(f'No products could be indexed into {target_class}; keeping the current index')
                 
-                for sku in skus:
-                    try:
-                        # Delete existing entry if it exists
-                        if sku.weaviate_id:
-                            try:
-                                weaviate_service.delete_product(sku.weaviate_id)
-                            except:
-                                pass  # Ignore delete errors
-                        
-                        # Add product to Weaviate
-                        weaviate_id = weaviate_service.add_product(sku.to_dict())
-                        
-                        if weaviate_id:
-                            sku.weaviate_id = weaviate_id
-                            db.session.commit()
-                            processed += 1
-                            
-                            self._update_task_status(task_id, {
-                                'status': 'running',
-                                'processed': processed,
-                                'total': total,
-                                'current_operation': f'Indexed: {sku.title[:50]}...',
-                                'log_entries': [f'Successfully indexed: {sku.title}']
-                            })
-                        else:
-                            failed += 1
-                            self._update_task_status(task_id, {
-                                'status': 'running',
-                                'processed': processed,
-                                'total': total,
-                                'current_operation': f'Failed: {sku.title[:50]}...',
-                                'log_entries': [f'Failed to index: {sku.title}']
-                            })
-                    
-                    except Exception as e:
-                        failed += 1
-                        print(f"Error indexing SKU {sku.id}: {e}")
-                        self._update_task_status(task_id, {
-                            'status': 'running',
-                            'processed': processed,
-                            'total': total,
-                            'current_operation': f'Error: {sku.title[:50]}...',
-                            'log_entries': [f'Error indexing {sku.title}: {str(e)}']
-                        })
+                previous_class = weaviate_service.activate_class(target_class)
+                job.save_checkpoint({**job.checkpoint, 'previous_class': previous_class})
+                job.update_progress(operation=f'Switched search to {target_class}',
+                                    log=f'Search switched from {previous_class} to {target_class}', force=True)
+            
+            # Let other processes pick up the new pointer before the old class disappears;
+            # a job resumed after the switch drops the old class if it is still there
+            if previous_class != target_class and previous_class in weaviate_service.list_product_classes():
+                time.sleep(CLASS_POINTER_TTL * 2)
+                weaviate_service.drop_class(previous_class)
+        
+        # Complete
+        job.update_progress(processed=processed, total=total, failed=failed, force=True)
+        job.queue.complete(job.job_id, log=f'Reindexing completed. Processed: {processed}, Failed: {failed}')
+        
+        # Every vector may have changed, so recompute all similar-product lists
+        job.queue.enqueue('vector_neighbors', {'mode': 'full'})
+    
+    def _index_batch(self, job, batch, target_class, processed, failed, total):
+        """Index one batch of SKUs into Weaviate and return updated counters"""
+        weaviate_service, _ = get_services()
+        
+        # Download/resize the whole batch's images on the image pool while we index
+        products = [sku.to_dict() for sku in batch]
+        image_futures = weaviate_service.prefetch_images(products)
+        images = {url: future.result() for url, future in image_futures.items()}
+        
+        # Embed the batch's images together (batched CLIP / OpenAI embedding requests)
+        weaviate_service.prepare_image_embeddings(list(images.values()))
+        
+        for sku, product_data in zip(batch, products):
+            try:
+                image_base64 = None
+                if product_data.get('images'):
+                    image_base64 = images.get(product_data['images'][0]['url'])
                 
-                # Complete
-                self._update_task_status(task_id, {
-                    'status': 'completed',
-                    'processed': processed,
-                    'total': total,
-                    'current_operation': 'Completed',
-                    'log_entries': [f'Reindexing completed. Processed: {processed}, Failed: {failed}']
-                })
+                # add_product replaces the object under the product's UUID
+                weaviate_id = weaviate_service.add_product(product_data, class_name=target_class,
+                                                           image_base64=image_base64)
                 
+                if weaviate_id:
+                    # Objects indexed before deterministic UUIDs are removed once replaced;
+                    # a rebuild drops the whole old class instead
+                    if not target_class and sku.weaviate_id and sku.weaviate_id != weaviate_id:
+                        weaviate_service.delete_product(sku.weaviate_id)
+                    sku.weaviate_id = weaviate_id
+                    processed += 1
+                    
+                    job.update_progress(processed=processed, total=total, failed=failed,
+                                        operation=f'Indexed: {sku.title[:50]}...')
+                else:
+                    failed += 1
+                    job.update_progress(processed=processed, total=total, failed=failed,
+                                        operation=f'Failed: {sku.title[:50]}...',
+                                        log=f'Failed to index: {sku.title}')
+            
             except Exception as e:
-                print(f"Reindexing error: {e}")
-                self._update_task_status(task_id, {
-                    'status': 'failed',
-                    'processed': 0,
-                    'total': 0,
-                    'current_operation': 'Failed',
-                    'error': str(e),
-                    'log_entries': [f'Reindexing failed: {str(e)}']
-                })
-    
-    def _update_task_status(self, task_id, status):
-        """Update task status (simple in-memory storage)"""
-        global _task_statuses
-        _task_statuses[task_id] = status
+                failed += 1
+                print(f"Error indexing SKU {sku.id}: {e}")
+                job.update_progress(processed=processed, total=total, failed=failed,
+                                    operation=f'Error: {sku.title[:50]}...',
+                                    log=f'Error indexing {sku.title}: {str(e)}')
+        
+        return processed, failed
+
+
+@register_job_handler('vector_reindex')
+def run_vector_reindex_job(job):
+    """Job handler: rebuild the Weaviate index from the SKU table"""
+    VectorReindexResource()._reindex_products(job)
+
 
 class VectorReindexStatusResource(Resource):
     def get(self, task_id):
         """Get reindexing status"""
-        global _task_statuses
-        if task_id in _task_statuses:
-            return _task_statuses[task_id]
+        job = job_queue.get(task_id)
+        if job:
+            return job.to_dict()
         else:
             return {
                 'status': 'not_found',
@@ -1954,8 +2035,19 @@ class VectorReindexStatusResource(Resource):
 
 class VectorReindexStopResource(Resource):
     def post(self):
-        """Stop reindexing (placeholder for now)"""
-        return {'message': 'Stop signal sent (background tasks will complete current operations)'}
+        """Stop reindexing - the worker stops before the next product"""
+        from models.job import BackgroundJob
+        
+        data = request.get_json(silent=True) or {}
+        task_id = data.get('task_id')
+        if not task_id:
+            active_job = BackgroundJob.get_active('vector_reindex')
+            task_id = active_job.id if active_job else None
+        
+        if not task_id or not job_queue.request_cancel(task_id):
+            return {'message': 'No running reindex task to stop'}
+        
+        return {'message': 'Stop signal sent', 'task_id': task_id}
 
 class VectorClearResource(Resource):
     def post(self):
@@ -1969,9 +2061,17 @@ class VectorClearResource(Resource):
             SKU.query.update({SKU.weaviate_id: None})
             db.session.commit()
             
-            # Try to delete the schema and recreate it (clears all data)
+            # Stop a rebuild that would otherwise write into a dropped class
+            from models.job import BackgroundJob
+            active_job = BackgroundJob.get_active('vector_reindex')
+            if active_job:
+                job_queue.request_cancel(active_job.id)
+            
+            # Drop only the product classes and start over with an empty base class
             try:
-                weaviate_service.client.schema.delete_all()
+                for class_name in weaviate_service.list_product_classes():
+                    weaviate_service.drop_class(class_name)
+                weaviate_service.reset_class_pointer()
                 weaviate_service.setup_schema()
             except Exception as e:
                 print(f"Error clearing Weaviate schema: {e}")
@@ -1996,13 +2096,9 @@ class CatalogProductsResource(Resource):
             # Search query
             search_query = request.args.get('q', '')
             
-            # Filters
-            categories = request.args.getlist('categories') or request.args.get('categories', '').split(',') if request.args.get('categories') else []
-            vendors = request.args.getlist('vendors') or request.args.get('vendors', '').split(',') if request.args.get('vendors') else []
-            product_types = request.args.getlist('product_types') or request.args.get('product_types', '').split(',') if request.args.get('product_types') else []
-            min_price = request.args.get('min_price', type=float)
-            max_price = request.args.get('max_price', type=float)
-            stock_filter = request.args.get('stock', 'all')  # all, in_stock, out_of_stock
+            # Filters (categories, vendors, product_types, min_price, max_price, stock)
+            filter_spec = ProductFilterSpec.from_request_args(request.args)
+            product_query = ProductQueryEngine()
             
             # Start with base query
             query = SKU.query
@@ -2013,7 +2109,8 @@ class CatalogProductsResource(Resource):
                 # Get vector search results first
                 try:
                     weaviate_service, _ = get_services()
-                    weaviate_results = weaviate_service.search_by_text(search_query, limit=50)  # Get more results for filtering
+                    # Vendor/type/price filters are pushed into the vector search
+                    weaviate_results = product_query.vector_search(weaviate_service, search_query, filter_spec, limit=50)
                     
                     # Extract product IDs from vector search, maintaining order for relevance
                     vector_product_ids = []
@@ -2053,47 +2150,12 @@ class CatalogProductsResource(Resource):
                         )
                     )
             
-            # Apply category filter
-            if categories:
-                categories = [c for c in categories if c]  # Remove empty strings
-                if categories:
-                    query = query.join(SKU.categories).filter(Category.id.in_(categories))
-            
-            # Apply vendor filter
-            if vendors:
-                vendors = [v for v in vendors if v]
-                if vendors:
-                    query = query.filter(SKU.vendor.in_(vendors))
-            
-            # Apply product type filter
-            if product_types:
-                product_types = [pt for pt in product_types if pt]
-                if product_types:
-                    query = query.filter(SKU.product_type.in_(product_types))
-            
-            # Apply price range filter
-            if min_price is not None:
-                query = query.filter(SKU.price >= min_price)
-            if max_price is not None:
-                query = query.filter(SKU.price <= max_price)
-            
-            # Apply stock filter
-            if stock_filter == 'in_stock':
-                query = query.filter(SKU.quantity > 0)
-            elif stock_filter == 'out_of_stock':
-                query = query.filter(SKU.quantity == 0)
+            # Apply category, vendor, product type, price and stock filters
+            query = product_query.apply(query, filter_spec)
             
             # Apply sorting
-            if sort == 'price-low':
-                query = query.order_by(SKU.price.asc())
-            elif sort == 'price-high':
-                query = query.order_by(SKU.price.desc())
-            elif sort == 'name-asc':
-                query = query.order_by(SKU.title.asc())
-            elif sort == 'name-desc':
-                query = query.order_by(SKU.title.desc())
-            elif sort == 'newest':
-                query = query.order_by(SKU.created_at.desc())
+            if sort in SORT_ORDERS:
+                query = product_query.sort(query, sort)
             else:  # relevance (default)
                 if search_query and vector_results:
                     # Use vector search order for relevance - don't apply database sorting
@@ -2112,8 +2174,8 @@ class CatalogProductsResource(Resource):
             
             # Handle pagination and ordering
             if search_query and vector_results and sort == 'relevance':
-                # For vector search with relevance sorting, we need custom ordering
-                all_results = query.all()
+                # For vector search with relevance sorting, order the matching ids here
+                all_ids = [row.id for row in query.with_entities(SKU.id).all()]
                 
                 # Create a mapping of product_id to vector search order/score
                 vector_order = {}
@@ -2125,17 +2187,22 @@ class CatalogProductsResource(Resource):
                             'score': 1 - result.get('_additional', {}).get('distance', 1)
                         }
                 
-                # Sort products by vector search relevance
-                sorted_results = sorted(all_results, key=lambda sku: vector_order.get(sku.id, {}).get('order', 999))
+                # Sort products by vector similarity blended with click-through popularity;
+                # products matched only by the database filters keep coming last
+                popularity = get_popularity_index(current_app._get_current_object())
+                sorted_ids = sorted(all_ids, key=lambda product_id: (
+                    -popularity.blend(product_id, vector_order[product_id]['score']) if product_id in vector_order else 999
+                ))
                 
-                # Apply manual pagination
+                # Apply manual pagination, then load just this page
                 start_idx = (page - 1) * per_page
                 end_idx = start_idx + per_page
-                paginated_results = sorted_results[start_idx:end_idx]
+                page_ids = sorted_ids[start_idx:end_idx]
+                skus = product_query.fetch(page_ids)
                 
                 # Get products with all relationships
                 products = []
-                for sku in paginated_results:
+                for sku in (skus[product_id] for product_id in page_ids if product_id in skus):
                     product_data = sku.to_dict()
                     # Add similarity score from vector search
                     if sku.id in vector_order:
@@ -2144,19 +2211,17 @@ class CatalogProductsResource(Resource):
                     products.append(product_data)
                 
                 # Create pagination info
-                total_results = len(all_results)
+                total_results = len(all_ids)
                 
             else:
                 # Standard pagination for non-vector searches or other sort orders
-                pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+                items, total_results = product_query.paginate(query, page, per_page)
                 
                 # Get products with all relationships
                 products = []
-                for sku in pagination.items:
+                for sku in items:
                     product_data = sku.to_dict()
                     products.append(product_data)
-                
-                total_results = pagination.total
             
             return {
                 'products': products,
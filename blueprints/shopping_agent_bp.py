@@ -3,14 +3,17 @@ Shopping Agent Blueprint
 Handles chat interface and API endpoints for the shopping assistant
 """
 
-from flask import Blueprint, request, jsonify, render_template, session
+from flask import Blueprint, request, jsonify, render_template, session, current_app, Response, stream_with_context
 from flask_restful import Api, Resource
-import asyncio
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import base64
 
+# Register the analytics_rollup and product_cooccurrence job handlers and schedules
+import services.analytics_rollup
+import services.recommendations
+
 shopping_agent_bp = Blueprint('shopping_agent', __name__)
 api = Api(shopping_agent_bp)
 
@@ -102,6 +105,89 @@ def agent_settings():
     return render_template('agent_settings.html')
 
 
+def get_write_buffer():
+    """Write-behind buffer for conversation, interaction and analytics rows"""
+    from shopping_agent.write_buffer import get_write_buffer as _get_write_buffer
+    return _get_write_buffer(current_app._get_current_object())
+
+
+def save_chat_turn(session_id, message, image_data, response):
+    """Queue a user message and the agent's response, with product impressions and analytics"""
+    buffer = get_write_buffer()
+    buffer.add_chat_turn(session_id, message, image_data, response)
+    
+    # Log response analytics
+    buffer.log_event(session_id, 'message_received', {
+        'products_count': len(response.get('products', [])),
+        'has_suggestions': bool(response.get('suggestions'))
+    })
+
+
+def _sse_event(event_type, data):
+    """Format one server-sent event"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+@shopping_agent_bp.route('/api/agent/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat over server-sent events: status, products, text, suggestions, then done"""
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    session_id = data.get('session_id', str(uuid.uuid4()))
+    image_data = data.get('image')  # Base64 encoded image
+    
+    agent = get_or_create_agent()
+    if not agent:
+        return jsonify({
+            'success': False,
+            'error': 'Shopping assistant dependencies not available. The required modules (adk, mcp) are not installed or configured properly.',
+            'response': 'I apologize, but I\'m not properly set up yet. The shopping assistant requires additional dependencies to be installed. Please contact your administrator.'
+        }), 503
+    
+    get_write_buffer().log_event(session_id, 'message_sent', {
+        'has_image': bool(image_data),
+        'message_length': len(message),
+        'streaming': True
+    })
+    
+    app = current_app._get_current_object()
+    
+    def generate():
+        from shopping_agent.runtime import iterate_agent_stream
+        
+        response = None
+        try:
+            events = iterate_agent_stream(
+                agent.process_message_stream(message=message, session_id=session_id, image_data=image_data),
+                app=app
+            )
+            for event in events:
+                if event['type'] == 'done':
+                    response = event['response']
+                    yield _sse_event('done', response)
+                else:
+                    yield _sse_event(event['type'], {k: v for k, v in event.items() if k != 'type'})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield _sse_event('done', {
+                'success': False,
+                'error': str(e),
+                'response': 'I apologize, but I encountered an error. Please try again.'
+            })
+        
+        # Persist after the shopper already has the full answer
+        if response:
+            try:
+                save_chat_turn(session_id, message, image_data, response)
+            except Exception as e:
+                print(f"Error saving streamed chat turn: {e}")
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 # API Resources
 class ChatResource(Resource):
     def post(self):
@@ -121,71 +207,27 @@ class ChatResource(Resource):
             }, 503
         
         # Log analytics event
-        AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics = get_models()
-        AgentAnalytics.log_event(session_id, 'message_sent', {
+        get_write_buffer().log_event(session_id, 'message_sent', {
             'has_image': bool(image_data),
             'message_length': len(message)
         })
         
-        # Process message asynchronously
+        # Process message on the shared agent event loop
         try:
             print(f"Processing message: {message}")
-            # Run async function in sync context
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            from shopping_agent.runtime import run_agent_coroutine
             
-            response = loop.run_until_complete(
+            response = run_agent_coroutine(
                 agent.process_message(
                     message=message,
                     session_id=session_id,
                     image_data=image_data
-                )
+                ),
+                app=current_app._get_current_object()
             )
             print(f"Agent response: {response}")
             
-            # Save conversation to database
-            db = get_db()
-            
-            # Save user message
-            user_msg = AgentConversation(
-                session_id=session_id,
-                role='user',
-                content=message,
-                message_metadata=json.dumps({'has_image': bool(image_data)})
-            )
-            db.session.add(user_msg)
-            
-            # Save assistant response
-            assistant_msg = AgentConversation(
-                session_id=session_id,
-                role='assistant',
-                content=response['response'],
-                message_metadata=json.dumps({
-                    'products_shown': len(response.get('products', [])),
-                    'products': response.get('products', []),  # Store complete product data
-                    'suggestions': response.get('suggestions', [])
-                })
-            )
-            db.session.add(assistant_msg)
-            db.session.commit()
-            
-            # Track product interactions
-            for idx, product in enumerate(response.get('products', [])):
-                interaction = AgentProductInteraction(
-                    conversation_id=assistant_msg.id,
-                    product_id=product.get('id'),
-                    interaction_type='shown',
-                    position=idx + 1
-                )
-                db.session.add(interaction)
-            
-            db.session.commit()
-            
-            # Log response analytics
-            AgentAnalytics.log_event(session_id, 'message_received', {
-                'products_count': len(response.get('products', [])),
-                'has_suggestions': bool(response.get('suggestions'))
-            })
+            save_chat_turn(session_id, message, image_data, response)
             
             return response
             
@@ -196,8 +238,6 @@ class ChatResource(Resource):
                 'error': str(e),
                 'response': 'I apologize, but I encountered an error. Please try again.'
             }, 500
-        finally:
-            loop.close()
 
 
 class ImageUploadResource(Resource):
@@ -226,16 +266,25 @@ class ImageUploadResource(Resource):
 
 class ConversationHistoryResource(Resource):
     def get(self, session_id):
-        """Get conversation history"""
+        """Get conversation history, newest page first; pass next_cursor as ?before= for older messages"""
         AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics = get_models()
+        limit = min(request.args.get('limit', 50, type=int), 200)
+        before = request.args.get('before')
+        
+        # Write any buffered turns first so the history is complete
+        get_write_buffer().flush()
         
         # Get history from database
-        history = AgentConversation.get_session_history(session_id)
+        try:
+            history, next_cursor = AgentConversation.get_history_page(session_id, limit, before)
+        except ValueError:
+            return {'success': False, 'error': 'Invalid cursor'}, 400
         
         return {
             'success': True,
             'session_id': session_id,
-            'messages': [msg.to_dict() for msg in reversed(history)]
+            'messages': AgentConversation.to_dicts(history),
+            'next_cursor': next_cursor
         }
     
     def delete(self, session_id):
@@ -243,7 +292,8 @@ class ConversationHistoryResource(Resource):
         db = get_db()
         AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics = get_models()
         
-        # Delete conversations
+        # Delete conversations (including any still buffered)
+        get_write_buffer().flush()
         AgentConversation.query.filter_by(session_id=session_id).delete()
         db.session.commit()
         
@@ -312,6 +362,8 @@ class AgentConfigResource(Resource):
         
         # Reset agent instance to force recreation with new config
         _agent_instance = None
+        from shopping_agent.llm_providers import get_provider_pool
+        get_provider_pool().invalidate()
         
         return {
             'success': True,
@@ -338,26 +390,79 @@ class AgentModelsResource(Resource):
         }
 
 
+class AgentSessionStatsResource(Resource):
+    def get(self):
+        """Memory usage of the agent's in-memory conversation sessions"""
+        if _agent_instance is None:
+            return {'success': True, 'stats': None}
+        
+        return {
+            'success': True,
+            'stats': _agent_instance.conversation_manager.stats()
+        }
+
+
+class AgentAnalyticsResource(Resource):
+    def get(self):
+        """Rolled-up agent analytics: activity per bucket, top products and CTR by position"""
+        from models.analytics import AgentAnalyticsRollup, AgentProductRollup
+        
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ('hour', 'day'):
+            return {'success': False, 'error': "granularity must be 'hour' or 'day'"}, 400
+        days = min(request.args.get('days', 7, type=int), 365)
+        since = datetime.utcnow() - timedelta(days=days)
+        db = get_db()
+        
+        buckets = AgentAnalyticsRollup.query.filter(
+            AgentAnalyticsRollup.granularity == granularity,
+            AgentAnalyticsRollup.bucket_start >= since
+        ).order_by(AgentAnalyticsRollup.bucket_start).all()
+        
+        product_filter = (AgentProductRollup.granularity == granularity, AgentProductRollup.bucket_start >= since)
+        impressions = db.func.sum(AgentProductRollup.impressions)
+        clicks = db.func.sum(AgentProductRollup.clicks)
+        top_products = db.session.query(AgentProductRollup.product_id, impressions, clicks)\
+            .filter(*product_filter)\
+            .group_by(AgentProductRollup.product_id)\
+            .order_by(clicks.desc(), impressions.desc())\
+            .limit(20).all()
+        positions = db.session.query(AgentProductRollup.position, impressions, clicks)\
+            .filter(*product_filter)\
+            .group_by(AgentProductRollup.position)\
+            .order_by(AgentProductRollup.position).all()
+        
+        return {
+            'success': True,
+            'granularity': granularity,
+            'buckets': [bucket.to_dict() for bucket in buckets],
+            'top_products': [{
+                'product_id': product_id, 'impressions': shown or 0, 'clicks': clicked or 0
+            } for product_id, shown, clicked in top_products],
+            'positions': [{
+                'position': position, 'impressions': shown or 0, 'clicks': clicked or 0,
+                'ctr': round((clicked or 0) / shown, 4) if shown else None
+            } for position, shown, clicked in positions]
+        }
+
+
 class ProductClickResource(Resource):
     def post(self):
         """Track product clicks/interactions"""
         data = request.get_json()
-        db = get_db()
-        AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics = get_models()
+        buffer = get_write_buffer()
         
         # Log the interaction
         if 'conversation_id' in data:
-            interaction = AgentProductInteraction(
+            buffer.add_interaction(
                 conversation_id=data['conversation_id'],
                 product_id=data['product_id'],
                 interaction_type='clicked',
                 position=data.get('position', 0)
             )
-            db.session.add(interaction)
-            db.session.commit()
         
         # Log analytics
-        AgentAnalytics.log_event(
+        buffer.log_event(
             session_id=data.get('session_id', 'unknown'),
             event_type='product_click',
             event_data={
@@ -375,4 +480,6 @@ api.add_resource(ImageUploadResource, '/api/agent/upload')
 api.add_resource(ConversationHistoryResource, '/api/agent/history/<string:session_id>')
 api.add_resource(AgentConfigResource, '/api/agent/config')
 api.add_resource(AgentModelsResource, '/api/agent/models')
-api.add_resource(ProductClickResource, '/api/agent/product-click')
\ No newline at end of file
+api.add_resource(ProductClickResource, '/api/agent/product-click')
+api.add_resource(AgentSessionStatsResource, '/api/agent/sessions/stats')
+api.add_resource(AgentAnalyticsResource, '/api/agent/analytics')
\ No newline at end of file
@@ -30,4 +30,10 @@ class Config:
     API_VERSION = 'v1'
     
     # Pagination
-    ITEMS_PER_PAGE = 20
\ No newline at end of file
+    ITEMS_PER_PAGE = 20
+    
+    # Background jobs
+    JOB_WORKER_EMBEDDED = os.environ.get('JOB_WORKER_EMBEDDED', 'true').lower() == 'true'
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))
+    JOB_HEARTBEAT_TIMEOUT = int(os.environ.get('JOB_HEARTBEAT_TIMEOUT', 300))  # seconds before a silent job is re-queued
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the (session_id, created_at) index to agent_conversations
+"""
+
+from sqlalchemy import text
+from database import db
+from ai_ecomm import create_app
+import sys
+
+def migrate_conversation_indexes():
+    """Create the composite history index and drop the session_id index it replaces"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_agent_conversations_session_created "
+                "ON agent_conversations (session_id, created_at)"
+            ))
+            print("✅ Index ix_agent_conversations_session_created is present")
+
+            # The composite index covers lookups by session_id alone
+            db.session.execute(text("DROP INDEX IF EXISTS ix_agent_conversations_session_id"))
+            print("✅ Dropped redundant index ix_agent_conversations_session_id")
+
+            db.session.execute(text("ANALYZE agent_conversations"))
+            db.session.commit()
+
+            # Verify the changes
+            print("\n📊 Current agent_conversations indexes:")
+            result = db.session.execute(text("PRAGMA index_list(agent_conversations)"))
+            for row in result:
+                print(f"  - {row[1]}")
+
+            print("\n✅ Migration completed successfully!")
+
+        except Exception as e:
+            print(f"\n❌ Migration failed: {e}")
+            db.session.rollback()
+            sys.exit(1)
+
+if __name__ == "__main__":
+    print("🔄 Starting agent_conversations index migration...\n")
+    migrate_conversation_indexes()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Migration script to replace stored product payloads in agent conversation
+metadata with compact product references
+"""
+
+import json
+import sys
+
+from sqlalchemy import text
+from database import db
+from ai_ecomm import create_app
+from models.agent import AgentConversation
+
+
+def migrate_conversation_metadata(batch_size=500):
+    """Rewrite assistant messages that still store full product dicts"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            converted = 0
+            last_id = 0
+            while True:
+                rows = AgentConversation.query.filter(
+                    AgentConversation.id > last_id,
+                    AgentConversation.role == 'assistant',
+                    AgentConversation.message_metadata.like('%"products": [%')
+                ).order_by(AgentConversation.id).limit(batch_size).all()
+                if not rows:
+                    break
+
+                for row in rows:
+                    metadata = json.loads(row.message_metadata)
+                    products = metadata.pop('products', None)
+                    if products is not None:
+                        metadata['product_refs'] = AgentConversation.product_refs(products)
+                        row.message_metadata = json.dumps(metadata)
+                        converted += 1
+                last_id = rows[-1].id
+                db.session.commit()
+                print(f"Converted {converted} messages so far...")
+
+            print(f"\n✅ Converted {converted} messages to product references")
+
+            # Reclaim the space freed by the smaller rows
+            db.session.close()
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+            print("✅ Database vacuumed")
+
+        except Exception as e:
+            print(f"\n❌ Migration failed: {e}")
+            db.session.rollback()
+            sys.exit(1)
+
+if __name__ == "__main__":
+    print("🔄 Starting conversation metadata migration...\n")
+    migrate_conversation_metadata()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Migration script for co-occurrence recommendations: creates the product_cooccurrences,
+cooccurrence_sessions and product_neighbor_lists tables, indexes agent_product_interactions
+by conversation and backfills the folded session state of an existing matrix
+"""
+
+from sqlalchemy import text
+from database import db
+from ai_ecomm import create_app
+from services.recommendations import backfill_sessions
+import sys
+
+def migrate_product_recommendations():
+    """Create the recommendation tables and the interaction conversation index"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            # create_app() already ran db.create_all(), which creates the new tables
+            print("✅ Tables product_cooccurrences, cooccurrence_sessions and product_neighbor_lists are present")
+
+            # Sessions' interactions are looked up through their conversations
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_agent_product_interactions_conversation_id "
+                "ON agent_product_interactions (conversation_id)"
+            ))
+            print("✅ Index ix_agent_product_interactions_conversation_id is present")
+
+            db.session.execute(text("ANALYZE agent_product_interactions"))
+            db.session.commit()
+
+            # A matrix built before cooccurrence_sessions existed needs each session's folded items
+            backfilled = backfill_sessions()
+            print(f"✅ Backfilled folded items for {backfilled} sessions")
+
+            # Verify the changes
+            print("\n📊 Current agent_product_interactions indexes:")
+            result = db.session.execute(text("PRAGMA index_list(agent_product_interactions)"))
+            for row in result:
+                print(f"  - {row[1]}")
+
+            print("\n✅ Migration completed successfully!")
+            print("ℹ️  The product_cooccurrence job backfills the matrix from existing interactions on its next run")
+
+        except Exception as e:
+            print(f"\n❌ Migration failed: {e}")
+            db.session.rollback()
+            sys.exit(1)
+
+if __name__ == "__main__":
+    print("🔄 Starting product recommendations migration...\n")
+    migrate_product_recommendations()
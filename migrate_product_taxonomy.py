@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Migration script to add canonical_product_type to skus and backfill it from the product type taxonomy
+"""
+
+from sqlalchemy import text
+from database import db
+from ai_ecomm import create_app
+from services.product_taxonomy import canonical_product_type
+import sys
+
+BATCH_SIZE = 1000
+
+def migrate_product_taxonomy():
+    """Add the indexed canonical_product_type column and fill it for existing SKUs"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            result = db.session.execute(text("PRAGMA table_info(skus)"))
+            columns = [row[1] for row in result]
+
+            if 'canonical_product_type' not in columns:
+                db.session.execute(text("ALTER TABLE skus ADD COLUMN canonical_product_type VARCHAR(50)"))
+                print("✅ Added canonical_product_type column")
+            else:
+                print("ℹ️  canonical_product_type column already exists")
+
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_skus_canonical_product_type ON skus (canonical_product_type)"
+            ))
+            print("✅ Index ix_skus_canonical_product_type is present")
+
+            # Backfill every SKU, so taxonomy changes are picked up by re-running the script
+            last_id, updated, typed = 0, 0, 0
+            while True:
+                rows = db.session.execute(text(
+                    "SELECT id, product_type, title, tags FROM skus WHERE id > :last_id ORDER BY id LIMIT :limit"
+                ), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+                if not rows:
+                    break
+
+                values = [{"id": row[0], "canonical": canonical_product_type(row[1], row[2], row[3])} for row in rows]
+                db.session.execute(text("UPDATE skus SET canonical_product_type = :canonical WHERE id = :id"), values)
+                db.session.commit()
+
+                last_id = rows[-1][0]
+                updated += len(values)
+                typed += sum(1 for value in values if value["canonical"])
+                print(f"  - Backfilled {updated} SKUs")
+
+            db.session.execute(text("ANALYZE skus"))
+            db.session.commit()
+
+            # Verify the changes
+            print("\n📊 SKUs per canonical product type:")
+            result = db.session.execute(text(
+                "SELECT COALESCE(canonical_product_type, '(none)'), COUNT(*) FROM skus "
+                "GROUP BY canonical_product_type ORDER BY COUNT(*) DESC"
+            ))
+            for row in result:
+                print(f"  - {row[0]}: {row[1]}")
+
+            print(f"\n✅ Migration completed successfully! {typed} of {updated} SKUs have a canonical type")
+
+        except Exception as e:
+            print(f"\n❌ Migration failed: {e}")
+            db.session.rollback()
+            sys.exit(1)
+
+if __name__ == "__main__":
+    print("🔄 Starting product taxonomy migration...\n")
+    migrate_product_taxonomy()
@@ -2,6 +2,13 @@ from .category import Category
 from .sku import SKU, SKUImage, SKUVariant
 from .sync_log import SyncLog
 from .agent import AgentConfig, AgentConversation, AgentProductInteraction, AgentAnalytics
+from .job import BackgroundJob
+from .image_embedding import ImageEmbedding
+from .analytics import AgentAnalyticsRollup, AgentProductRollup, AnalyticsWatermark
+from .recommendation import ProductCooccurrence, CooccurrenceSession, ProductNeighborList
 
 __all__ = ['Category', 'SKU', 'SKUImage', 'SKUVariant', 'SyncLog', 
-           'AgentConfig', 'AgentConversation', 'AgentProductInteraction', 'AgentAnalytics']
\ No newline at end of file
+           'AgentConfig', 'AgentConversation', 'AgentProductInteraction', 'AgentAnalytics',
+           'BackgroundJob', 'ImageEmbedding',
+           'AgentAnalyticsRollup', 'AgentProductRollup', 'AnalyticsWatermark',
+           'ProductCooccurrence', 'CooccurrenceSession', 'ProductNeighborList']
\ No newline at end of file
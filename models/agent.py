@@ -49,9 +49,13 @@ class AgentConfig(db.Model):
 class AgentConversation(db.Model):
     """Store conversation history"""
     __tablename__ = 'agent_conversations'
+    __table_args__ = (
+        # Serves "messages of a session in time order" without a sort step
+        db.Index('ix_agent_conversations_session_created', 'session_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(255), nullable=False, index=True)
+    session_id = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # user, assistant, system
     content = db.Column(db.Text, nullable=False)
     message_metadata = db.Column(db.Text)  # JSON string
@@ -71,13 +75,91 @@ class AgentConversation(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
     
+    @staticmethod
+    def product_refs(products):
+        """Compact references stored instead of full product payloads"""
+        refs = []
+        for rank, product in enumerate(products, start=1):
+            if product.get('id') is None:
+                continue
+            ref = {'id': product['id'], 'rank': rank}
+            if product.get('score') is not None:
+                ref['score'] = product['score']
+            refs.append(ref)
+        return refs
+    
+    @classmethod
+    def to_dicts(cls, messages):
+        """Serialize messages, hydrating product references with one batched SKU lookup"""
+        from models.sku import SKU
+        from sqlalchemy.orm import selectinload
+        
+        dicts = [msg.to_dict() for msg in messages]
+        ids = {ref['id'] for d in dicts for ref in d['metadata'].get('product_refs', [])}
+        if not ids:
+            return dicts
+        
+        skus = SKU.query.options(selectinload(SKU.images)).filter(SKU.id.in_(ids)).all()
+        by_id = {sku.id: sku for sku in skus}
+        
+        for d in dicts:
+            refs = d['metadata'].pop('product_refs', None)
+            if refs is None:
+                continue  # Older rows store full product data
+            products = []
+            for ref in sorted(refs, key=lambda r: r['rank']):
+                sku = by_id.get(ref['id'])
+                if sku is None:
+                    continue  # Product deleted since the message was stored
+                products.append({
+                    'id': sku.id,
+                    'title': sku.title,
+                    'description': sku.description,
+                    'price': float(sku.price) if sku.price else None,
+                    'vendor': sku.vendor,
+                    'quantity': sku.quantity,
+                    'images': [{'url': img.url} for img in sorted(sku.images, key=lambda img: img.position or 0)],
+                    'score': ref.get('score')
+                })
+            d['metadata']['products'] = products
+        return dicts
+    
     @classmethod
-    def get_session_history(cls, session_id, limit=50):
-        """Get conversation history for a session"""
-        return cls.query.filter_by(session_id=session_id)\
-                       .order_by(cls.created_at.desc())\
-                       .limit(limit)\
-                       .all()
+    def get_session_history(cls, session_id, limit=50, before=None):
+        """Get the last ``limit`` messages of a session, oldest first
+        
+        ``before`` is a cursor from get_history_page; only older messages are returned.
+        """
+        return cls.get_history_page(session_id, limit, before)[0]
+    
+    @classmethod
+    def get_history_page(cls, session_id, limit=50, before=None):
+        """Return (messages oldest first, cursor for the previous page or None)
+        
+        Walks the (session_id, created_at) index backwards and fetches one extra
+        row to tell whether older messages exist, so no COUNT query is needed.
+        """
+        query = cls.query.filter(cls.session_id == session_id)
+        
+        if before:
+            created_at, message_id = cls._parse_cursor(before)
+            query = query.filter(db.or_(
+                cls.created_at < created_at,
+                db.and_(cls.created_at == created_at, cls.id < message_id)
+            ))
+        
+        rows = query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        
+        cursor = f"{rows[0].created_at.isoformat()}_{rows[0].id}" if has_more else None
+        return rows, cursor
+    
+    @staticmethod
+    def _parse_cursor(cursor):
+        created_at, message_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
 
 
 class AgentProductInteraction(db.Model):
@@ -85,7 +167,7 @@ class AgentProductInteraction(db.Model):
     __tablename__ = 'agent_product_interactions'
     
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('agent_conversations.id'))
+    conversation_id = db.Column(db.Integer, db.ForeignKey('agent_conversations.id'), index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('skus.id'))
     interaction_type = db.Column(db.String(50))  # shown, clicked, compared, etc.
     position = db.Column(db.Integer)  # Position in results
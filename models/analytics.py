@@ -0,0 +1,107 @@
+"""
+Pre-aggregated shopping agent analytics
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from datetime import datetime
+
+
+class AgentAnalyticsRollup(db.Model):
+    """Agent activity per hour or day, aggregated from agent_analytics and agent_product_interactions"""
+    __tablename__ = 'agent_analytics_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', name='uq_agent_analytics_rollup_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    messages = db.Column(db.Integer, default=0)  # message_sent events
+    image_messages = db.Column(db.Integer, default=0)
+    searches = db.Column(db.Integer, default=0)  # message_received events (one per answered turn)
+    zero_result_searches = db.Column(db.Integer, default=0)
+    impressions = db.Column(db.Integer, default=0)  # products shown
+    clicks = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'granularity': self.granularity,
+            'bucket_start': self.bucket_start.isoformat(),
+            'messages': self.messages or 0,
+            'image_messages': self.image_messages or 0,
+            'searches': self.searches or 0,
+            'zero_result_searches': self.zero_result_searches or 0,
+            'zero_result_rate': round((self.zero_result_searches or 0) / self.searches, 4) if self.searches else None,
+            'impressions': self.impressions or 0,
+            'clicks': self.clicks or 0
+        }
+
+
+class AgentProductRollup(db.Model):
+    """Impressions and clicks per product and result position, per hour or day"""
+    __tablename__ = 'agent_product_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'product_id', 'position',
+                            name='uq_agent_product_rollup_bucket'),
+        db.Index('ix_agent_product_rollups_product', 'product_id', 'granularity', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    impressions = db.Column(db.Integer, default=0)
+    clicks = db.Column(db.Integer, default=0)
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'granularity': self.granularity,
+            'bucket_start': self.bucket_start.isoformat(),
+            'product_id': self.product_id,
+            'position': self.position,
+            'impressions': self.impressions or 0,
+            'clicks': self.clicks or 0
+        }
+
+
+class AnalyticsWatermark(db.Model):
+    """Highest raw event id already folded into the rollups, per source table"""
+    __tablename__ = 'analytics_watermarks'
+
+    source = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def get_last_id(cls, source):
+        """Get the high-water mark for a source (0 if nothing was rolled up yet)"""
+        watermark = db.session.get(cls, source)
+        return watermark.last_id if watermark else 0
+
+    @classmethod
+    def advance(cls, source, from_id, to_id):
+        """Move a high-water mark from from_id to to_id in the current transaction
+
+        Conditional on the mark still being at from_id, so of two runs that
+        read the same mark only the first moves it; False means another run
+        got there first and the caller must roll back its batch.
+        """
+        updated = cls.query.filter(cls.source == source, cls.last_id == from_id).update(
+            {cls.last_id: to_id, cls.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        if updated:
+            return True
+        if from_id != 0 or db.session.query(cls.source).filter(cls.source == source).first() is not None:
+            return False
+        try:
+            db.session.add(cls(source=source, last_id=to_id))
+            db.session.flush()
+        except IntegrityError:
+            return False
+        return True
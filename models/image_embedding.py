@@ -0,0 +1,36 @@
+"""
+Cached image descriptions and embeddings
+"""
+
+from database import db
+from datetime import datetime
+import json
+
+
+class ImageEmbedding(db.Model):
+    """Embedding of one image (by content hash) produced by one model version"""
+    __tablename__ = 'image_embeddings'
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'model_version', name='uq_image_embedding_hash_model'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the preprocessed JPEG bytes
+    model_version = db.Column(db.String(100), nullable=False)  # ImageEmbeddingBackend.model_version
+    description = db.Column(db.Text)  # Only set by description-based backends
+    embedding = db.Column(db.Text, nullable=False)  # JSON array of floats
+    dimensions = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_result(self):
+        """Convert to the dict shape returned by image embedding backends"""
+        return {
+            'embedding': json.loads(self.embedding),
+            'description': self.description,
+            'embedding_model': self.model_version
+        }
+
+    @classmethod
+    def lookup(cls, content_hash, model_version):
+        """Get the cached embedding for an image and model, if any"""
+        return cls.query.filter_by(content_hash=content_hash, model_version=model_version).first()
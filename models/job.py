@@ -0,0 +1,88 @@
+"""
+Database-backed background job queue
+"""
+
+from database import db
+from datetime import datetime
+import json
+
+
+class BackgroundJob(db.Model):
+    """A unit of background work (sync, reindex, ...) claimed by a job worker"""
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.String(36), primary_key=True)  # UUID, exposed to clients as task_id
+    job_type = db.Column(db.String(50), nullable=False, index=True)  # shopify_sync, vector_reindex, ...
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed, cancelled
+    payload = db.Column(db.Text)  # JSON arguments for the handler
+
+    # Progress reporting
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    current_operation = db.Column(db.String(255))
+    log_entries = db.Column(db.Text)  # JSON array of the latest log lines
+    error = db.Column(db.Text)
+
+    # Resumability - handlers store whatever they need to continue after a restart
+    checkpoint = db.Column(db.Text)  # JSON object
+    attempts = db.Column(db.Integer, default=0)
+
+    # Coordination between API and workers
+    cancel_requested = db.Column(db.Boolean, default=False)
+    worker_id = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+
+    def get_payload(self):
+        """Decode the JSON payload"""
+        return json.loads(self.payload) if self.payload else {}
+
+    def get_checkpoint(self):
+        """Decode the JSON checkpoint"""
+        return json.loads(self.checkpoint) if self.checkpoint else {}
+
+    def to_dict(self):
+        """Convert to dictionary (shape matches the legacy reindex status payload)"""
+        return {
+            'task_id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'processed': self.processed or 0,
+            'failed': self.failed or 0,
+            'total': self.total or 0,
+            'current_operation': self.current_operation,
+            'log_entries': json.loads(self.log_entries) if self.log_entries else [],
+            'error': self.error,
+            'checkpoint': self.get_checkpoint(),
+            'attempts': self.attempts or 0,
+            'cancel_requested': bool(self.cancel_requested),
+            'worker_id': self.worker_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+    @classmethod
+    def get_active(cls, job_type):
+        """Get the queued or running job of a given type, if any"""
+        return cls.query.filter(
+            cls.job_type == job_type,
+            cls.status.in_(['queued', 'running'])
+        ).order_by(cls.created_at.desc()).first()
+
+    @classmethod
+    def get_active_for(cls, job_type, **payload):
+        """Get the queued or running job of a given type whose payload has the given values"""
+        jobs = cls.query.filter(
+            cls.job_type == job_type,
+            cls.status.in_(['queued', 'running'])
+        ).order_by(cls.created_at.desc()).all()
+        for job in jobs:
+            job_payload = job.get_payload()
+            if all(job_payload.get(key) == value for key, value in payload.items()):
+                return job
+        return None
@@ -0,0 +1,63 @@
+"""
+Precomputed product-to-product recommendations
+"""
+
+import json
+from database import db
+from datetime import datetime
+
+
+class ProductCooccurrence(db.Model):
+    """Weighted count of agent sessions in which two products were both shown or clicked
+
+    Stored in both directions (product_id, other_id) and (other_id, product_id);
+    the diagonal row (product_id == other_id) holds the product's own total.
+    """
+    __tablename__ = 'product_cooccurrences'
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    weight = db.Column(db.Float, nullable=False, default=0)
+
+
+class CooccurrenceSession(db.Model):
+    """Product weights of an agent session as last folded into product_cooccurrences
+
+    Kept so a returning session is diffed against what the matrix already
+    holds, even after its raw interactions have been compacted away.
+    """
+    __tablename__ = 'cooccurrence_sessions'
+
+    session_id = db.Column(db.String(255), primary_key=True)
+    items = db.Column(db.Text, nullable=False, default='{}')  # JSON {product_id: weight} in first-seen order
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def get_items(self):
+        """Items as an ordered {product_id: weight} dict"""
+        return {int(product_id): weight for product_id, weight in json.loads(self.items or '{}').items()}
+
+    def set_items(self, items):
+        self.items = json.dumps(items)
+
+
+class ProductNeighborList(db.Model):
+    """Top-k neighbours of a product for one recommendation source, ready to serve"""
+    __tablename__ = 'product_neighbor_lists'
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    source = db.Column(db.String(20), primary_key=True)  # cooccurrence, vector
+    neighbors = db.Column(db.Text, nullable=False, default='[]')  # JSON [[product_id, score], ...] best first
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def get_neighbors(self):
+        """Neighbours as a list of (product_id, score) tuples"""
+        return [tuple(pair) for pair in json.loads(self.neighbors or '[]')]
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'product_id': self.product_id,
+            'source': self.source,
+            'neighbors': [{'product_id': product_id, 'score': score} for product_id, score in self.get_neighbors()],
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -1,6 +1,7 @@
 from datetime import datetime
 from database import db
-from sqlalchemy import Numeric
+from sqlalchemy import Numeric, event
+from services.product_taxonomy import canonical_product_type
 
 class SKU(db.Model):
     __tablename__ = 'skus'
@@ -13,6 +14,7 @@ class SKU(db.Model):
     body_html = db.Column(db.Text)
     vendor = db.Column(db.String(255))
     product_type = db.Column(db.String(255))
+    canonical_product_type = db.Column(db.String(50), index=True)  # Set on write from the taxonomy
     tags = db.Column(db.Text)  # Comma-separated tags
     status = db.Column(db.String(50), default='active')  # active, archived, draft
     
@@ -67,6 +69,7 @@ class SKU(db.Model):
             'body_html': self.body_html,
             'vendor': self.vendor,
             'product_type': self.product_type,
+            'canonical_product_type': self.canonical_product_type,
             'tags': self.tags.split(',') if self.tags else [],
             'status': self.status,
             'price': float(self.price) if self.price else None,
@@ -97,6 +100,13 @@ class SKU(db.Model):
         }
 
 
+@event.listens_for(SKU, 'before_insert')
+@event.listens_for(SKU, 'before_update')
+def _set_canonical_product_type(mapper, connection, target):
+    """Keep canonical_product_type in step with product_type, title and tags"""
+    target.canonical_product_type = canonical_product_type(target.product_type, target.title, target.tags)
+
+
 class SKUImage(db.Model):
     __tablename__ = 'sku_images'
     
@@ -16,10 +16,10 @@ def reindex_all_products_with_images():
         print("Initializing Weaviate service...")
         weaviate_service = WeaviateService()
         
-        # Check if OpenAI is configured
-        if not weaviate_service.openai_service or not weaviate_service.openai_service.is_configured():
-            print("WARNING: OpenAI is not configured. Image embeddings will not be generated.")
-            print("Please configure OpenAI API key in the vector configuration page.")
+        # Check the image embedding backend (local CLIP, or OpenAI when selected)
+        if not weaviate_service.image_embedder.is_available():
+            print(f"WARNING: Image embedding backend '{weaviate_service.image_embedder.name}' is not available. Image embeddings will not be generated.")
+            print("Install sentence-transformers for CLIP, or configure an OpenAI API key for the OpenAI backend.")
             return
         
         # Get all SKUs
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Run dedicated background job workers (Shopify sync, vector reindex, ...)
+
+Jobs are stored in the application database, so any number of worker
+processes - on this host or others sharing the database - can process them.
+Set JOB_WORKER_EMBEDDED=false on the web processes when running these.
+
+Usage:
+    python run_job_worker.py              # one worker process
+    python run_job_worker.py --workers 4  # four worker processes
+"""
+
+import argparse
+import multiprocessing
+import signal
+import sys
+from pathlib import Path
+
+# Add the current directory to Python path
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir))
+
+
+def run_worker(job_types=None):
+    """Run a single worker loop until interrupted"""
+    from ai_ecomm import create_app
+    from services.job_queue import JobWorker
+
+    app = create_app()
+    worker = JobWorker(app, job_types=job_types, poll_interval=app.config.get('JOB_POLL_INTERVAL', 2.0))
+
+    def handle_signal(signum, frame):
+        print(f"[JOBS] Signal {signum} received, finishing current job...")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    worker.run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background job workers')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--job-types', nargs='*', help='Only process these job types')
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args.job_types)
+        return
+
+    processes = []
+    for _ in range(args.workers):
+        process = multiprocessing.Process(target=run_worker, args=(args.job_types,))
+        process.start()
+        processes.append(process)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Incremental rollups of shopping agent analytics
+
+Raw agent_analytics events and agent_product_interactions rows are folded
+into hourly and daily rollup tables. Each source table has a high-water mark
+(the last raw id aggregated), advanced in the same transaction as the rollup
+counters and only if it still holds the value the batch was read at, so every
+row is counted exactly once even when two runs overlap.
+
+Raw rows older than ANALYTICS_RETENTION_DAYS that are already rolled up are
+deleted, as are hourly rollups older than ANALYTICS_HOURLY_RETENTION_DAYS;
+daily rollups are kept.
+"""
+
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from database import db
+from models.agent import AgentAnalytics, AgentProductInteraction
+from models.analytics import AgentAnalyticsRollup, AgentProductRollup, AnalyticsWatermark
+from services.job_queue import register_job_handler, register_periodic_job
+
+
+BATCH_SIZE = 5000
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Truncate a timestamp to the start of its hour or day"""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+GRANULARITIES = ('hour', 'day')
+
+
+def _apply_activity(counters: Dict[Tuple[str, datetime], Counter]):
+    """Add counter deltas to AgentAnalyticsRollup rows, creating missing buckets"""
+    if not counters:
+        return
+    existing = AgentAnalyticsRollup.query.filter(
+        AgentAnalyticsRollup.granularity.in_({key[0] for key in counters}),
+        AgentAnalyticsRollup.bucket_start.in_({key[1] for key in counters})
+    ).all()
+    rows = {(row.granularity, row.bucket_start): row for row in existing}
+
+    for (granularity, start), deltas in counters.items():
+        row = rows.get((granularity, start))
+        if row is None:
+            row = AgentAnalyticsRollup(granularity=granularity, bucket_start=start)
+            db.session.add(row)
+        for field, delta in deltas.items():
+            setattr(row, field, (getattr(row, field) or 0) + delta)
+
+
+def _apply_products(counters: Dict[Tuple[str, datetime, int, int], Counter]):
+    """Add counter deltas to AgentProductRollup rows, creating missing buckets"""
+    if not counters:
+        return
+    existing = AgentProductRollup.query.filter(
+        AgentProductRollup.bucket_start.in_({key[1] for key in counters}),
+        AgentProductRollup.product_id.in_({key[2] for key in counters})
+    ).all()
+    rows = {(row.granularity, row.bucket_start, row.product_id, row.position): row for row in existing}
+
+    for key, deltas in counters.items():
+        row = rows.get(key)
+        if row is None:
+            granularity, start, product_id, position = key
+            row = AgentProductRollup(granularity=granularity, bucket_start=start,
+                                     product_id=product_id, position=position)
+            db.session.add(row)
+        for field, delta in deltas.items():
+            setattr(row, field, (getattr(row, field) or 0) + delta)
+
+
+def _claim_batch(source: str, last_id: int, batch_end: int) -> bool:
+    """Advance the source's watermark over a batch before folding it; False if another run claimed it"""
+    if AnalyticsWatermark.advance(source, last_id, batch_end):
+        return True
+    db.session.rollback()
+    print(f"[ANALYTICS] {source} batch after id {last_id} was already rolled up by another run")
+    return False
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def roll_up_events(batch_size: int = BATCH_SIZE) -> int:
+    """Fold the next batch of agent_analytics events into the rollups; returns rows processed"""
+    last_id = AnalyticsWatermark.get_last_id('agent_analytics')
+    events = db.session.query(
+        AgentAnalytics.id, AgentAnalytics.event_type, AgentAnalytics.event_data, AgentAnalytics.created_at
+    ).filter(AgentAnalytics.id > last_id).order_by(AgentAnalytics.id).limit(batch_size).all()
+    if not events or not _claim_batch('agent_analytics', last_id, events[-1].id):
+        return 0
+
+    activity = defaultdict(Counter)
+    products = defaultdict(Counter)
+    for event in events:
+        data = json.loads(event.event_data) if event.event_data else {}
+        for granularity in GRANULARITIES:
+            start = bucket_start(event.created_at, granularity)
+            counter = activity[(granularity, start)]
+            if event.event_type == 'message_sent':
+                counter['messages'] += 1
+                if data.get('has_image'):
+                    counter['image_messages'] += 1
+            elif event.event_type == 'message_received':
+                counter['searches'] += 1
+                if not data.get('products_count'):
+                    counter['zero_result_searches'] += 1
+            elif event.event_type == 'product_click':
+                counter['clicks'] += 1
+                product_id = _as_int(data.get('product_id'))
+                if product_id is not None:
+                    position = _as_int(data.get('position')) or 0
+                    products[(granularity, start, product_id, position)]['clicks'] += 1
+
+    _apply_activity(activity)
+    _apply_products(products)
+    db.session.commit()
+    return len(events)
+
+
+def roll_up_impressions(batch_size: int = BATCH_SIZE) -> int:
+    """Fold the next batch of 'shown' product interactions into the rollups; returns rows processed
+
+    Clicks are counted from product_click events, which are logged for every
+    click, so 'clicked' interaction rows are skipped here.
+    """
+    last_id = AnalyticsWatermark.get_last_id('agent_product_interactions')
+    interactions = db.session.query(
+        AgentProductInteraction.id, AgentProductInteraction.product_id, AgentProductInteraction.interaction_type,
+        AgentProductInteraction.position, AgentProductInteraction.created_at
+    ).filter(AgentProductInteraction.id > last_id).order_by(AgentProductInteraction.id).limit(batch_size).all()
+    if not interactions or not _claim_batch('agent_product_interactions', last_id, interactions[-1].id):
+        return 0
+
+    activity = defaultdict(Counter)
+    products = defaultdict(Counter)
+    for interaction in interactions:
+        if interaction.interaction_type != 'shown':
+            continue
+        for granularity in GRANULARITIES:
+            start = bucket_start(interaction.created_at, granularity)
+            activity[(granularity, start)]['impressions'] += 1
+            if interaction.product_id is not None:
+                products[(granularity, start, interaction.product_id, interaction.position or 0)]['impressions'] += 1
+
+    _apply_activity(activity)
+    _apply_products(products)
+    db.session.commit()
+    return len(interactions)
+
+
+def compact_raw_events(retention_days: int = None, hourly_retention_days: int = None) -> Dict[str, int]:
+    """Delete rolled-up raw rows past retention, and old hourly rollups"""
+    retention_days = retention_days or int(os.getenv('ANALYTICS_RETENTION_DAYS', 90))
+    hourly_retention_days = hourly_retention_days or int(os.getenv('ANALYTICS_HOURLY_RETENTION_DAYS', 30))
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+
+    deleted = {
+        'events': AgentAnalytics.query.filter(
+            AgentAnalytics.created_at < cutoff,
+            AgentAnalytics.id <= AnalyticsWatermark.get_last_id('agent_analytics')
+        ).delete(synchronize_session=False),
+        # Interactions also feed the co-occurrence matrix; keep the rows it has not folded yet
+        'interactions': AgentProductInteraction.query.filter(
+            AgentProductInteraction.created_at < cutoff,
+            AgentProductInteraction.id <= min(AnalyticsWatermark.get_last_id('agent_product_interactions'),
+                                              AnalyticsWatermark.get_last_id('product_cooccurrence'))
+        ).delete(synchronize_session=False)
+    }
+
+    hourly_cutoff = now - timedelta(days=hourly_retention_days)
+    deleted['hourly_rollups'] = AgentAnalyticsRollup.query.filter(
+        AgentAnalyticsRollup.granularity == 'hour',
+        AgentAnalyticsRollup.bucket_start < hourly_cutoff
+    ).delete(synchronize_session=False)
+    deleted['hourly_product_rollups'] = AgentProductRollup.query.filter(
+        AgentProductRollup.granularity == 'hour',
+        AgentProductRollup.bucket_start < hourly_cutoff
+    ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return deleted
+
+
+@register_job_handler('analytics_rollup')
+def run_analytics_rollup_job(job):
+    """Job handler: catch the rollups up with the raw tables, then apply retention"""
+    processed = 0
+    for roll_up, source in ((roll_up_events, 'events'), (roll_up_impressions, 'product interactions')):
+        while True:
+            job.raise_if_cancelled()
+            count = roll_up(job.payload.get('batch_size', BATCH_SIZE))
+            if not count:
+                break
+            processed += count
+            job.update_progress(processed=processed, operation=f'Rolling up {source}')
+
+    deleted = compact_raw_events()
+    job.update_progress(processed=processed, force=True,
+                        log=f'Rolled up {processed} raw rows; retention removed {deleted}')
+    print(f"[ANALYTICS] Rolled up {processed} raw rows, retention removed {deleted}")
+
+
+register_periodic_job('analytics_rollup', float(os.getenv('ANALYTICS_ROLLUP_INTERVAL', 300)))
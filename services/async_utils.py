@@ -0,0 +1,31 @@
+"""
+Helpers for calling blocking services from async code
+
+The weaviate-client version in use only offers a synchronous API and the
+models run on CPU, so async callers hand that work to a bounded thread pool.
+Each call runs in its own application context (and therefore its own
+database session), so concurrent calls never share a session.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASYNC_IO_WORKERS', 16)), thread_name_prefix='async-io')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the shared pool without blocking the event loop"""
+    call = functools.partial(func, *args, **kwargs)
+
+    if has_app_context():
+        app = current_app._get_current_object()
+
+        def call_in_context():
+            with app.app_context():
+                return call()
+        return await asyncio.get_running_loop().run_in_executor(_executor, call_in_context)
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
@@ -0,0 +1,175 @@
+"""
+On-disk cache of preprocessed product images
+
+Blobs are the JPEG bytes produced by the image pipeline, stored under the
+SHA-256 of their content (identical images shared by several URLs are kept
+once). A small SQLite index maps each source URL to its blob plus the
+ETag/Last-Modified validators the server sent, so a cached image is reused
+without any network I/O until it is due for revalidation, and is then
+revalidated with a conditional GET. Total size is capped; the least recently
+used entries are evicted first.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class ImageCache:
+    """Content-addressed JPEG cache with an LRU size cap"""
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None, revalidate_after: int = None):
+        self.cache_dir = cache_dir or os.getenv(
+            'IMAGE_CACHE_DIR',
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'image_cache')
+        )
+        self.max_bytes = max_bytes or int(os.getenv('IMAGE_CACHE_MAX_MB', 1024)) * 1024 * 1024
+        self.revalidate_after = revalidate_after if revalidate_after is not None else \
+            int(os.getenv('IMAGE_CACHE_REVALIDATE_SECONDS', 7 * 24 * 3600))
+
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                blob_key TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_blob_key ON entries (blob_key)")
+        self._conn.commit()
+
+    def _blob_path(self, blob_key: str) -> str:
+        return os.path.join(self.cache_dir, blob_key[:2], f"{blob_key}.jpg")
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """Get the index entry for a URL, or None if it is not cached"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob_key, size, etag, last_modified, validated_at FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'blob_key': row[0],
+            'size': row[1],
+            'etag': row[2],
+            'last_modified': row[3],
+            'validated_at': row[4]
+        }
+
+    def is_fresh(self, entry: Dict) -> bool:
+        """True when the entry can be used without asking the server"""
+        return time.time() - entry['validated_at'] < self.revalidate_after
+
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict:
+        """Request headers for revalidating an entry"""
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read(self, url: str, entry: Dict) -> Optional[bytes]:
+        """Read a cached blob and record the access; drops entries whose blob went missing"""
+        try:
+            with open(self._blob_path(entry['blob_key']), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.remove(url)
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        return data
+
+    def mark_validated(self, url: str):
+        """Record a 304 response - the cached blob is still current"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET validated_at = ?, last_access = ? WHERE url = ?", (now, now, url)
+            )
+            self._conn.commit()
+
+    def put(self, url: str, data: bytes, etag: str = None, last_modified: str = None):
+        """Store preprocessed JPEG bytes for a URL"""
+        blob_key = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob_key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT blob_key FROM entries WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, blob_key, size, etag, last_modified, validated_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, blob_key, len(data), etag, last_modified, now, now)
+            )
+            self._conn.commit()
+            if previous and previous[0] != blob_key:
+                self._delete_blob_if_unused(previous[0])
+            self._evict()
+
+    def remove(self, url: str):
+        """Drop a URL from the cache"""
+        with self._lock:
+            row = self._conn.execute("SELECT blob_key FROM entries WHERE url = ?", (url,)).fetchone()
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._conn.commit()
+            if row:
+                self._delete_blob_if_unused(row[0])
+
+    def stats(self) -> Dict:
+        """Entry count and stored bytes (shared blobs counted once)"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self._stored_bytes()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'cache_dir': self.cache_dir}
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob_key, size FROM entries)"
+        ).fetchone()[0]
+
+    def _evict(self):
+        """Remove least recently used entries until under the size cap (lock held)"""
+        total = self._stored_bytes()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT url, blob_key, size FROM entries ORDER BY last_access ASC").fetchall()
+        for url, blob_key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            if self._delete_blob_if_unused(blob_key):
+                total -= size
+        self._conn.commit()
+
+    def _delete_blob_if_unused(self, blob_key: str) -> bool:
+        """Delete a blob file once no URL references it (lock held)"""
+        in_use = self._conn.execute("SELECT 1 FROM entries WHERE blob_key = ? LIMIT 1", (blob_key,)).fetchone()
+        if in_use:
+            return False
+        try:
+            os.remove(self._blob_path(blob_key))
+        except OSError:
+            pass
+        return True
@@ -0,0 +1,284 @@
+"""
+Pluggable image embedding backends
+
+The default backend runs a CLIP model locally through sentence-transformers,
+producing a visual embedding on CPU without any API call. The OpenAI backend
+keeps the previous behaviour (GPT-4o-mini description, then a text embedding
+of that description) for deployments that prefer it.
+
+Results are persisted in the ``image_embeddings`` table keyed by the image's
+content hash and the backend's model version, so reindexes and re-syncs only
+embed images that are new (or new to the current model).
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import db
+from models.image_embedding import ImageEmbedding
+
+from .openai_service import OpenAIService
+
+
+class ImageEmbeddingBackend:
+    """Turns a base64 image into an embedding"""
+
+    name = None
+    model_version = None
+
+    def is_available(self) -> bool:
+        """Whether the backend can produce embeddings"""
+        return True
+
+    def embed_image(self, image_base64: str, use_cache: bool = True) -> Optional[Dict]:
+        """Return {'embedding', 'description', 'embedding_model'} or None on failure
+
+        With ``use_cache`` the result is looked up in and added to the
+        image_embeddings table; new rows are committed with the caller's
+        transaction.
+        """
+        if not use_cache:
+            return self._embed_image(image_base64)
+
+        content_hash = image_content_hash(image_base64)
+        try:
+            cached = ImageEmbedding.lookup(content_hash, self.model_version)
+            if cached is not None:
+                return cached.to_result()
+        except SQLAlchemyError as e:
+            print(f"[IMAGE EMBEDDINGS] Error reading embedding cache: {e}")
+
+        result = self._embed_image(image_base64)
+        if result:
+            _store_cached_embedding(content_hash, result)
+        return result
+
+    async def embed_image_async(self, image_base64: str) -> Optional[Dict]:
+        """Embed a query image without blocking the event loop (not cached)"""
+        return await asyncio.to_thread(self._embed_image, image_base64)
+
+    def embed_images(self, images: List[str]) -> List[Optional[Dict]]:
+        """Embed many images at once, computing only those missing from the cache"""
+        hashes = [image_content_hash(image) for image in images]
+        results = [None] * len(images)
+
+        try:
+            cached = ImageEmbedding.query.filter(
+                ImageEmbedding.content_hash.in_(set(hashes)),
+                ImageEmbedding.model_version == self.model_version
+            ).all()
+            by_hash = {entry.content_hash: entry.to_result() for entry in cached}
+        except SQLAlchemyError as e:
+            print(f"[IMAGE EMBEDDINGS] Error reading embedding cache: {e}")
+            by_hash = {}
+
+        # Compute each missing image once, even if several products share it
+        missing = {}
+        for index, content_hash in enumerate(hashes):
+            if content_hash in by_hash:
+                results[index] = by_hash[content_hash]
+            else:
+                missing.setdefault(content_hash, []).append(index)
+
+        if missing:
+            computed = self._embed_images([images[indexes[0]] for indexes in missing.values()])
+            for (content_hash, indexes), result in zip(missing.items(), computed):
+                if result:
+                    _store_cached_embedding(content_hash, result)
+                for index in indexes:
+                    results[index] = result
+
+        return results
+
+    def _embed_image(self, image_base64: str) -> Optional[Dict]:
+        """Compute the embedding (no caching)"""
+        raise NotImplementedError
+
+    def _embed_images(self, images: List[str]) -> List[Optional[Dict]]:
+        """Compute several embeddings (no caching); backends override to batch"""
+        return [self._embed_image(image) for image in images]
+
+
+class ClipImageEmbeddingBackend(ImageEmbeddingBackend):
+    """Local CLIP image encoder (sentence-transformers)"""
+
+    name = 'clip'
+
+    def __init__(self, model_name: str = None):
+        self.model_name = model_name or os.getenv('CLIP_MODEL_NAME', 'clip-ViT-B-32')
+        self.model_version = self.model_name
+        self._model = None
+        self._load_failed = False
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        """Load the CLIP model on first use"""
+        if self._model is None and not self._load_failed:
+            with self._lock:
+                if self._model is None and not self._load_failed:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                        print(f"[IMAGE EMBEDDINGS] Loading CLIP model {self.model_name}...")
+                        self._model = SentenceTransformer(self.model_name)
+                        print(f"[IMAGE EMBEDDINGS] CLIP model loaded successfully")
+                    except Exception as e:
+                        print(f"[IMAGE EMBEDDINGS] Failed to load CLIP model: {e}")
+                        self._load_failed = True
+        return self._model
+
+    def is_available(self) -> bool:
+        return self._get_model() is not None
+
+    def _embed_image(self, image_base64: str) -> Optional[Dict]:
+        model = self._get_model()
+        if model is None:
+            return None
+
+        try:
+            image = Image.open(io.BytesIO(_decode_image(image_base64))).convert('RGB')
+            embedding = model.encode(image, normalize_embeddings=True)
+            return {
+                'embedding': embedding.tolist(),
+                'description': None,
+                'embedding_model': self.model_version
+            }
+        except Exception as e:
+            print(f"[IMAGE EMBEDDINGS] Error generating CLIP embedding: {e}")
+            return None
+
+    def _embed_images(self, images: List[str]) -> List[Optional[Dict]]:
+        model = self._get_model()
+        if model is None:
+            return [None] * len(images)
+
+        try:
+            decoded = [Image.open(io.BytesIO(_decode_image(image))).convert('RGB') for image in images]
+            embeddings = model.encode(decoded, batch_size=32, normalize_embeddings=True)
+            return [{
+                'embedding': embedding.tolist(),
+                'description': None,
+                'embedding_model': self.model_version
+            } for embedding in embeddings]
+        except Exception as e:
+            print(f"[IMAGE EMBEDDINGS] Batch CLIP embedding failed, embedding one by one: {e}")
+            return super()._embed_images(images)
+
+
+class OpenAIImageEmbeddingBackend(ImageEmbeddingBackend):
+    """GPT-4o-mini image description embedded with text-embedding-3-small"""
+
+    name = 'openai'
+    model_version = 'gpt-4o-mini+text-embedding-3-small'
+
+    def __init__(self, openai_service: OpenAIService = None):
+        self.openai_service = openai_service or OpenAIService()
+
+    def is_available(self) -> bool:
+        return bool(self.openai_service and self.openai_service.is_configured())
+
+    def _embed_image(self, image_base64: str) -> Optional[Dict]:
+        if not self.is_available():
+            return None
+
+        image_data = self.openai_service.process_image_for_embedding(image_base64)
+        if not image_data:
+            return None
+        return {
+            'embedding': image_data['embedding'],
+            'description': image_data['description'],
+            'embedding_model': self.model_version
+        }
+
+    async def embed_image_async(self, image_base64: str) -> Optional[Dict]:
+        if not self.is_available():
+            return None
+
+        description = await self.openai_service.describe_image_async(image_base64)
+        if not description:
+            return None
+        embedding = (await self.openai_service.get_text_embeddings_async([description]))[0]
+        if not embedding:
+            return None
+        return {
+            'embedding': embedding,
+            'description': description,
+            'embedding_model': self.model_version
+        }
+
+    def _embed_images(self, images: List[str]) -> List[Optional[Dict]]:
+        if not self.is_available():
+            return [None] * len(images)
+
+        # Descriptions need one chat call per image; embed them all in one batched request
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix='image-describe') as executor:
+            descriptions = list(executor.map(self.openai_service.describe_image, images))
+        embeddings = self.openai_service.get_text_embeddings(descriptions)
+
+        return [{
+            'embedding': embedding,
+            'description': description,
+            'embedding_model': self.model_version
+        } if embedding else None for description, embedding in zip(descriptions, embeddings)]
+
+
+def _decode_image(image_base64: str) -> bytes:
+    """Decode base64 image data (with or without a data: URL prefix)"""
+    if image_base64.startswith('data:image'):
+        image_base64 = image_base64.split(',', 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def image_content_hash(image_base64: str) -> str:
+    """SHA-256 of the image bytes; the image pipeline's output is deterministic per source image"""
+    return hashlib.sha256(_decode_image(image_base64)).hexdigest()
+
+
+def _store_cached_embedding(content_hash: str, result: Dict):
+    """Add an embedding to the cache inside a savepoint, ignoring concurrent duplicates"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(ImageEmbedding(
+                content_hash=content_hash,
+                model_version=result['embedding_model'],
+                description=result.get('description'),
+                embedding=json.dumps(result['embedding']),
+                dimensions=len(result['embedding'])
+            ))
+    except SQLAlchemyError as e:
+        print(f"[IMAGE EMBEDDINGS] Could not cache embedding {content_hash[:12]}: {e}")
+
+
+# vector_config.image_embedding_model values -> backend name
+MODEL_BACKENDS = {
+    'clip-vit-base-patch32': 'clip',
+    'openai-clip': 'clip',
+    'openai-ada-002': 'openai'
+}
+
+_clip_backend = None
+_clip_backend_lock = threading.Lock()
+
+
+def get_image_embedding_backend(configured_model: str = None,
+                                openai_service: OpenAIService = None) -> ImageEmbeddingBackend:
+    """Pick the backend from IMAGE_EMBEDDING_BACKEND, else from the vector config model"""
+    global _clip_backend
+
+    backend = os.getenv('IMAGE_EMBEDDING_BACKEND') or MODEL_BACKENDS.get(configured_model or '', 'clip')
+    if backend == 'openai':
+        return OpenAIImageEmbeddingBackend(openai_service)
+
+    # The CLIP model is large - share one instance per process
+    with _clip_backend_lock:
+        if _clip_backend is None:
+            _clip_backend = ClipImageEmbeddingBackend()
+    return _clip_backend
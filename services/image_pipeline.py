@@ -0,0 +1,149 @@
+"""
+Image fetch and preprocessing stage for indexing
+
+Downloads product images over a pooled HTTP session and resizes/re-encodes
+them on a bounded thread pool, so indexing can prefetch a whole batch of
+images while it works through the previous ones. Remote images go through
+the on-disk image cache, so unchanged images are not downloaded again.
+"""
+import base64
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .image_cache import ImageCache
+
+
+class ImagePipeline:
+    """Bounded pool that turns image URLs into base64 JPEGs ready for Weaviate"""
+
+    def __init__(self, max_workers: int = None, timeout: int = 10, max_size=(1024, 1024),
+                 local_base_url: str = None, cache: Optional[ImageCache] = None):
+        self.max_workers = max_workers or int(os.getenv('IMAGE_FETCH_WORKERS', 8))
+        self.timeout = timeout
+        self.max_size = max_size
+        self.local_base_url = local_base_url or os.getenv('IMAGE_LOCAL_BASE_URL', 'http://localhost:5000')
+        self.cache = cache
+        if self.cache is None and os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() == 'true':
+            self.cache = ImageCache()
+
+        # One keep-alive connection pool shared by all fetch threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.max_workers,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-fetch')
+
+    def fetch(self, image_url: str) -> Optional[bytes]:
+        """Read raw image bytes from the local uploads folder or over HTTP"""
+        # Handle relative URLs - try local file system first
+        if image_url.startswith('/'):
+            local_path = f".{image_url}"  # Convert /uploads/... to ./uploads/...
+            if os.path.exists(local_path):
+                with open(local_path, 'rb') as f:
+                    return f.read()
+            image_url = f"{self.local_base_url}{image_url}"
+            print(f"[IMAGES] Local file not found, trying HTTP: {image_url}")
+
+        response = self.session.get(image_url, timeout=self.timeout)
+        if response.status_code == 200:
+            return response.content
+
+        print(f"[IMAGES] Download failed for {image_url}: {response.status_code}")
+        return None
+
+    def fetch_preprocessed(self, image_url: str) -> Optional[bytes]:
+        """Get the preprocessed JPEG for a URL, using the on-disk cache for remote images"""
+        if self.cache is None or image_url.startswith('/'):
+            image_data = self.fetch(image_url)
+            return self.preprocess(image_data) if image_data else None
+
+        entry = self.cache.lookup(image_url)
+        if entry and self.cache.is_fresh(entry):
+            cached = self.cache.read(image_url, entry)
+            if cached is not None:
+                return cached
+
+        response = self.session.get(image_url, timeout=self.timeout,
+                                    headers=self.cache.conditional_headers(entry))
+        if response.status_code == 304 and entry:
+            cached = self.cache.read(image_url, entry)
+            if cached is not None:
+                self.cache.mark_validated(image_url)
+                return cached
+            # Blob vanished from disk - download it unconditionally
+            response = self.session.get(image_url, timeout=self.timeout)
+
+        if response.status_code != 200:
+            print(f"[IMAGES] Download failed for {image_url}: {response.status_code}")
+            return None
+
+        jpeg = self.preprocess(response.content)
+        self.cache.put(image_url, jpeg,
+                       etag=response.headers.get('ETag'),
+                       last_modified=response.headers.get('Last-Modified'))
+        return jpeg
+
+    def preprocess(self, image_source) -> Optional[bytes]:
+        """Resize to fit max_size and re-encode as RGB JPEG (accepts bytes or a file object)"""
+        if isinstance(image_source, (bytes, bytearray)):
+            image_source = io.BytesIO(image_source)
+
+        img = Image.open(image_source)
+        img.thumbnail(self.max_size, Image.Resampling.LANCZOS)
+
+        # Convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+    def fetch_and_encode(self, image_url: str) -> Optional[str]:
+        """Download, preprocess and base64-encode one image"""
+        try:
+            jpeg = self.fetch_preprocessed(image_url)
+            if not jpeg:
+                return None
+            return base64.b64encode(jpeg).decode('utf-8')
+        except Exception as e:
+            print(f"[IMAGES] Error downloading/encoding image {image_url}: {e}")
+            return None
+
+    def submit(self, image_url: str) -> Future:
+        """Schedule one image on the pool"""
+        return self.executor.submit(self.fetch_and_encode, image_url)
+
+    def prefetch(self, image_urls: Iterable[str]) -> Dict[str, Future]:
+        """Schedule a batch of images; returns url -> future of the base64 JPEG"""
+        futures = {}
+        for url in image_urls:
+            if url and url not in futures:
+                futures[url] = self.submit(url)
+        return futures
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_image_pipeline() -> ImagePipeline:
+    """Process-wide image pipeline (one connection pool and thread pool)"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ImagePipeline()
+    return _pipeline
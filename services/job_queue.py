@@ -0,0 +1,379 @@
+"""
+Durable background job queue backed by the application database
+
+Jobs are rows in ``background_jobs``. Any process running a ``JobWorker``
+(the embedded worker thread inside the web app, or ``run_job_worker.py``)
+can claim queued jobs, so status survives restarts and is shared across
+gunicorn workers. Running jobs heartbeat while they report progress; a job
+whose worker disappears is re-queued and resumes from its last checkpoint.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import exists, insert, literal, or_, select, update
+from sqlalchemy.exc import OperationalError
+
+from database import db
+from models.job import BackgroundJob
+
+
+# Registered handlers: job_type -> callable(JobContext)
+_job_handlers: Dict[str, Callable] = {}
+
+# Periodic jobs: job_type -> (interval seconds, payload)
+_periodic_jobs: Dict[str, tuple] = {}
+
+# One embedded worker per process
+_embedded_worker = None
+_embedded_worker_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when cancellation of its job was requested"""
+    pass
+
+
+def register_job_handler(job_type: str):
+    """Decorator registering a handler for a job type"""
+    def decorator(func):
+        _job_handlers[job_type] = func
+        return func
+    return decorator
+
+
+def register_periodic_job(job_type: str, interval: float, payload: Optional[Dict] = None):
+    """Have job workers enqueue a job of this type every ``interval`` seconds"""
+    _periodic_jobs[job_type] = (interval, payload)
+
+
+def get_job_handler(job_type: str) -> Optional[Callable]:
+    """Get the handler registered for a job type"""
+    return _job_handlers.get(job_type)
+
+
+class JobContext:
+    """Handle given to job handlers for progress, checkpoints and cancellation"""
+
+    def __init__(self, job: BackgroundJob, queue: 'JobQueue', report_interval: float = 1.0):
+        self.job_id = job.id
+        self.job_type = job.job_type
+        self.payload = job.get_payload()
+        self.checkpoint = job.get_checkpoint()
+        self.attempt = job.attempts or 1
+        self.queue = queue
+        self.report_interval = report_interval
+        self._last_report = 0.0
+
+    @property
+    def is_resumed(self) -> bool:
+        """True when the job was restarted after an interruption"""
+        return bool(self.checkpoint)
+
+    def update_progress(self, processed: int = None, total: int = None, failed: int = None,
+                        operation: str = None, log: str = None, force: bool = False):
+        """Report progress; writes are throttled unless ``force`` is set"""
+        now = time.monotonic()
+        if not force and not log and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+
+        values = {'heartbeat_at': datetime.utcnow()}
+        if processed is not None:
+            values['processed'] = processed
+        if total is not None:
+            values['total'] = total
+        if failed is not None:
+            values['failed'] = failed
+        if operation is not None:
+            values['current_operation'] = operation[:255]
+        if log is not None:
+            values['log_entries'] = json.dumps([log])
+        self.queue._update(self.job_id, **values)
+
+    def save_checkpoint(self, checkpoint: Dict):
+        """Persist resume state; the handler receives it again if the job restarts"""
+        self.checkpoint = checkpoint
+        self.queue._update(self.job_id, checkpoint=json.dumps(checkpoint), heartbeat_at=datetime.utcnow())
+
+    def is_cancelled(self) -> bool:
+        """Check whether cancellation was requested"""
+        return self.queue.is_cancel_requested(self.job_id)
+
+    def raise_if_cancelled(self):
+        """Raise JobCancelled if cancellation was requested"""
+        if self.is_cancelled():
+            raise JobCancelled(f"Job {self.job_id} cancelled")
+
+
+class JobQueue:
+    """Enqueue, claim and manage background jobs"""
+
+    def __init__(self, heartbeat_timeout: int = 300, max_attempts: int = 3):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+
+    def enqueue(self, job_type: str, payload: Optional[Dict] = None) -> BackgroundJob:
+        """Create a queued job"""
+        job = BackgroundJob(
+            id=str(uuid.uuid4()),
+            job_type=job_type,
+            status='queued',
+            payload=json.dumps(payload or {}),
+            current_operation='Queued',
+            log_entries=json.dumps([f'{job_type} queued'])
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def get(self, job_id: str) -> Optional[BackgroundJob]:
+        """Get a job by id (always re-read from the database)"""
+        job = db.session.get(BackgroundJob, job_id)
+        if job is not None:
+            db.session.refresh(job)
+        return job
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Request cancellation; queued jobs are cancelled immediately"""
+        result = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, BackgroundJob.status == 'queued')
+            .values(status='cancelled', cancel_requested=True, completed_at=datetime.utcnow(),
+                    current_operation='Cancelled', log_entries=json.dumps(['Cancelled before start']))
+        )
+        if result.rowcount == 0:
+            result = db.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job_id, BackgroundJob.status == 'running')
+                .values(cancel_requested=True)
+            )
+        db.session.commit()
+        return result.rowcount > 0
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        """Check the cancellation flag without loading the whole row"""
+        flag = db.session.query(BackgroundJob.cancel_requested).filter(BackgroundJob.id == job_id).scalar()
+        return bool(flag)
+
+    def claim_next(self, worker_id: str, job_types: Optional[List[str]] = None) -> Optional[BackgroundJob]:
+        """Atomically claim the oldest queued job this worker can handle"""
+        job_types = job_types or list(_job_handlers.keys())
+        if not job_types:
+            return None
+
+        candidates = db.session.query(BackgroundJob.id).filter(
+            BackgroundJob.status == 'queued',
+            BackgroundJob.job_type.in_(job_types)
+        ).order_by(BackgroundJob.created_at.asc()).limit(5).all()
+
+        for (job_id,) in candidates:
+            now = datetime.utcnow()
+            result = db.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job_id, BackgroundJob.status == 'queued')
+                .values(status='running', worker_id=worker_id, heartbeat_at=now,
+                        started_at=db.func.coalesce(BackgroundJob.started_at, now),
+                        attempts=db.func.coalesce(BackgroundJob.attempts, 0) + 1)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                return self.get(job_id)
+        return None
+
+    def requeue_stale(self) -> int:
+        """Re-queue running jobs whose worker stopped heartbeating"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.heartbeat_timeout)
+        stale = BackgroundJob.query.filter(
+            BackgroundJob.status == 'running',
+            BackgroundJob.heartbeat_at < cutoff
+        ).all()
+
+        for job in stale:
+            if job.cancel_requested:
+                job.status = 'cancelled'
+                job.completed_at = datetime.utcnow()
+            elif (job.attempts or 0) >= self.max_attempts:
+                job.status = 'failed'
+                job.error = f'Worker {job.worker_id} stopped responding ({job.attempts} attempts)'
+                job.completed_at = datetime.utcnow()
+            else:
+                job.status = 'queued'
+                job.current_operation = 'Re-queued after worker interruption'
+                job.log_entries = json.dumps([f'Worker {job.worker_id} stopped responding, job re-queued'])
+            job.worker_id = None
+        if stale:
+            db.session.commit()
+        return len(stale)
+
+    def enqueue_due_periodic(self) -> int:
+        """Enqueue periodic jobs whose interval has passed since the last one was created
+
+        Each enqueue is a single conditional INSERT, so of several workers
+        checking at once only one adds a run, and never while a job of the
+        same type is still queued or running.
+        """
+        enqueued = 0
+        for job_type, (interval, payload) in _periodic_jobs.items():
+            if self.enqueue_unless_active(job_type, payload, min_interval=interval) is not None:
+                enqueued += 1
+        return enqueued
+
+    def enqueue_unless_active(self, job_type: str, payload: Optional[Dict] = None,
+                              min_interval: float = 0) -> Optional[str]:
+        """Atomically enqueue a job unless one of its type is active or was created in the last min_interval seconds
+
+        Returns the new job id, or None when nothing was enqueued.
+        """
+        now = datetime.utcnow()
+        values = {
+            'id': str(uuid.uuid4()),
+            'job_type': job_type,
+            'status': 'queued',
+            'payload': json.dumps(payload or {}),
+            'processed': 0,
+            'failed': 0,
+            'total': 0,
+            'current_operation': 'Queued',
+            'log_entries': json.dumps([f'{job_type} queued']),
+            'attempts': 0,
+            'cancel_requested': False,
+            'created_at': now,
+        }
+        blocking = exists().where(
+            BackgroundJob.job_type == job_type,
+            or_(BackgroundJob.status.in_(['queued', 'running']),
+                BackgroundJob.created_at > now - timedelta(seconds=min_interval))
+        )
+        columns = BackgroundJob.__table__.c
+        row = select(*[literal(value, type_=columns[name].type) for name, value in values.items()]).where(~blocking)
+        try:
+            result = db.session.execute(insert(BackgroundJob).from_select(list(values), row))
+            db.session.commit()
+        except OperationalError as e:
+            # Another worker holds the write lock for the same check; it will enqueue
+            db.session.rollback()
+            print(f"[JOBS] Skipped enqueueing {job_type}: {e}")
+            return None
+        return values['id'] if result.rowcount == 1 else None
+
+    def complete(self, job_id: str, operation: str = 'Completed', log: str = None):
+        """Mark a job as completed"""
+        self._update(job_id, status='completed', completed_at=datetime.utcnow(),
+                     current_operation=operation, log_entries=json.dumps([log or operation]))
+
+    def fail(self, job_id: str, error: str):
+        """Mark a job as failed"""
+        self._update(job_id, status='failed', completed_at=datetime.utcnow(), error=error[:2000],
+                     current_operation='Failed', log_entries=json.dumps([f'Failed: {error[:500]}']))
+
+    def cancel(self, job_id: str):
+        """Mark a job as cancelled (called by the worker once the handler stopped)"""
+        self._update(job_id, status='cancelled', completed_at=datetime.utcnow(),
+                     current_operation='Cancelled', log_entries=json.dumps(['Cancelled by user']))
+
+    def _update(self, job_id: str, **values):
+        """Apply column updates in their own short transaction"""
+        db.session.execute(update(BackgroundJob).where(BackgroundJob.id == job_id).values(**values))
+        db.session.commit()
+
+
+class JobWorker:
+    """Polls the queue and runs claimed jobs inside an application context"""
+
+    def __init__(self, app, worker_id: str = None, poll_interval: float = 2.0,
+                 job_types: Optional[List[str]] = None, queue: Optional[JobQueue] = None):
+        self.app = app
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval
+        self.job_types = job_types
+        self.queue = queue or JobQueue(
+            heartbeat_timeout=app.config.get('JOB_HEARTBEAT_TIMEOUT', 300),
+            max_attempts=app.config.get('JOB_MAX_ATTEMPTS', 3)
+        )
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_periodic_check = 0.0
+
+    def run_once(self) -> bool:
+        """Claim and run a single job; returns False if the queue was empty"""
+        with self.app.app_context():
+            try:
+                self.queue.requeue_stale()
+                if _periodic_jobs and time.monotonic() >= self._next_periodic_check:
+                    self._next_periodic_check = time.monotonic() + 60
+                    self.queue.enqueue_due_periodic()
+                job = self.queue.claim_next(self.worker_id, self.job_types)
+            except Exception as e:
+                print(f"[JOBS] Error claiming job: {e}")
+                db.session.rollback()
+                return False
+
+            if job is None:
+                return False
+
+            handler = get_job_handler(job.job_type)
+            print(f"[JOBS] Worker {self.worker_id} running {job.job_type} job {job.id} (attempt {job.attempts})")
+            context = JobContext(job, self.queue)
+
+            try:
+                if handler is None:
+                    raise Exception(f"No handler registered for job type '{job.job_type}'")
+                handler(context)
+                current = self.queue.get(job.id)
+                if current is not None and current.status == 'running':
+                    self.queue.complete(job.id)
+            except JobCancelled:
+                db.session.rollback()
+                print(f"[JOBS] Job {job.id} cancelled")
+                self.queue.cancel(job.id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[JOBS] Job {job.id} failed: {e}")
+                print(f"[JOBS] Full traceback: {traceback.format_exc()}")
+                self.queue.fail(job.id, str(e))
+            return True
+
+    def run_forever(self):
+        """Process jobs until stop() is called"""
+        print(f"[JOBS] Worker {self.worker_id} started")
+        while not self._stop.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                print(f"[JOBS] Worker loop error: {e}")
+                worked = False
+            if not worked:
+                self._stop.wait(self.poll_interval)
+        print(f"[JOBS] Worker {self.worker_id} stopped")
+
+    def start(self) -> threading.Thread:
+        """Run the worker loop in a daemon thread"""
+        self._thread = threading.Thread(target=self.run_forever, name=f"job-worker-{self.worker_id}", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Ask the worker loop to exit after the current job"""
+        self._stop.set()
+
+
+def ensure_embedded_worker(app) -> Optional[JobWorker]:
+    """Start the in-process worker thread once, unless dedicated workers are configured"""
+    global _embedded_worker
+
+    if not app.config.get('JOB_WORKER_EMBEDDED', True):
+        return None
+
+    with _embedded_worker_lock:
+        if _embedded_worker is None:
+            _embedded_worker = JobWorker(app, poll_interval=app.config.get('JOB_POLL_INTERVAL', 2.0))
+            _embedded_worker.start()
+    return _embedded_worker
@@ -4,11 +4,46 @@ OpenAI Service for Image and Text Embeddings
 import os
 import base64
 import requests
+import asyncio
+import threading
+import time
+from requests.adapters import HTTPAdapter
 from typing import List, Optional, Dict
 import json
 from PIL import Image
 import io
 
+# Embeddings endpoint limits: inputs per request, and a conservative cap on
+# total characters so a batch stays under the per-request token limit
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_BATCH_CHARS = 600000
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# One keep-alive connection pool and one concurrency limit per process
+_session = None
+_session_lock = threading.Lock()
+_request_slots = threading.BoundedSemaphore(int(os.getenv('OPENAI_MAX_CONCURRENCY', 4)))
+
+# aiohttp sessions are bound to an event loop: loop -> (session, semaphore)
+_async_sessions = {}
+
+
+def _get_session() -> requests.Session:
+    """Shared HTTP session for OpenAI API calls"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+
 class OpenAIService:
     def __init__(self, api_key: str = None):
         """Initialize OpenAI service with API key"""
@@ -18,6 +53,7 @@ class OpenAIService:
             print("[OPENAI] Warning: No API key provided")
         
         self.base_url = "https://api.openai.com/v1"
+        self.max_retries = 5
         
     def _get_config_api_key(self):
         """Get OpenAI API key from database config"""
@@ -44,40 +80,144 @@ class OpenAIService:
         """Check if OpenAI is properly configured"""
         return bool(self.api_key)
     
-    def get_text_embedding(self, text: str, model: str = "text-embedding-3-small") -> Optional[List[float]]:
-        """Generate text embedding using OpenAI"""
-        if not self.api_key:
-            print("[OPENAI] No API key available for text embedding")
-            return None
+    def _post(self, path: str, data: Dict, timeout: int = 30) -> requests.Response:
+        """POST to the API over the pooled session, limiting concurrency and retrying 429/5xx"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        for attempt in range(self.max_retries + 1):
+            with _request_slots:
+                response = _get_session().post(f"{self.base_url}{path}", headers=headers, json=data, timeout=timeout)
             
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt == self.max_retries:
+                return response
             
-            data = {
-                "input": text,
-                "model": model
-            }
+            # Honour Retry-After when the API sends it, otherwise back off exponentially
+            try:
+                delay = float(response.headers.get('Retry-After', ''))
+            except ValueError:
+                delay = min(2 ** attempt, 30)
+            print(f"[OPENAI] {path} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+        return response
+    
+    async def _get_async_session(self):
+        """aiohttp session and concurrency limit for the running event loop"""
+        loop = asyncio.get_running_loop()
+        entry = _async_sessions.get(loop)
+        if entry is None or entry[0].closed:
+            # Forget sessions of loops that have been closed
+            for stale_loop in [l for l in _async_sessions if l.is_closed()]:
+                _async_sessions.pop(stale_loop, None)
+            entry = (aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)),
+                     asyncio.Semaphore(int(os.getenv('OPENAI_MAX_CONCURRENCY', 4))))
+            _async_sessions[loop] = entry
+        return entry
+    
+    async def _post_async(self, path: str, data: Dict):
+        """Async POST to the API; returns (status, parsed JSON or error text)"""
+        if aiohttp is None:
+            raise ImportError("aiohttp package not installed. Run: pip install aiohttp")
+        
+        session, slots = await self._get_async_session()
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        for attempt in range(self.max_retries + 1):
+            async with slots:
+                async with session.post(f"{self.base_url}{path}", headers=headers, json=data) as response:
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After', '')
+                    body = await response.json() if status == 200 else await response.text()
             
-            response = requests.post(
-                f"{self.base_url}/embeddings",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            if status != 429 and status < 500 or attempt == self.max_retries:
+                return status, body
             
-            if response.status_code == 200:
-                result = response.json()
-                return result['data'][0]['embedding']
-            else:
-                print(f"[OPENAI] Text embedding failed: {response.status_code} - {response.text}")
-                return None
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = min(2 ** attempt, 30)
+            print(f"[OPENAI] {path} returned {status}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return status, body
+    
+    def get_text_embedding(self, text: str, model: str = "text-embedding-3-small") -> Optional[List[float]]:
+        """Generate text embedding using OpenAI"""
+        return self.get_text_embeddings([text], model=model)[0]
+    
+    def get_text_embeddings(self, texts: List[str], model: str = "text-embedding-3-small") -> List[Optional[List[float]]]:
+        """Generate embeddings for many texts, packing as many inputs per request as the endpoint allows
+        
+        Returns one entry per input text (None for empty texts or failed batches).
+        """
+        results = [None] * len(texts)
+        if not self.api_key:
+            print("[OPENAI] No API key available for text embedding")
+            return results
+        
+        for batch in self._embedding_batches(texts):
+            try:
+                response = self._post("/embeddings", {
+                    "input": [texts[index] for index in batch],
+                    "model": model
+                })
                 
-        except Exception as e:
-            print(f"[OPENAI] Error generating text embedding: {e}")
-            return None
+                if response.status_code == 200:
+                    for item in response.json()['data']:
+                        results[batch[item['index']]] = item['embedding']
+                else:
+                    print(f"[OPENAI] Text embedding failed: {response.status_code} - {response.text}")
+                    
+            except Exception as e:
+                print(f"[OPENAI] Error generating text embeddings: {e}")
+        
+        return results
+    
+    async def get_text_embeddings_async(self, texts: List[str], model: str = "text-embedding-3-small") -> List[Optional[List[float]]]:
+        """Async variant of get_text_embeddings; batches are sent concurrently"""
+        results = [None] * len(texts)
+        if not self.api_key:
+            print("[OPENAI] No API key available for text embedding")
+            return results
+        
+        async def embed_batch(batch):
+            try:
+                status, body = await self._post_async("/embeddings", {
+                    "input": [texts[index] for index in batch],
+                    "model": model
+                })
+                if status == 200:
+                    for item in body['data']:
+                        results[batch[item['index']]] = item['embedding']
+                else:
+                    print(f"[OPENAI] Text embedding failed: {status} - {body}")
+            except Exception as e:
+                print(f"[OPENAI] Error generating text embeddings: {e}")
+        
+        await asyncio.gather(*(embed_batch(batch) for batch in self._embedding_batches(texts)))
+        return results
+    
+    def _embedding_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group indexes of non-empty inputs into requests under the input-count and size limits"""
+        batches = []
+        batch, batch_chars = [], 0
+        for index, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_chars + len(text) > EMBEDDING_BATCH_CHARS):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(index)
+            batch_chars += len(text)
+        if batch:
+            batches.append(batch)
+        return batches
     
     def get_image_embedding(self, image_base64: str, model: str = "clip-vit-base-patch32") -> Optional[List[float]]:
         """Generate image embedding using OpenAI Vision"""
@@ -107,43 +247,7 @@ class OpenAIService:
             return None
             
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # Ensure the base64 data has proper prefix
-            if not image_base64.startswith('data:image'):
-                image_base64 = f"data:image/jpeg;base64,{image_base64}"
-            
-            data = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Describe this product image in detail, focusing on: 1) Type of product, 2) Color and style, 3) Key features and characteristics, 4) Material or texture if visible, 5) Overall appearance. Be concise but descriptive for search purposes."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_base64
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 200
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            response = self._post("/chat/completions", self._describe_image_request(image_base64))
             
             if response.status_code == 200:
                 result = response.json()
@@ -158,6 +262,55 @@ class OpenAIService:
             print(f"[OPENAI] Error describing image: {e}")
             return None
     
+    async def describe_image_async(self, image_base64: str) -> Optional[str]:
+        """Async variant of describe_image"""
+        if not self.api_key:
+            print("[OPENAI] No API key available for image description")
+            return None
+        
+        try:
+            status, body = await self._post_async("/chat/completions", self._describe_image_request(image_base64))
+            
+            if status == 200:
+                description = body['choices'][0]['message']['content']
+                print(f"[OPENAI] Generated image description: {description[:100]}...")
+                return description
+            else:
+                print(f"[OPENAI] Image description failed: {status} - {body}")
+                return None
+                
+        except Exception as e:
+            print(f"[OPENAI] Error describing image: {e}")
+            return None
+    
+    def _describe_image_request(self, image_base64: str) -> Dict:
+        """Request body asking gpt-4o-mini to describe a product image"""
+        # Ensure the base64 data has proper prefix
+        if not image_base64.startswith('data:image'):
+            image_base64 = f"data:image/jpeg;base64,{image_base64}"
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "Describe this product image in detail, focusing on: 1) Type of product, 2) Color and style, 3) Key features and characteristics, 4) Material or texture if visible, 5) Overall appearance. Be concise but descriptive for search purposes."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_base64
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 200
+        }
+    
     def search_images_by_text(self, query: str, image_descriptions: List[Dict]) -> List[Dict]:
         """Search images using text query against image descriptions"""
         if not self.api_key or not image_descriptions:
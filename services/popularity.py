@@ -0,0 +1,216 @@
+"""
+Click-through popularity signal for search ranking
+
+Per-product popularity is computed from the daily agent_product_rollups rows
+(impressions and clicks by result position) and held in memory as a dense
+float array indexed by SKU id, so ranking only does an array lookup per result.
+
+Impressions are position-debiased: each impression is weighted by the
+probability that a shopper looks at that position at all (its examination
+propensity, estimated from the aggregate CTR by position relative to the top
+slot). A product's CTR is clicks over examined impressions, smoothed towards
+the catalog-wide CTR, and mapped to a score in (0, 1) where an average or
+unseen product scores 0.5.
+
+Each process refreshes its own copy in a background thread once it is older
+than POPULARITY_REFRESH_INTERVAL seconds; until the first load completes the
+ranking stage leaves results in similarity order.
+"""
+
+import math
+import os
+import threading
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import func
+
+from database import db
+from models.analytics import AgentProductRollup
+
+
+NEUTRAL_SCORE = 0.5
+
+
+def default_propensity(position: int) -> float:
+    """Examination propensity used where a position has too few impressions to estimate"""
+    if position <= 1:
+        return 1.0
+    return 1.0 / math.log2(position + 1)
+
+
+class PopularityIndex:
+    """Dense per-product popularity scores, refreshed periodically from the rollups"""
+
+    def __init__(self, window_days: int = None, prior_weight: float = None,
+                 refresh_interval: float = None, min_position_impressions: int = None):
+        self.window_days = window_days or int(os.getenv('POPULARITY_WINDOW_DAYS', 30))
+        self.prior_weight = prior_weight or float(os.getenv('POPULARITY_PRIOR_WEIGHT', 20))
+        self.refresh_interval = refresh_interval or float(os.getenv('POPULARITY_REFRESH_INTERVAL', 600))
+        self.min_position_impressions = min_position_impressions or int(
+            os.getenv('POPULARITY_MIN_POSITION_IMPRESSIONS', 200))
+        self.weight = float(os.getenv('POPULARITY_WEIGHT', 0.15))
+
+        self._scores = array('f')
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.propensities = {}
+        self.products = 0
+
+    def score(self, product_id) -> float:
+        """Popularity of a product in (0, 1); NEUTRAL_SCORE when unknown"""
+        scores = self._scores
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return NEUTRAL_SCORE
+        if 0 <= product_id < len(scores):
+            return scores[product_id]
+        return NEUTRAL_SCORE
+
+    def blend(self, product_id, similarity: float, weight: float = None) -> float:
+        """Blend vector similarity with popularity"""
+        weight = self.weight if weight is None else weight
+        return (1 - weight) * similarity + weight * self.score(product_id)
+
+    def rerank(self, results: List[Dict], weight: float = None, sources: Iterable[str] = None) -> List[Dict]:
+        """Reorder search result dicts (with product_id and _additional.distance) by blended score
+
+        With sources, only results whose _source is one of them are reordered,
+        and only among the slots held by the same source: distances from
+        different searches (or the synthetic ones of keyword hits) are not on
+        one scale, so every other result keeps its position.
+        """
+        weight = self.weight if weight is None else weight
+        if not results or weight <= 0 or not self.products:
+            return results
+
+        def blended(result):
+            similarity = 1 - (result.get('_additional') or {}).get('distance', 1)
+            return self.blend(result.get('product_id'), similarity, weight)
+
+        if sources is None:
+            return sorted(results, key=blended, reverse=True)
+
+        slots = defaultdict(list)
+        for position, result in enumerate(results):
+            if result.get('_source') in sources:
+                slots[result.get('_source')].append(position)
+        reranked = list(results)
+        for positions in slots.values():
+            ordered = sorted((results[position] for position in positions), key=blended, reverse=True)
+            for position, result in zip(positions, ordered):
+                reranked[position] = result
+        return reranked
+
+    def _position_propensities(self, since) -> Dict[int, float]:
+        """Examination propensity per position, from aggregate CTR relative to the top position"""
+        rows = db.session.query(
+            AgentProductRollup.position,
+            func.sum(AgentProductRollup.impressions),
+            func.sum(AgentProductRollup.clicks)
+        ).filter(
+            AgentProductRollup.granularity == 'day',
+            AgentProductRollup.bucket_start >= since,
+            AgentProductRollup.position > 0
+        ).group_by(AgentProductRollup.position).all()
+
+        ctr = {position: clicks / shown for position, shown, clicks in rows
+               if shown and shown >= self.min_position_impressions}
+        top = ctr.get(1)
+        propensities = {}
+        for position, _, _ in rows:
+            if top and position in ctr:
+                # Propensity can't exceed the top slot's, and never drops to zero
+                propensities[position] = min(1.0, max(0.05, ctr[position] / top))
+            else:
+                propensities[position] = default_propensity(position)
+        return propensities
+
+    def compute(self) -> array:
+        """Build the score array from the rollups (needs an app context)"""
+        from models.sku import SKU
+
+        since = datetime.utcnow() - timedelta(days=self.window_days)
+        propensities = self._position_propensities(since)
+
+        rows = db.session.query(
+            AgentProductRollup.product_id,
+            AgentProductRollup.position,
+            func.sum(AgentProductRollup.impressions),
+            func.sum(AgentProductRollup.clicks)
+        ).filter(
+            AgentProductRollup.granularity == 'day',
+            AgentProductRollup.bucket_start >= since
+        ).group_by(AgentProductRollup.product_id, AgentProductRollup.position).all()
+
+        examined = {}
+        clicks = {}
+        for product_id, position, shown, clicked in rows:
+            propensity = propensities.get(position, default_propensity(position)) if position > 0 else 1.0
+            examined[product_id] = examined.get(product_id, 0.0) + (shown or 0) * propensity
+            clicks[product_id] = clicks.get(product_id, 0) + (clicked or 0)
+
+        total_examined = sum(examined.values())
+        prior_ctr = sum(clicks.values()) / total_examined if total_examined else 0.0
+
+        max_id = db.session.query(func.max(SKU.id)).scalar() or 0
+        if examined:
+            max_id = max(max_id, max(examined))
+        scores = array('f', [NEUTRAL_SCORE]) * (max_id + 1)
+        if prior_ctr > 0:
+            for product_id, weight in examined.items():
+                ctr = (clicks[product_id] + prior_ctr * self.prior_weight) / (weight + self.prior_weight)
+                scores[product_id] = ctr / (ctr + prior_ctr)
+
+        self.propensities = propensities
+        self.products = len(examined)
+        return scores
+
+    def refresh(self):
+        """Recompute the scores and swap them in (needs an app context)"""
+        started = time.time()
+        scores = self.compute()
+        self._scores = scores
+        self._loaded_at = time.time()
+        print(f"[POPULARITY] Scored {self.products} products ({len(scores)} slots) "
+              f"in {(self._loaded_at - started) * 1000:.0f}ms")
+
+    def refresh_if_stale(self, app):
+        """Start a background refresh when the scores are older than the refresh interval"""
+        if time.time() - self._loaded_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception as e:
+                print(f"[POPULARITY] Refresh failed: {e}")
+                # Keep the previous scores and retry after half an interval, not on every request
+                self._loaded_at = time.time() - self.refresh_interval / 2
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='popularity-refresh', daemon=True).start()
+
+
+_popularity_index = None
+
+
+def get_popularity_index(app=None) -> PopularityIndex:
+    """Process-wide popularity index; passing the app schedules a refresh when stale"""
+    global _popularity_index
+    if _popularity_index is None:
+        _popularity_index = PopularityIndex()
+    if app is not None:
+        _popularity_index.refresh_if_stale(app)
+    return _popularity_index
@@ -0,0 +1,216 @@
+"""
+Product filtering shared by the catalog, search, the shopping agent and the MCP server
+
+A ProductFilterSpec holds the filters; ProductQueryEngine turns it into SQL
+(SKU queries with eager loading and pagination) and, for vector searches,
+decides which filters can be pushed into Weaviate. Vendor, product type and
+price are stored on the Weaviate objects, so they go into the vector search's
+where filter and the top-k is drawn from matching products only. Categories,
+stock, options and canonical product types exist only in SQL; when any are
+set the vector search over-fetches. Every filter is then checked in SQL
+against the candidate ids, so a stale vector index can never leak a
+non-matching product.
+"""
+
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
+
+from models.category import Category
+from models.sku import SKU, ProductOption
+from services.product_taxonomy import PRODUCT_TYPE_SYNONYMS, normalize_product_types
+
+
+VECTOR_OVERFETCH = 3  # Candidates per requested result when SQL-only filters will drop some
+
+SORT_ORDERS = {
+    'price-low': lambda: SKU.price.asc(),
+    'price-high': lambda: SKU.price.desc(),
+    'name-asc': lambda: SKU.title.asc(),
+    'name-desc': lambda: SKU.title.desc(),
+    'newest': lambda: SKU.created_at.desc(),
+}
+
+
+def _ints(values) -> List[int]:
+    result = []
+    for value in values or []:
+        try:
+            result.append(int(value))
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+def _strings(values) -> List[str]:
+    return [str(value) for value in values or [] if value]
+
+
+def _float(value) -> Optional[float]:
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProductFilterSpec:
+    """Filters for a product query"""
+
+    def __init__(self, categories: Iterable = None, vendors: Iterable[str] = None,
+                 product_types: Iterable[str] = None, min_price: float = None, max_price: float = None,
+                 stock: str = 'all', options: Dict[str, List[str]] = None, canonical_types: Iterable[str] = None):
+        self.categories = _ints(categories)  # Category ids
+        self.vendors = _strings(vendors)
+        self.product_types = _strings(product_types)  # Exact SKU.product_type values
+        self.canonical_types = normalize_product_types(_strings(canonical_types))  # 'jeans' -> 'pants'
+        self.min_price = _float(min_price)
+        self.max_price = _float(max_price)
+        self.stock = stock if stock in ('in_stock', 'out_of_stock') else 'all'
+        self.options = {name: _strings(values) for name, values in (options or {}).items() if values}
+
+    @classmethod
+    def from_search_filters(cls, filters: Dict) -> 'ProductFilterSpec':
+        """Spec from the search page's JSON filters (minPrice, productTypes, inStock, ...)"""
+        if not filters:
+            return cls()
+        in_stock, out_of_stock = filters.get('inStock', True), filters.get('outOfStock', False)
+        if in_stock and not out_of_stock:
+            stock = 'in_stock'
+        elif out_of_stock and not in_stock:
+            stock = 'out_of_stock'
+        else:
+            stock = 'all'
+        return cls(categories=filters.get('categories'), vendors=filters.get('vendors'),
+                   product_types=filters.get('productTypes'), min_price=filters.get('minPrice'),
+                   max_price=filters.get('maxPrice'), stock=stock, options=filters.get('options'))
+
+    @classmethod
+    def from_request_args(cls, args) -> 'ProductFilterSpec':
+        """Spec from catalog query parameters; list filters may repeat or be comma-separated"""
+        def listed(name):
+            return [value for raw in args.getlist(name) for value in raw.split(',') if value]
+
+        return cls(categories=listed('categories'), vendors=listed('vendors'),
+                   product_types=listed('product_types'), min_price=args.get('min_price'),
+                   max_price=args.get('max_price'), stock=args.get('stock', 'all'))
+
+    def is_empty(self) -> bool:
+        return not (self.categories or self.vendors or self.product_types or self.canonical_types or self.options
+                    or self.min_price is not None or self.max_price is not None or self.stock != 'all')
+
+    def has_sql_only_filters(self) -> bool:
+        """Whether some filters can't be evaluated by Weaviate"""
+        return bool(self.categories or self.canonical_types or self.options or self.stock != 'all')
+
+    def weaviate_where(self) -> Optional[Dict]:
+        """Weaviate where filter for the filters stored on the vector objects"""
+        operands = []
+        for path, values in (('vendor', self.vendors), ('product_type', self.product_types)):
+            if values:
+                matches = [{'path': [path], 'operator': 'Equal', 'valueString': value} for value in values]
+                operands.append(matches[0] if len(matches) == 1 else {'operator': 'Or', 'operands': matches})
+        if self.min_price is not None:
+            operands.append({'path': ['price'], 'operator': 'GreaterThanEqual', 'valueNumber': self.min_price})
+        if self.max_price is not None:
+            operands.append({'path': ['price'], 'operator': 'LessThanEqual', 'valueNumber': self.max_price})
+
+        if not operands:
+            return None
+        return operands[0] if len(operands) == 1 else {'operator': 'And', 'operands': operands}
+
+
+class ProductQueryEngine:
+    """Plans and runs filtered product queries"""
+
+    EAGER_LOADS = (
+        selectinload(SKU.images),
+        selectinload(SKU.variants),
+        selectinload(SKU.options),
+        selectinload(SKU.categories),
+    )
+
+    def apply(self, query, spec: ProductFilterSpec):
+        """Add the spec's filters to a SKU query"""
+        if spec.categories:
+            # EXISTS rather than a join, so products in several categories aren't repeated
+            query = query.filter(SKU.categories.any(Category.id.in_(spec.categories)))
+        if spec.vendors:
+            query = query.filter(SKU.vendor.in_(spec.vendors))
+        if spec.product_types:
+            query = query.filter(SKU.product_type.in_(spec.product_types))
+        if spec.canonical_types:
+            # Taxonomy types use the indexed column; types outside the taxonomy fall back to the title
+            known = [value for value in spec.canonical_types if value in PRODUCT_TYPE_SYNONYMS]
+            conditions = [SKU.canonical_product_type.in_(known)] if known else []
+            conditions += [SKU.title.ilike(f'%{value}%') for value in spec.canonical_types if value not in known]
+            query = query.filter(or_(*conditions))
+        if spec.min_price is not None:
+            query = query.filter(SKU.price >= spec.min_price)
+        if spec.max_price is not None:
+            query = query.filter(SKU.price <= spec.max_price)
+        if spec.stock == 'in_stock':
+            query = query.filter(SKU.quantity > 0)
+        elif spec.stock == 'out_of_stock':
+            query = query.filter(SKU.quantity == 0)
+        for name, values in spec.options.items():
+            # ProductOption.values is a JSON array, so match the quoted value
+            query = query.filter(SKU.options.any(and_(
+                ProductOption.name == name,
+                or_(*[ProductOption.values.like(f'%{json.dumps(value)}%') for value in values])
+            )))
+        return query
+
+    def sort(self, query, sort: str):
+        """Order a SKU query by one of the catalog sort keys; relevance is left to the caller"""
+        order = SORT_ORDERS.get(sort)
+        return query.order_by(order()) if order else query
+
+    def with_relations(self, query):
+        """Eager-load everything SKU.to_dict() reads"""
+        return query.options(*self.EAGER_LOADS)
+
+    def find(self, spec: ProductFilterSpec, limit: int = 20, sort: str = None, relations=None) -> List[SKU]:
+        """Matching SKUs with the given relationships (default: all of them) eager-loaded"""
+        query = self.sort(self.apply(SKU.query, spec), sort)
+        if relations is None:
+            query = self.with_relations(query)
+        else:
+            query = query.options(*[selectinload(relation) for relation in relations])
+        return query.limit(limit).all()
+
+    def paginate(self, query, page: int, per_page: int) -> Tuple[List[SKU], int]:
+        """One page of an already filtered and sorted SKU query, plus the total count"""
+        pagination = self.with_relations(query).paginate(page=page, per_page=per_page, error_out=False)
+        return pagination.items, pagination.total
+
+    def fetch(self, product_ids: Iterable[int]) -> Dict[int, SKU]:
+        """SKUs by id, eager-loaded, in one query"""
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids:
+            return {}
+        return {sku.id: sku for sku in self.with_relations(SKU.query.filter(SKU.id.in_(product_ids))).all()}
+
+    def filter_ids(self, product_ids: Iterable[int], spec: ProductFilterSpec) -> set:
+        """The subset of product ids that match the spec"""
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids:
+            return set()
+        query = self.apply(SKU.query.with_entities(SKU.id).filter(SKU.id.in_(product_ids)), spec)
+        return {row.id for row in query.all()}
+
+    def filter_results(self, results: List[Dict], spec: ProductFilterSpec) -> List[Dict]:
+        """Search result dicts (with product_id) that match the spec, in their original order"""
+        if spec.is_empty() or not results:
+            return results
+        allowed = self.filter_ids((result.get('product_id') for result in results), spec)
+        return [result for result in results if result.get('product_id') in allowed]
+
+    def vector_search(self, weaviate_service, text: str, spec: ProductFilterSpec, limit: int = 10) -> List[Dict]:
+        """Text vector search with Weaviate-side filters pushed down and the rest applied in SQL"""
+        fetch_limit = limit * VECTOR_OVERFETCH if spec.has_sql_only_filters() else limit
+        results = weaviate_service.search_by_text(text, limit=fetch_limit, where=spec.weaviate_where())
+        return self.filter_results(results, spec)[:limit]
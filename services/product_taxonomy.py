@@ -0,0 +1,85 @@
+"""
+Product type taxonomy
+
+Maps free-form product types, titles and tags onto a small set of canonical
+types (shirt, pants, shoes, dress, jacket) through a synonym table. SKUs get
+their canonical type at write time (SKU.canonical_product_type, indexed), so
+a product-type filter is a plain WHERE instead of a keyword scan of titles.
+"""
+
+import re
+from typing import Iterable, List, Optional
+
+
+PRODUCT_TYPE_SYNONYMS = {
+    "shirt": ["shirt", "blouse", "top", "tee", "t-shirt", "tshirt", "polo", "tank top", "tunic",
+              "sweatshirt", "overshirt", "undershirt"],
+    "pants": ["pant", "pants", "jean", "jeans", "trouser", "trousers", "slack", "slacks", "legging", "leggings",
+              "chino", "chinos", "jogger", "joggers", "sweatpant", "sweatpants", "trackpant", "trackpants",
+              "jegging", "jeggings"],
+    "shoes": ["shoe", "shoes", "sneaker", "sneakers", "boot", "boots", "sandal", "sandals", "heel", "heels",
+              "loafer", "loafers", "trainer", "trainers", "snowboot", "snowboots", "workboot", "workboots",
+              "stiletto", "stilettos"],
+    "dress": ["dress", "dresses", "gown", "frock", "sundress", "nightdress", "minidress", "maxidress", "shirtdress"],
+    "jacket": ["jacket", "coat", "blazer", "hoodie", "cardigan", "sweater", "parka", "raincoat", "overcoat",
+               "topcoat", "trenchcoat", "windbreaker"],
+}
+
+
+def _plural(word: str) -> str:
+    return word + 'es' if word.endswith(('s', 'sh', 'ch', 'x')) else word + 's'
+
+
+# Every synonym and its plural, mapped to the canonical type
+SYNONYM_INDEX = {}
+for _canonical, _synonyms in PRODUCT_TYPE_SYNONYMS.items():
+    for _synonym in [_canonical] + _synonyms:
+        SYNONYM_INDEX.setdefault(_synonym, _canonical)
+        SYNONYM_INDEX.setdefault(_plural(_synonym), _canonical)
+
+# Whole words only, so "laptop" is not a top; compound garments ("sweatpants") are listed as synonyms
+_PHRASE = re.compile(r"\b(" + "|".join(
+    re.escape(synonym) for synonym in sorted(SYNONYM_INDEX, key=len, reverse=True)
+) + r")\b")
+
+
+def _types_in(text: Optional[str]) -> List[str]:
+    """Canonical types mentioned in a text, in order of appearance"""
+    if not text:
+        return []
+    return [SYNONYM_INDEX[match] for match in _PHRASE.findall(text.lower())]
+
+
+def canonical_product_type(product_type: str = None, title: str = None, tags: str = None) -> Optional[str]:
+    """Canonical type of a product, from its product type, else its title, else its tags
+
+    The last match wins ("Shirt Jacket" is a jacket), as the head noun of a
+    product name usually comes last.
+    """
+    for text in (product_type, title, tags):
+        types = _types_in(text)
+        if types:
+            return types[-1]
+    return None
+
+
+def normalize_product_type(value: str) -> Optional[str]:
+    """Canonical type for a requested type such as 'Jeans' or 'sneakers', or None if unknown"""
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in PRODUCT_TYPE_SYNONYMS:
+        return value
+    return SYNONYM_INDEX.get(value) or canonical_product_type(value)
+
+
+def normalize_product_types(values: Iterable[str]) -> List[str]:
+    """Canonical types for requested types, keeping unknown ones lowercased, without duplicates"""
+    result = []
+    for value in values or []:
+        if not value:
+            continue
+        normalized = normalize_product_type(value) or value.strip().lower()
+        if normalized not in result:
+            result.append(normalized)
+    return result
@@ -0,0 +1,308 @@
+"""
+Item-to-item recommendations from shopping agent sessions
+
+Each agent session is treated as a sparse vector over products: a product the
+session was shown weighs SHOWN_WEIGHT and one it clicked weighs CLICKED_WEIGHT.
+product_cooccurrences holds the sum over sessions of w_a * w_b for every pair
+of products (and w_a ** 2 on the diagonal), so the cosine similarity of two
+products is C_ab / sqrt(C_aa * C_bb).
+
+The matrix is updated incrementally from agent_product_interactions past a
+high-water mark: every session's folded product weights are kept in
+cooccurrence_sessions, and for each session touched by a batch the pair
+weights before and after the batch are compared and only the differences are
+written. The stored weights (not the raw interactions, which analytics
+retention deletes) are the "before", so a returning session is never counted
+twice. The top-k neighbour list of every product whose row changed is then
+rebuilt, so serving is a primary-key lookup per seed product.
+"""
+
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import or_
+
+from database import db
+from models.agent import AgentConversation, AgentProductInteraction
+from models.analytics import AnalyticsWatermark
+from models.recommendation import CooccurrenceSession, ProductCooccurrence, ProductNeighborList
+from services.job_queue import register_job_handler, register_periodic_job
+
+
+BATCH_SIZE = 5000
+SHOWN_WEIGHT = 1.0
+CLICKED_WEIGHT = 3.0
+MAX_SESSION_ITEMS = 50  # Only a session's first distinct products count, bounding pairs per session
+MIN_SUPPORT = 2.0  # Minimum co-occurrence weight for a neighbour
+NEIGHBORS_PER_PRODUCT = int(os.getenv('RECOMMENDATION_NEIGHBORS', 20))
+SOURCE = 'cooccurrence'
+WATERMARK_SOURCE = 'product_cooccurrence'
+
+
+def session_items(rows: Iterable, items: Dict[int, float] = None) -> Dict[int, float]:
+    """Product weights for one session, extending items with its (product_id, interaction_type) rows in id order"""
+    items = dict(items or {})
+    for row in rows:
+        weight = CLICKED_WEIGHT if row.interaction_type == 'clicked' else SHOWN_WEIGHT
+        if row.product_id in items:
+            items[row.product_id] = max(items[row.product_id], weight)
+        elif len(items) < MAX_SESSION_ITEMS:
+            items[row.product_id] = weight
+    return items
+
+
+def pair_deltas(old: Dict[int, float], new: Dict[int, float]) -> Dict[Tuple[int, int], float]:
+    """Changes to the co-occurrence weights when a session's items go from old to new"""
+    deltas = {}
+    changed = [product_id for product_id, weight in new.items() if old.get(product_id) != weight]
+    changed_set = set(changed)
+    for product_id in changed:
+        deltas[(product_id, product_id)] = new[product_id] ** 2 - old.get(product_id, 0) ** 2
+        for other_id, other_weight in new.items():
+            if other_id == product_id or (other_id in changed_set and other_id < product_id):
+                continue
+            delta = new[product_id] * other_weight - old.get(product_id, 0) * old.get(other_id, 0)
+            deltas[(product_id, other_id)] = delta
+            deltas[(other_id, product_id)] = delta
+    return deltas
+
+
+def _apply_deltas(deltas: Dict[Tuple[int, int], float]):
+    """Add weight deltas to ProductCooccurrence rows, creating missing pairs"""
+    existing = ProductCooccurrence.query.filter(
+        ProductCooccurrence.product_id.in_({key[0] for key in deltas}),
+        ProductCooccurrence.other_id.in_({key[1] for key in deltas})
+    ).all()
+    rows = {(row.product_id, row.other_id): row for row in existing}
+
+    for (product_id, other_id), delta in deltas.items():
+        row = rows.get((product_id, other_id))
+        if row is None:
+            db.session.add(ProductCooccurrence(product_id=product_id, other_id=other_id, weight=delta))
+        else:
+            row.weight = (row.weight or 0) + delta
+
+
+def _fold_sessions(rows_by_session: Dict[str, List]) -> Dict[Tuple[int, int], float]:
+    """Extend the stored items of each session with its new rows; returns the summed pair deltas"""
+    states = {state.session_id: state for state in CooccurrenceSession.query.filter(
+        CooccurrenceSession.session_id.in_(list(rows_by_session))
+    ).all()}
+
+    deltas = defaultdict(float)
+    for session_id, rows in rows_by_session.items():
+        state = states.get(session_id)
+        if state is None:
+            state = CooccurrenceSession(session_id=session_id)
+            db.session.add(state)
+        old = state.get_items()
+        new = session_items(rows, old)
+        for key, delta in pair_deltas(old, new).items():
+            deltas[key] += delta
+        state.set_items(new)
+    return deltas
+
+
+def update_cooccurrence(batch_size: int = BATCH_SIZE) -> Tuple[int, set]:
+    """Fold the next batch of interactions into the co-occurrence matrix
+
+    Returns the number of interactions processed and the products whose rows changed.
+    """
+    last_id = AnalyticsWatermark.get_last_id(WATERMARK_SOURCE)
+    batch = db.session.query(
+        AgentProductInteraction.id, AgentProductInteraction.product_id,
+        AgentProductInteraction.interaction_type, AgentConversation.session_id
+    ).outerjoin(AgentConversation, AgentProductInteraction.conversation_id == AgentConversation.id).filter(
+        AgentProductInteraction.id > last_id
+    ).order_by(AgentProductInteraction.id).limit(batch_size).all()
+    if not batch:
+        return 0, set()
+    # Claim the batch first; a concurrent run that read the same watermark must not fold it again
+    if not AnalyticsWatermark.advance(WATERMARK_SOURCE, last_id, batch[-1].id):
+        db.session.rollback()
+        print(f"[RECOMMEND] Interactions after id {last_id} were already folded by another run")
+        return 0, set()
+
+    rows_by_session = defaultdict(list)
+    for row in batch:
+        if row.session_id and row.product_id is not None:
+            rows_by_session[row.session_id].append(row)
+
+    deltas = _fold_sessions(rows_by_session) if rows_by_session else {}
+    if deltas:
+        _apply_deltas(deltas)
+    db.session.commit()
+    return len(batch), {key[0] for key in deltas}
+
+
+def backfill_sessions(batch_size: int = BATCH_SIZE) -> int:
+    """Rebuild cooccurrence_sessions from the raw interactions already folded into the matrix
+
+    For databases whose matrix predates the session table; sessions whose raw
+    rows were already compacted cannot be recovered.
+    """
+    last_id = AnalyticsWatermark.get_last_id(WATERMARK_SOURCE)
+    rows_by_session = defaultdict(list)
+    for row in db.session.query(
+        AgentProductInteraction.product_id, AgentProductInteraction.interaction_type, AgentConversation.session_id
+    ).join(AgentConversation, AgentProductInteraction.conversation_id == AgentConversation.id).filter(
+        AgentProductInteraction.id <= last_id,
+        AgentProductInteraction.product_id.isnot(None)
+    ).order_by(AgentProductInteraction.id).yield_per(batch_size):
+        rows_by_session[row.session_id].append(row)
+
+    known = {session_id for (session_id,) in db.session.query(CooccurrenceSession.session_id)}
+    added = 0
+    for session_id, rows in rows_by_session.items():
+        if session_id not in known:
+            state = CooccurrenceSession(session_id=session_id)
+            state.set_items(session_items(rows))
+            db.session.add(state)
+            added += 1
+    db.session.commit()
+    return added
+
+
+def rebuild_neighbor_lists(product_ids: Iterable[int], k: int = NEIGHBORS_PER_PRODUCT) -> int:
+    """Recompute the top-k co-occurrence neighbours (by cosine) of the given products"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+
+    pairs = defaultdict(dict)
+    for row in ProductCooccurrence.query.filter(ProductCooccurrence.product_id.in_(product_ids)).all():
+        pairs[row.product_id][row.other_id] = row.weight
+
+    candidates = {other_id for others in pairs.values() for other_id, weight in others.items()
+                  if weight >= MIN_SUPPORT}
+    norms = {row.product_id: row.weight for row in ProductCooccurrence.query.filter(
+        ProductCooccurrence.product_id.in_(candidates | set(product_ids)),
+        ProductCooccurrence.other_id == ProductCooccurrence.product_id
+    ).all()}
+
+    existing = {row.product_id: row for row in ProductNeighborList.query.filter(
+        ProductNeighborList.source == SOURCE,
+        ProductNeighborList.product_id.in_(product_ids)
+    ).all()}
+
+    for product_id in product_ids:
+        others = pairs.get(product_id, {})
+        scored = []
+        for other_id, weight in others.items():
+            if other_id == product_id or weight < MIN_SUPPORT:
+                continue
+            denominator = math.sqrt((norms.get(product_id) or 0) * (norms.get(other_id) or 0))
+            if denominator > 0:
+                scored.append((other_id, round(weight / denominator, 4)))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+
+        row = existing.get(product_id)
+        if row is None:
+            row = ProductNeighborList(product_id=product_id, source=SOURCE)
+            db.session.add(row)
+        row.neighbors = json.dumps(scored[:k])
+
+    db.session.commit()
+    return len(product_ids)
+
+
+def get_neighbors(product_ids: List[int], limit: int = 10, source: str = SOURCE,
+                  exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+    """Top neighbours of one or more seed products, merged by summed score"""
+    if not product_ids:
+        return []
+    lists = ProductNeighborList.query.filter(
+        ProductNeighborList.source == source,
+        ProductNeighborList.product_id.in_(product_ids)
+    ).all()
+
+    excluded = set(exclude) | set(product_ids)
+    scores = defaultdict(float)
+    for neighbor_list in lists:
+        for other_id, score in neighbor_list.get_neighbors():
+            if other_id not in excluded:
+                scores[other_id] += score
+    ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+    return [(product_id, round(score, 4)) for product_id, score in ranked]
+
+
+def session_product_ids(session_id: str, limit: int = 10) -> List[int]:
+    """Products a session interacted with, clicked ones first, then most recently shown"""
+    rows = db.session.query(
+        AgentProductInteraction.product_id, AgentProductInteraction.interaction_type
+    ).join(AgentConversation, AgentProductInteraction.conversation_id == AgentConversation.id).filter(
+        AgentConversation.session_id == session_id,
+        AgentProductInteraction.product_id.isnot(None)
+    ).order_by(AgentProductInteraction.id.desc()).limit(200).all()
+
+    clicked = [row.product_id for row in rows if row.interaction_type == 'clicked']
+    shown = [row.product_id for row in rows if row.interaction_type != 'clicked']
+    return list(dict.fromkeys(clicked + shown))[:limit]
+
+
+def recommend_for_session(session_id: str, preferences: Dict = None, limit: int = 10) -> List:
+    """SKUs that co-occur with the session's products, filtered by preferences, best first
+
+    Preferences: price_range {min, max}, vendors, categories (ids) and
+    category_names (matched against Category.name).
+    """
+    from models.category import Category
+    from models.sku import SKU
+
+    seeds = session_product_ids(session_id)
+    neighbors = get_neighbors(seeds, limit=limit * 3)
+    if not neighbors:
+        return []
+
+    preferences = preferences or {}
+    query = SKU.query.filter(SKU.id.in_([product_id for product_id, _ in neighbors]), SKU.quantity > 0)
+    price_range = preferences.get('price_range') or {}
+    if price_range.get('min'):
+        query = query.filter(SKU.price >= price_range['min'])
+    if price_range.get('max'):
+        query = query.filter(SKU.price <= price_range['max'])
+    if preferences.get('vendors'):
+        query = query.filter(SKU.vendor.in_(preferences['vendors']))
+    if preferences.get('categories'):
+        query = query.filter(SKU.categories.any(Category.id.in_(preferences['categories'])))
+    if preferences.get('category_names'):
+        # Keywords from the conversation; ignored when no category is named like them
+        category_ids = [row.id for row in Category.query.with_entities(Category.id).filter(
+            or_(*[Category.name.ilike(f'%{name}%') for name in preferences['category_names']])
+        ).all()]
+        if category_ids:
+            query = query.filter(SKU.categories.any(Category.id.in_(category_ids)))
+
+    skus = {sku.id: sku for sku in query.all()}
+    return [skus[product_id] for product_id, _ in neighbors if product_id in skus][:limit]
+
+
+@register_job_handler('product_cooccurrence')
+def run_cooccurrence_job(job):
+    """Job handler: catch the co-occurrence matrix up with new interactions and rebuild changed lists"""
+    processed = 0
+    touched = set()
+    while True:
+        job.raise_if_cancelled()
+        count, changed = update_cooccurrence(job.payload.get('batch_size', BATCH_SIZE))
+        if not count:
+            break
+        processed += count
+        touched |= changed
+        job.update_progress(processed=processed, operation='Updating product co-occurrence')
+
+    rebuilt = 0
+    touched = sorted(touched)
+    for start in range(0, len(touched), 500):
+        job.raise_if_cancelled()
+        rebuilt += rebuild_neighbor_lists(touched[start:start + 500])
+
+    job.update_progress(processed=processed, force=True,
+                        log=f'Folded {processed} interactions; rebuilt {rebuilt} neighbour lists')
+    print(f"[RECOMMEND] Folded {processed} interactions, rebuilt {rebuilt} neighbour lists")
+
+
+register_periodic_job('product_cooccurrence', float(os.getenv('RECOMMENDATION_REFRESH_INTERVAL', 600)))
@@ -0,0 +1,219 @@
+"""
+Precomputed nearest neighbours from the product vectors
+
+A batch job reads every product vector from the live Weaviate class, L2
+normalises them into one matrix and computes each product's top-k cosine
+neighbours with blocked matrix products. The lists are stored in
+product_neighbor_lists (source 'vector'), so "similar products" is a single
+primary-key lookup instead of an embedding plus a vector search.
+
+The periodic run is incremental: it first checks in SQL whether any SKU
+changed or was deleted and stops there if not. Otherwise only SKUs updated
+since their list was written (or without a list) are recomputed in full. Every other list is
+patched by merging in the changed products that now beat its k-th score,
+and lists that referenced a changed or deleted product are recomputed.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from database import db
+from models.recommendation import ProductNeighborList
+from models.sku import SKU
+from services.job_queue import register_job_handler, register_periodic_job
+
+
+SOURCE = 'vector'
+NEIGHBORS_PER_PRODUCT = int(os.getenv('VECTOR_NEIGHBORS', 20))
+BLOCK_SIZE = 1024  # Rows per matrix product, bounding memory at BLOCK_SIZE x products floats
+
+
+ProgressCallback = Optional[Callable[[int], None]]
+
+
+def load_vectors(weaviate_service, class_name: str = None, progress: ProgressCallback = None):
+    """Product ids and their L2-normalised vectors as a float32 matrix"""
+    import numpy as np
+
+    ids, vectors = [], []
+    for product_id, vector in weaviate_service.iter_product_vectors(class_name):
+        ids.append(product_id)
+        vectors.append(vector)
+        if progress and len(ids) % 500 == 0:
+            progress(len(ids))
+    if not ids:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.asarray(ids, dtype=np.int64), matrix / norms
+
+
+def top_k_neighbors(ids, matrix, rows, k: int = NEIGHBORS_PER_PRODUCT) -> Dict[int, List[Tuple[int, float]]]:
+    """Top-k cosine neighbours of matrix[rows] among all products, best first"""
+    import numpy as np
+
+    rows = np.asarray(rows, dtype=np.int64)
+    k = min(k, len(ids) - 1)
+    if k <= 0:
+        return {int(ids[row]): [] for row in rows}
+
+    lists = {}
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        sims = matrix[block] @ matrix.T
+        sims[np.arange(len(block)), block] = -np.inf  # A product is not its own neighbour
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        for i, row in enumerate(block):
+            lists[int(ids[row])] = [(int(ids[j]), round(float(score), 4)) for j, score in zip(top[i], top_sims[i])]
+    return lists
+
+
+def _load_lists() -> Dict[int, ProductNeighborList]:
+    return {row.product_id: row for row in ProductNeighborList.query.filter_by(source=SOURCE).all()}
+
+
+def _save_lists(lists: Dict[int, List[Tuple[int, float]]], existing: Dict[int, ProductNeighborList]):
+    now = datetime.utcnow()
+    for product_id, neighbors in lists.items():
+        row = existing.get(product_id)
+        if row is None:
+            row = ProductNeighborList(product_id=product_id, source=SOURCE)
+            db.session.add(row)
+        row.neighbors = json.dumps(neighbors)
+        # Set explicitly: an unchanged list issues no UPDATE, and the SKU would look changed forever
+        row.updated_at = now
+
+
+def rebuild_all(ids, matrix, k: int = NEIGHBORS_PER_PRODUCT, progress: ProgressCallback = None) -> int:
+    """Recompute every product's list and drop lists of products without a vector"""
+    existing = _load_lists()
+    for start in range(0, len(ids), BLOCK_SIZE * 4):
+        rows = range(start, min(start + BLOCK_SIZE * 4, len(ids)))
+        _save_lists(top_k_neighbors(ids, matrix, rows, k), existing)
+        db.session.commit()
+        if progress:
+            progress(rows.stop)
+
+    stale = set(existing) - {int(product_id) for product_id in ids}
+    if stale:
+        ProductNeighborList.query.filter(
+            ProductNeighborList.source == SOURCE,
+            ProductNeighborList.product_id.in_(stale)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    return len(ids)
+
+
+def changed_product_ids(existing: Dict[int, ProductNeighborList]) -> set:
+    """Indexed SKUs updated after their neighbour list was written, or that have none"""
+    changed = set()
+    for sku_id, updated_at in db.session.query(SKU.id, SKU.updated_at).filter(SKU.weaviate_id.isnot(None)).all():
+        row = existing.get(sku_id)
+        if row is None or (updated_at and row.updated_at and updated_at > row.updated_at):
+            changed.add(sku_id)
+    return changed
+
+
+def pending_changes() -> Tuple[set, set]:
+    """(changed, removed) from SQL alone: SKUs needing a recompute and lists whose SKU was deleted"""
+    existing = _load_lists()
+    removed = set(existing) - {sku_id for (sku_id,) in db.session.query(SKU.id)}
+    return changed_product_ids(existing), removed
+
+
+def refresh_changed(ids, matrix, k: int = NEIGHBORS_PER_PRODUCT, progress: ProgressCallback = None) -> int:
+    """Recompute lists for changed SKUs and patch the rest; returns the number of lists written"""
+    import numpy as np
+
+    existing = _load_lists()
+    row_of = {int(product_id): row for row, product_id in enumerate(ids)}
+    changed = {product_id for product_id in changed_product_ids(existing) if product_id in row_of}
+    removed = set(existing) - set(row_of)
+    if not changed and not removed:
+        return 0
+    if len(changed) > len(ids) // 2:
+        return rebuild_all(ids, matrix, k, progress)
+
+    current = {product_id: row.get_neighbors() for product_id, row in existing.items() if product_id in row_of}
+    recompute = set(changed)
+    for product_id, neighbors in current.items():
+        if any(other_id in changed or other_id in removed for other_id, _ in neighbors):
+            recompute.add(product_id)
+
+    # Changed products that now rank in an unchanged product's top-k
+    patched = {}
+    changed_rows = np.asarray(sorted(row_of[product_id] for product_id in changed), dtype=np.int64)
+    kth = np.full(len(ids), -np.inf, dtype=np.float32)
+    for product_id, neighbors in current.items():
+        if len(neighbors) >= min(k, len(ids) - 1):
+            kth[row_of[product_id]] = neighbors[-1][1]
+    for start in range(0, len(changed_rows), BLOCK_SIZE):
+        block = changed_rows[start:start + BLOCK_SIZE]
+        sims = matrix[block] @ matrix.T
+        for i, j in zip(*np.nonzero(sims > kth[None, :])):
+            product_id = int(ids[j])
+            if product_id in recompute or product_id not in current:
+                continue
+            merged = patched.setdefault(product_id, list(current[product_id]))
+            merged.append((int(ids[block[i]]), round(float(sims[i, j]), 4)))
+        if progress:
+            progress(start + len(block))
+    for product_id, merged in patched.items():
+        patched[product_id] = sorted(merged, key=lambda pair: pair[1], reverse=True)[:k]
+
+    recomputed = top_k_neighbors(ids, matrix, [row_of[product_id] for product_id in sorted(recompute)], k)
+    _save_lists({**patched, **recomputed}, existing)
+    if removed:
+        ProductNeighborList.query.filter(
+            ProductNeighborList.source == SOURCE,
+            ProductNeighborList.product_id.in_(removed)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return len(patched) + len(recomputed)
+
+
+@register_job_handler('vector_neighbors')
+def run_vector_neighbors_job(job):
+    """Job handler: refresh the precomputed vector neighbour lists ({"mode": "full"} rebuilds all)"""
+    from services.weaviate_service import WeaviateService
+
+    has_lists = ProductNeighborList.query.filter_by(source=SOURCE).first() is not None
+    full = job.payload.get('mode') == 'full' or not has_lists
+    if not full:
+        changed, removed = pending_changes()
+        if not changed and not removed:
+            job.update_progress(processed=0, force=True, log='No products changed; neighbour lists are current')
+            return
+
+    def heartbeat(operation):
+        # Throttled; keeps a long load or rebuild from being requeued as stale
+        def report(done):
+            job.update_progress(processed=done, operation=f'{operation} ({done})')
+            job.raise_if_cancelled()
+        return report
+
+    job.update_progress(operation='Loading product vectors', force=True)
+    ids, matrix = load_vectors(WeaviateService(), progress=heartbeat('Loading product vectors'))
+    job.raise_if_cancelled()
+    job.update_progress(total=len(ids), operation=f'Computing neighbours for {len(ids)} products', force=True)
+
+    progress = heartbeat('Computing neighbours')
+    if full:
+        written = rebuild_all(ids, matrix, progress=progress)
+    else:
+        written = refresh_changed(ids, matrix, progress=progress)
+
+    job.update_progress(processed=written, force=True,
+                        log=f'Wrote {written} neighbour lists from {len(ids)} product vectors')
+    print(f"[NEIGHBORS] Wrote {written} neighbour lists from {len(ids)} product vectors")
+
+
+register_periodic_job('vector_neighbors', float(os.getenv('VECTOR_NEIGHBORS_INTERVAL', 3600)))
@@ -1,14 +1,69 @@
 import weaviate
 from weaviate.embedded import EmbeddedOptions
+from weaviate.util import generate_uuid5
 import os
 from typing import List, Dict, Optional
 import base64
-from PIL import Image
-import io
-import requests
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import re
+import time
 from .openai_service import OpenAIService
+from .image_pipeline import get_image_pipeline
+from .image_embeddings import get_image_embedding_backend
+from .async_utils import run_blocking
+
+# Products live in a versioned class (Product, Product_v2, ...). The class
+# that serves searches is recorded in the settings table so a rebuilt index
+# can be switched in atomically.
+BASE_CLASS_NAME = "Product"
+ACTIVE_CLASS_SETTING = 'vector_active_class'
+BUILDING_CLASS_SETTING = 'vector_building_class'
+CLASS_POINTER_TTL = 5  # seconds a process may serve from a stale pointer
+
+
+def _get_setting(key: str) -> Optional[str]:
+    """Read a value from the settings table"""
+    from database import db
+    from sqlalchemy import text
+    
+    result = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='settings'"))
+    if not result.fetchone():
+        return None
+    
+    row = db.session.execute(
+        text("SELECT value FROM settings WHERE key = :key ORDER BY id DESC LIMIT 1"),
+        {"key": key}
+    ).fetchone()
+    return row[0] if row and row[0] else None
+
+
+def _set_settings(values: Dict[str, Optional[str]]):
+    """Write several settings in a single transaction"""
+    from database import db
+    from sqlalchemy import text
+    
+    result = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='settings'"))
+    if not result.fetchone():
+        db.session.execute(text("""
+            CREATE TABLE settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                value TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+    
+    for key, value in values.items():
+        db.session.execute(text("DELETE FROM settings WHERE key = :key"), {"key": key})
+        if value is not None:
+            db.session.execute(
+                text("INSERT INTO settings (key, value) VALUES (:key, :value)"),
+                {"key": key, "value": value}
+            )
+    db.session.commit()
+
 
 class WeaviateService:
     def __init__(self, url: str = None, api_key: str = None, vectorizer: str = None):
@@ -18,6 +73,8 @@ class WeaviateService:
         self.vectorizer = vectorizer or self._get_config_value('vectorizer') or os.getenv('WEAVIATE_VECTORIZER', 'text2vec-transformers')
         self.timeout = self._get_config_value('timeout') or 30
         self.client = None
+        self._class_pointer = None  # (fetched_at, active_class, building_class)
+        self.image_pipeline = get_image_pipeline()
         
         print(f"[WEAVIATE] Initializing with URL: {self.url}, Vectorizer: {self.vectorizer}, API Key: {'***' if self.api_key else 'None'}")
         
@@ -30,17 +87,19 @@ class WeaviateService:
             print(f"[WEAVIATE] Failed to load sentence transformer: {e}")
             self.sentence_model = None
         
-        # Initialize OpenAI service for image embeddings
+        # Initialize OpenAI service (optional image embedding backend)
         try:
             self.openai_service = OpenAIService()
-            if self.openai_service.is_configured():
-                print(f"[WEAVIATE] OpenAI service initialized for image embeddings")
-            else:
-                print(f"[WEAVIATE] OpenAI not configured - image search will use fallback")
         except Exception as e:
             print(f"[WEAVIATE] Failed to initialize OpenAI service: {e}")
             self.openai_service = None
         
+        # Image embeddings: local CLIP by default, OpenAI description embeddings optionally
+        self.image_embedder = get_image_embedding_backend(
+            self._get_config_value('image_embedding_model'), openai_service=self.openai_service
+        )
+        print(f"[WEAVIATE] Image embedding backend: {self.image_embedder.name}")
+        
         self.connect()
         self.setup_schema()
     
@@ -66,7 +125,8 @@ class WeaviateService:
                 'weaviate_url': config[1],
                 'api_key': config[2],
                 'vectorizer': config[3],
-                'timeout': config[4]
+                'timeout': config[4],
+                'image_embedding_model': config._mapping.get('image_embedding_model')
             }
             
             return config_map.get(key)
@@ -122,8 +182,93 @@ class WeaviateService:
             print(f"[WEAVIATE] Error generating vector for text: {e}")
             return None
     
-    def setup_schema(self):
+    @property
+    def class_name(self) -> str:
+        """Weaviate class currently serving searches"""
+        return self._get_class_pointer()[0]
+    
+    @property
+    def building_class_name(self) -> Optional[str]:
+        """Class being rebuilt in the background, if any"""
+        return self._get_class_pointer()[1]
+    
+    def _get_class_pointer(self):
+        """Read the active/building class pointer, cached for a few seconds"""
+        now = time.monotonic()
+        if self._class_pointer and now - self._class_pointer[0] < CLASS_POINTER_TTL:
+            return self._class_pointer[1], self._class_pointer[2]
+        
+        try:
+            active = _get_setting(ACTIVE_CLASS_SETTING) or BASE_CLASS_NAME
+            building = _get_setting(BUILDING_CLASS_SETTING)
+        except Exception as e:
+            print(f"[WEAVIATE] Error reading class pointer: {e}")
+            active, building = BASE_CLASS_NAME, None
+        
+        self._class_pointer = (now, active, building)
+        return active, building
+    
+    def _write_classes(self) -> List[str]:
+        """Classes a product write must reach: the live one plus any in-progress rebuild"""
+        active, building = self._get_class_pointer()
+        return [active] + ([building] if building and building != active else [])
+    
+    def list_product_classes(self) -> List[str]:
+        """All product classes (live, old and in-progress versions)"""
+        schema = self.client.schema.get()
+        return [c['class'] for c in schema.get('classes', [])
+                if c['class'] == BASE_CLASS_NAME or re.match(rf"^{BASE_CLASS_NAME}_v\d+$", c['class'])]
+    
+    def create_versioned_class(self) -> str:
+        """Create the next empty Product_vN class and return its name"""
+        versions = [1]
+        for name in self.list_product_classes():
+            match = re.match(rf"^{BASE_CLASS_NAME}_v(\d+)$", name)
+            if match:
+                versions.append(int(match.group(1)))
+        class_name = f"{BASE_CLASS_NAME}_v{max(versions) + 1}"
+        self.setup_schema(class_name)
+        return class_name
+    
+    def begin_rebuild(self, class_name: str):
+        """Mark a class as being rebuilt so live writes are mirrored into it"""
+        _set_settings({BUILDING_CLASS_SETTING: class_name})
+        self._class_pointer = None
+    
+    def activate_class(self, class_name: str) -> str:
+        """Atomically point searches at a class; returns the previously active class"""
+        self._class_pointer = None
+        previous = self.class_name
+        _set_settings({ACTIVE_CLASS_SETTING: class_name, BUILDING_CLASS_SETTING: None})
+        self._class_pointer = None
+        print(f"[WEAVIATE] Active class switched from {previous} to {class_name}")
+        return previous
+    
+    def abort_rebuild(self, class_name: str):
+        """Forget an unfinished rebuild and drop its class"""
+        _set_settings({BUILDING_CLASS_SETTING: None})
+        self._class_pointer = None
+        self.drop_class(class_name)
+    
+    def reset_class_pointer(self):
+        """Point searches back at the base Product class"""
+        _set_settings({ACTIVE_CLASS_SETTING: None, BUILDING_CLASS_SETTING: None})
+        self._class_pointer = None
+    
+    def drop_class(self, class_name: str) -> bool:
+        """Delete a product class and all of its objects"""
+        try:
+            self.client.schema.delete_class(class_name)
+            print(f"[WEAVIATE] Dropped class {class_name}")
+            return True
+        except Exception as e:
+            print(f"[WEAVIATE] Error dropping class {class_name}: {e}")
+            return False
+    
+    def setup_schema(self, class_name: str = None):
         """Setup Weaviate schema for products"""
+        class_name = class_name or self.class_name
+        
         # Configure module config based on vectorizer
         module_config = {}
         if self.vectorizer == "text2vec-transformers":
@@ -152,7 +297,7 @@ class WeaviateService:
         # For now, use manual vectorization (no vectorizer module required)
         schema = {
             "classes": [{
-                "class": "Product",
+                "class": class_name,
                 "description": "E-commerce product with text and image search capabilities",
                 "vectorizer": "none",  # Use manual vectors
                 "properties": [
@@ -216,6 +361,11 @@ class WeaviateService:
                         "dataType": ["number[]"],
                         "description": "Image embedding vector"
                     },
+                    {
+                        "name": "image_embedding_model",
+                        "dataType": ["string"],
+                        "description": "Model that produced image_embedding"
+                    },
                     {
                         "name": "categories",
                         "dataType": ["string[]"],
@@ -228,16 +378,26 @@ class WeaviateService:
         try:
             # Check if schema already exists
             existing_schema = self.client.schema.get()
-            if not any(c['class'] == 'Product' for c in existing_schema.get('classes', [])):
+            if not any(c['class'] == class_name for c in existing_schema.get('classes', [])):
                 self.client.schema.create(schema)
-                print("Weaviate schema created successfully")
+                print(f"Weaviate schema created successfully for {class_name}")
             else:
-                print("Weaviate schema already exists")
+                print(f"Weaviate schema already exists for {class_name}")
         except Exception as e:
             print(f"Error setting up Weaviate schema: {e}")
     
-    def add_product(self, product_data: Dict) -> Optional[str]:
-        """Add a product to Weaviate"""
+    @staticmethod
+    def product_uuid(product_id: int) -> str:
+        """Deterministic Weaviate UUID for a product, so re-adding replaces instead of duplicating"""
+        return generate_uuid5(product_id, BASE_CLASS_NAME)
+    
+    def add_product(self, product_data: Dict, class_name: str = None, image_base64: str = None) -> Optional[str]:
+        """Add a product to Weaviate, replacing the existing object for the same product
+        
+        Without ``class_name`` the product is written to the live class and,
+        during a rebuild, to the class being built. ``image_base64`` lets bulk
+        indexing pass an image already prefetched by the image pipeline.
+        """
         try:
             print(f"[WEAVIATE] Adding product: {product_data.get('title', 'Unknown')}")
             
@@ -259,23 +419,26 @@ class WeaviateService:
                 image_url = product_data['images'][0]['url']
                 weaviate_data['image_url'] = image_url
                 
-                # Download and encode image
-                image_base64 = self._download_and_encode_image(image_url)
+                # Download and encode image unless it was prefetched
+                if not image_base64:
+                    image_base64 = self._download_and_encode_image(image_url)
                 if image_base64:
                     weaviate_data['image'] = image_base64
                     
-                    # Generate image description and embedding using OpenAI
-                    if self.openai_service and self.openai_service.is_configured():
+                    # Generate image embedding with the configured backend
+                    if self.image_embedder.is_available():
                         print(f"[WEAVIATE] Generating image embedding for {product_data.get('title', 'Unknown')}")
-                        image_data = self.openai_service.process_image_for_embedding(image_base64)
+                        image_data = self.image_embedder.embed_image(image_base64)
                         if image_data:
-                            weaviate_data['image_description'] = image_data['description']
+                            if image_data.get('description'):
+                                weaviate_data['image_description'] = image_data['description']
                             weaviate_data['image_embedding'] = image_data['embedding']
+                            weaviate_data['image_embedding_model'] = image_data['embedding_model']
                             print(f"[WEAVIATE] Image embedding generated successfully")
                         else:
                             print(f"[WEAVIATE] Failed to generate image embedding")
                     else:
-                        print(f"[WEAVIATE] OpenAI not configured for image embedding")
+                        print(f"[WEAVIATE] Image embedding backend '{self.image_embedder.name}' not available")
             
             # Generate vector manually for text search
             tags_text = ', '.join(product_data.get('tags', [])) if isinstance(product_data.get('tags'), list) else str(product_data.get('tags', ''))
@@ -284,19 +447,28 @@ class WeaviateService:
             
             if vector:
                 print(f"[WEAVIATE] Generated vector with {len(vector)} dimensions")
-                # Add to Weaviate with manual vector
-                result = self.client.data_object.create(
-                    data_object=weaviate_data,
-                    class_name="Product",
-                    vector=vector
-                )
             else:
                 print(f"[WEAVIATE] No vector generated, adding without vector")
-                # Add to Weaviate without vector
-                result = self.client.data_object.create(
-                    data_object=weaviate_data,
-                    class_name="Product"
-                )
+            
+            # Upsert under the product's deterministic UUID - the live object is
+            # replaced in place, so the index never has a gap for this product
+            object_uuid = self.product_uuid(product_data['id'])
+            for target_class in ([class_name] if class_name else self._write_classes()):
+                if self.client.data_object.exists(object_uuid, class_name=target_class):
+                    self.client.data_object.replace(
+                        data_object=weaviate_data,
+                        class_name=target_class,
+                        uuid=object_uuid,
+                        vector=vector
+                    )
+                    result = object_uuid
+                else:
+                    result = self.client.data_object.create(
+                        data_object=weaviate_data,
+                        class_name=target_class,
+                        uuid=object_uuid,
+                        vector=vector
+                    )
             
             print(f"[WEAVIATE] Successfully added product with ID: {result}")
             return result
@@ -307,7 +479,7 @@ class WeaviateService:
             print(f"[WEAVIATE] Full traceback: {traceback.format_exc()}")
             return None
     
-    def update_product(self, weaviate_id: str, product_data: Dict) -> bool:
+    def update_product(self, weaviate_id: str, product_data: Dict, image_base64: str = None) -> bool:
         """Update a product in Weaviate"""
         try:
             # Prepare update data
@@ -326,18 +498,24 @@ class WeaviateService:
                 image_url = product_data['images'][0]['url']
                 update_data['image_url'] = image_url
                 
-                # Download and encode image
-                image_base64 = self._download_and_encode_image(image_url)
+                # Download and encode image unless it was prefetched
+                if not image_base64:
+                    image_base64 = self._download_and_encode_image(image_url)
                 if image_base64:
                     update_data['image'] = image_base64
             
             # Update in Weaviate
             self.client.data_object.update(
                 data_object=update_data,
-                class_name="Product",
+                class_name=self.class_name,
                 uuid=weaviate_id
             )
             
+            # Keep an in-progress rebuild in step with the live class
+            building = self.building_class_name
+            if building and building != self.class_name:
+                self.add_product(product_data, class_name=building, image_base64=image_base64)
+            
             return True
         except Exception as e:
             print(f"Error updating product in Weaviate: {e}")
@@ -346,17 +524,36 @@ class WeaviateService:
     def delete_product(self, weaviate_id: str) -> bool:
         """Delete a product from Weaviate"""
         try:
-            self.client.data_object.delete(
-                uuid=weaviate_id,
-                class_name="Product"
-            )
+            for target_class in self._write_classes():
+                if self.client.data_object.exists(weaviate_id, class_name=target_class):
+                    self.client.data_object.delete(
+                        uuid=weaviate_id,
+                        class_name=target_class
+                    )
             return True
         except Exception as e:
             print(f"Error deleting product from Weaviate: {e}")
             return False
-    
-    def search_by_text(self, query: str, limit: int = 10) -> List[Dict]:
-        """Search products by text query using vector similarity"""
+
+    def iter_product_vectors(self, class_name: str = None, batch_size: int = 500):
+        """Yield (product_id, vector) for every object in a product class, paging with the object cursor"""
+        class_name = class_name or self.class_name
+        after = None
+        while True:
+            page = self.client.data_object.get(class_name=class_name, with_vector=True,
+                                               limit=batch_size, after=after)
+            objects = (page or {}).get('objects') or []
+            if not objects:
+                return
+            for obj in objects:
+                product_id = (obj.get('properties') or {}).get('product_id')
+                if product_id is not None and obj.get('vector'):
+                    yield int(product_id), obj['vector']
+            after = objects[-1]['id']
+
+    def search_by_text(self, query: str, limit: int = 10, where: Optional[Dict] = None) -> List[Dict]:
+        """Search products by text query using vector similarity, optionally restricted by a where filter"""
+        class_name = self.class_name
         print(f"[WEAVIATE] Starting text search for query: '{query}'")
         print(f"[WEAVIATE] Using URL: {self.url}, Vectorizer: {self.vectorizer}")
         
@@ -364,12 +561,12 @@ class WeaviateService:
             # First check if we have any products indexed
             count_result = (
                 self.client.query
-                .aggregate("Product")
+                .aggregate(class_name)
                 .with_meta_count()
                 .do()
             )
             
-            total_products = count_result.get('data', {}).get('Aggregate', {}).get('Product', [{}])[0].get('meta', {}).get('count', 0)
+            total_products = count_result.get('data', {}).get('Aggregate', {}).get(class_name, [{}])[0].get('meta', {}).get('count', 0)
             print(f"[WEAVIATE] Total products indexed in Weaviate: {total_products}")
             
             if total_products == 0:
@@ -386,16 +583,18 @@ class WeaviateService:
             
             # Use manual vector search
             print(f"[WEAVIATE] Performing vector search with {len(query_vector)} dimensions...")
-            result = (
+            search = (
                 self.client.query
-                .get("Product", ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "tags"])
+                .get(class_name, ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "tags"])
                 .with_near_vector({"vector": query_vector})
                 .with_limit(limit)
                 .with_additional(["distance", "score"])
-                .do()
             )
+            if where:
+                search = search.with_where(where)
+            result = search.do()
             
-            products = result.get('data', {}).get('Get', {}).get('Product', [])
+            products = result.get('data', {}).get('Get', {}).get(class_name, [])
             print(f"[WEAVIATE] Vector search returned {len(products)} results")
             
             if products:
@@ -442,70 +641,90 @@ class WeaviateService:
                 
                 result = (
                     self.client.query
-                    .get("Product", ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "tags"])
+                    .get(class_name, ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "tags"])
                     .with_where(where_filter)
                     .with_limit(limit)
                     .do()
                 )
                 
-                products = result.get('data', {}).get('Get', {}).get('Product', [])
+                products = result.get('data', {}).get('Get', {}).get(class_name, [])
                 return products
             except Exception as fallback_e:
                 print(f"Error in fallback text search: {fallback_e}")
                 return []
     
-    def search_by_image(self, image_base64: str, limit: int = 10) -> List[Dict]:
-        """Search products by image using OpenAI embeddings"""
+    async def search_by_text_async(self, query: str, limit: int = 10, where: Optional[Dict] = None) -> List[Dict]:
+        """search_by_text for async callers (runs on the shared I/O pool)"""
+        return await run_blocking(self.search_by_text, query, limit, where)
+    
+    async def embed_query_image_async(self, image_base64: str) -> Optional[Dict]:
+        """Embed a query image without blocking the event loop"""
+        return await self.image_embedder.embed_image_async(image_base64)
+    
+    async def search_by_image_async(self, image_base64: str, limit: int = 10, query_data: Dict = None) -> List[Dict]:
+        """search_by_image for async callers; pass query_data if the image was embedded already"""
+        if query_data is None:
+            query_data = await self.embed_query_image_async(image_base64)
+        return await run_blocking(self.search_by_image, image_base64, limit, query_data)
+    
+    def search_by_image(self, image_base64: str, limit: int = 10, query_data: Dict = None) -> List[Dict]:
+        """Search products by image using the configured image embedding backend"""
+        class_name = self.class_name
         print(f"[WEAVIATE] Starting image search")
         
         try:
             # First, check if we have any products with image embeddings
             count_result = (
                 self.client.query
-                .aggregate("Product")
+                .aggregate(class_name)
                 .with_meta_count()
                 .do()
             )
             
-            total_products = count_result.get('data', {}).get('Aggregate', {}).get('Product', [{}])[0].get('meta', {}).get('count', 0)
+            total_products = count_result.get('data', {}).get('Aggregate', {}).get(class_name, [{}])[0].get('meta', {}).get('count', 0)
             print(f"[WEAVIATE] Total products indexed: {total_products}")
             
             if total_products == 0:
                 print(f"[WEAVIATE] No products indexed")
                 return []
             
-            # Use OpenAI for image similarity search
-            if self.openai_service and self.openai_service.is_configured():
-                print(f"[WEAVIATE] Using OpenAI for image search")
+            if self.image_embedder.is_available():
+                print(f"[WEAVIATE] Using {self.image_embedder.name} backend for image search")
                 
-                # Generate embedding for query image
-                query_embedding = self.openai_service.get_image_embedding(image_base64)
-                if not query_embedding:
+                # Generate embedding for query image unless the caller already did
+                if query_data is None:
+                    query_data = self.image_embedder.embed_image(image_base64, use_cache=False)
+                if not query_data:
                     print(f"[WEAVIATE] Failed to generate query image embedding")
                     return self._fallback_image_search(limit)
+                query_embedding = query_data['embedding']
                 
                 print(f"[WEAVIATE] Generated query embedding with {len(query_embedding)} dimensions")
                 
                 # Get all products with image embeddings
                 result = (
                     self.client.query
-                    .get("Product", ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "image_embedding", "image_description"])
+                    .get(class_name, ["product_id", "title", "description", "price", "image_url", "vendor", "product_type", "image_embedding", "image_description"])
                     .with_limit(100)  # Get more to calculate similarity
                     .do()
                 )
                 
-                products = result.get('data', {}).get('Get', {}).get('Product', [])
+                products = result.get('data', {}).get('Get', {}).get(class_name, [])
                 print(f"[WEAVIATE] Retrieved {len(products)} products for similarity calculation")
                 
-                # Calculate similarity and sort
+                # Calculate similarity and sort (skip embeddings from another model until reindexed)
                 scored_products = []
                 for product in products:
-                    if product.get('image_embedding'):
+                    if product.get('image_embedding') and len(product['image_embedding']) == len(query_embedding):
                         similarity = self._cosine_similarity(query_embedding, product['image_embedding'])
                         product['similarity'] = similarity
                         product['_additional'] = {'distance': 1 - similarity}  # Convert to distance
                         scored_products.append(product)
                 
+                if not scored_products:
+                    print(f"[WEAVIATE] No products with {len(query_embedding)}-dim image embeddings - reindex to embed images with the current backend")
+                    return self._fallback_image_search(limit)
+                
                 # Sort by similarity (highest first)
                 scored_products.sort(key=lambda x: x.get('similarity', 0), reverse=True)
                 
@@ -517,7 +736,7 @@ class WeaviateService:
                 
                 return results
             else:
-                print(f"[WEAVIATE] OpenAI not configured, using fallback")
+                print(f"[WEAVIATE] Image embedding backend not available, using fallback")
                 return self._fallback_image_search(limit)
                 
         except Exception as e:
@@ -528,15 +747,16 @@ class WeaviateService:
     
     def _fallback_image_search(self, limit: int) -> List[Dict]:
         """Fallback image search - return all products"""
+        class_name = self.class_name
         try:
             result = (
                 self.client.query
-                .get("Product", ["product_id", "title", "description", "price", "image_url", "vendor", "product_type"])
+                .get(class_name, ["product_id", "title", "description", "price", "image_url", "vendor", "product_type"])
                 .with_limit(limit)
                 .do()
             )
             
-            products = result.get('data', {}).get('Get', {}).get('Product', [])
+            products = result.get('data', {}).get('Get', {}).get(class_name, [])
             print(f"[WEAVIATE] Image search fallback returned {len(products)} products")
             return products
         except Exception as e:
@@ -591,77 +811,28 @@ class WeaviateService:
     
     def _download_and_encode_image(self, image_url: str) -> Optional[str]:
         """Download image from URL and encode to base64"""
-        try:
-            # Handle relative URLs - try local file system first
-            if image_url.startswith('/'):
-                # Try to read from local file system
-                local_path = f".{image_url}"  # Convert /uploads/... to ./uploads/...
-                print(f"[WEAVIATE] Trying local file: {local_path}")
-                
-                if os.path.exists(local_path):
-                    with open(local_path, 'rb') as f:
-                        image_data = f.read()
-                    print(f"[WEAVIATE] Read image from local file: {len(image_data)} bytes")
-                else:
-                    # Fall back to HTTP request
-                    image_url = f"http://localhost:5000{image_url}"
-                    print(f"[WEAVIATE] Local file not found, trying HTTP: {image_url}")
-                    response = requests.get(image_url, timeout=10)
-                    if response.status_code == 200:
-                        image_data = response.content
-                    else:
-                        print(f"[WEAVIATE] HTTP request failed: {response.status_code}")
-                        return None
-            else:
-                print(f"[WEAVIATE] Downloading image from: {image_url}")
-                response = requests.get(image_url, timeout=10)
-                if response.status_code == 200:
-                    image_data = response.content
-                else:
-                    print(f"[WEAVIATE] Download failed: {response.status_code}")
-                    return None
-            
-            # Process the image data
-            img = Image.open(io.BytesIO(image_data))
-            
-            # Resize if larger than 1024px in any dimension
-            max_size = (1024, 1024)
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Convert to RGB if necessary
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Save to bytes
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
-            
-            # Encode to base64
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-        except Exception as e:
-            print(f"Error downloading/encoding image: {e}")
+        return self.image_pipeline.fetch_and_encode(image_url)
+    
+    def prefetch_images(self, products: List[Dict]) -> Dict:
+        """Start downloading the first image of each product on the image pool"""
+        return self.image_pipeline.prefetch(
+            product['images'][0]['url'] for product in products if product.get('images')
+        )
+    
+    def prepare_image_embeddings(self, images: List[Optional[str]]):
+        """Embed a batch of images in as few backend calls as possible
         
-        return None
+        Results land in the image embedding cache, where the following
+        add_product calls pick them up.
+        """
+        images = [image for image in images if image]
+        if images and self.image_embedder.is_available():
+            self.image_embedder.embed_images(images)
     
     def encode_image_file(self, image_file) -> Optional[str]:
         """Encode uploaded image file to base64"""
         try:
-            img = Image.open(image_file)
-            
-            # Resize if larger than 1024px
-            max_size = (1024, 1024)
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Convert to RGB if necessary
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Save to bytes
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
-            
-            # Encode to base64
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+            return base64.b64encode(self.image_pipeline.preprocess(image_file)).decode('utf-8')
         except Exception as e:
             print(f"Error encoding image file: {e}")
-            return None
\ No newline at end of file
+            return None
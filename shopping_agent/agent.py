@@ -3,57 +3,143 @@ Shopping Agent Implementation using Google ADK
 Provides conversational shopping assistance with product search and recommendations
 """
 
-import json
 import asyncio
 import os
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, AsyncIterator
 from datetime import datetime
 from google.adk.agents import Agent
 from google.adk.sessions import InMemorySessionService
 import base64
 
-from .llm_providers import LLMProviderFactory, BaseLLMProvider
+from .llm_providers import BaseLLMProvider, get_provider_pool
 from .conversation import ConversationManager
 from .prompts import SYSTEM_PROMPTS
+from .intent_router import IntentRouter, INTENT_SCHEMA
+from services.async_utils import run_blocking
+
+
+# Shared Weaviate service (loads the embedding models once per process)
+_weaviate_service = None
+_weaviate_service_lock = threading.Lock()
+
+
+def get_weaviate_service():
+    """Get or create the shared Weaviate service"""
+    global _weaviate_service
+    if _weaviate_service is None:
+        with _weaviate_service_lock:
+            if _weaviate_service is None:
+                # Import here to avoid circular imports
+                from services.weaviate_service import WeaviateService
+                _weaviate_service = WeaviateService()
+    return _weaviate_service
+
+
+async def get_weaviate_service_async():
+    """get_weaviate_service() for coroutines; the first call builds the service off the event loop"""
+    if _weaviate_service is not None:
+        return _weaviate_service
+    return await run_blocking(get_weaviate_service)
+
+
+async def embed_query_image_async(image_base64: str):
+    """Embed a query image with the shared service"""
+    service = await get_weaviate_service_async()
+    return await service.embed_query_image_async(image_base64)
+
+
+def _load_llm_settings() -> Dict[str, Any]:
+    """Read the configured LLM provider and its API key from AgentConfig"""
+    llm_provider = "openai"  # default
+    llm_model = "gpt-4-turbo-preview"  # default
+    api_key = None
+    
+    try:
+        from models.agent import AgentConfig
+        config = AgentConfig.get_current_config()
+        if config:
+            llm_provider = config.llm_provider or "openai"
+            llm_model = config.llm_model or "gpt-4-turbo-preview"
+            
+            # Get the appropriate API key based on provider
+            if llm_provider.lower() == "openai":
+                api_key = config.openai_api_key or os.getenv("OPENAI_API_KEY")
+            elif llm_provider.lower() == "anthropic":
+                api_key = config.anthropic_api_key or os.getenv("ANTHROPIC_API_KEY")
+            elif llm_provider.lower() == "google":
+                api_key = config.google_api_key or os.getenv("GOOGLE_API_KEY")
+    except Exception as e:
+        print(f"[AGENT] Error getting config: {e}")
+        # Fallback to environment variables
+        api_key = os.getenv("OPENAI_API_KEY")
+    
+    return {"llm_provider": llm_provider, "llm_model": llm_model, "api_key": api_key}
+
+
+def _format_search_results(results: List[Dict]) -> List[Dict]:
+    """Convert Weaviate results to the product format the frontend expects"""
+    formatted_products = []
+    for result in results:
+        formatted_product = {
+            "id": result.get("product_id"),  # Use product_id as id
+            "title": result.get("title"),
+            "description": result.get("description"),
+            "price": result.get("price"),
+            "vendor": result.get("vendor"),
+            "quantity": result.get("quantity", 0),
+            # Convert image format for frontend
+            "images": []
+        }
+        
+        distance = (result.get("_additional") or {}).get("distance")
+        if distance is not None:
+            formatted_product["score"] = round(1 - float(distance), 4)
+        
+        # Handle different image formats from Weaviate
+        if result.get("image_url"):
+            formatted_product["images"] = [{"url": result["image_url"]}]
+        elif result.get("images"):
+            if isinstance(result["images"], list):
+                formatted_product["images"] = [{"url": img} for img in result["images"]]
+            else:
+                formatted_product["images"] = [{"url": result["images"]}]
+        
+        formatted_products.append(formatted_product)
+    return formatted_products
 
 
 def search_products_by_text(query: str, limit: int = 10) -> Dict[str, Any]:
     """Search for products using natural language query"""
     try:
-        # Import here to avoid circular imports
-        from services.weaviate_service import WeaviateService
-        
         print(f"[AGENT SEARCH] Searching for: {query}")
-        weaviate_service = WeaviateService()
-        results = weaviate_service.search_by_text(query, limit=limit)
+        results = get_weaviate_service().search_by_text(query, limit=limit)
         print(f"[AGENT SEARCH] Found {len(results)} results")
-        print(f"[AGENT SEARCH] Sample result: {results[0] if results else 'No results'}")
         
-        # Convert results to expected format for frontend
-        formatted_products = []
-        for result in results:
-            formatted_product = {
-                "id": result.get("product_id"),  # Changed from "id" to "product_id"
-                "title": result.get("title"),
-                "description": result.get("description"),
-                "price": result.get("price"),
-                "vendor": result.get("vendor"),
-                "quantity": result.get("quantity", 0),
-                # Convert image format for frontend
-                "images": []
-            }
-            
-            # Handle different image formats from Weaviate
-            if result.get("image_url"):
-                formatted_product["images"] = [{"url": result["image_url"]}]
-            elif result.get("images"):
-                if isinstance(result["images"], list):
-                    formatted_product["images"] = [{"url": img} for img in result["images"]]
-                else:
-                    formatted_product["images"] = [{"url": result["images"]}]
-            
-            formatted_products.append(formatted_product)
+        formatted_products = _format_search_results(results)
+        return {
+            "success": True,
+            "products": formatted_products,
+            "count": len(formatted_products)
+        }
+    except Exception as e:
+        print(f"[AGENT SEARCH] Error: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "products": []
+        }
+
+
+async def search_products_by_text_async(query: str, limit: int = 10) -> Dict[str, Any]:
+    """Async variant of search_products_by_text"""
+    try:
+        print(f"[AGENT SEARCH] Searching for: {query}")
+        service = await get_weaviate_service_async()
+        results = await service.search_by_text_async(query, limit=limit)
+        print(f"[AGENT SEARCH] Found {len(results)} results")
         
+        formatted_products = _format_search_results(results)
         return {
             "success": True,
             "products": formatted_products,
@@ -71,36 +157,30 @@ def search_products_by_text(query: str, limit: int = 10) -> Dict[str, Any]:
 def search_products_by_image(image_base64: str, limit: int = 10) -> Dict[str, Any]:
     """Search for similar products using an image"""
     try:
-        from services.weaviate_service import WeaviateService
-        
-        weaviate_service = WeaviateService()
-        results = weaviate_service.search_by_image(image_base64, limit=limit)
+        results = get_weaviate_service().search_by_image(image_base64, limit=limit)
         
-        # Convert results to expected format for frontend (same as text search)
-        formatted_products = []
-        for result in results:
-            formatted_product = {
-                "id": result.get("product_id"),  # Use product_id as id
-                "title": result.get("title"),
-                "description": result.get("description"),
-                "price": result.get("price"),
-                "vendor": result.get("vendor"),
-                "quantity": result.get("quantity", 0),
-                # Convert image format for frontend
-                "images": []
-            }
-            
-            # Handle different image formats from Weaviate
-            if result.get("image_url"):
-                formatted_product["images"] = [{"url": result["image_url"]}]
-            elif result.get("images"):
-                if isinstance(result["images"], list):
-                    formatted_product["images"] = [{"url": img} for img in result["images"]]
-                else:
-                    formatted_product["images"] = [{"url": result["images"]}]
-            
-            formatted_products.append(formatted_product)
+        formatted_products = _format_search_results(results)
+        return {
+            "success": True,
+            "products": formatted_products,
+            "count": len(formatted_products)
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "products": []
+        }
+
+
+async def search_products_by_image_async(image_base64: str, limit: int = 10,
+                                         query_data: Optional[Dict] = None) -> Dict[str, Any]:
+    """Async variant of search_products_by_image; query_data is a precomputed image embedding"""
+    try:
+        service = await get_weaviate_service_async()
+        results = await service.search_by_image_async(image_base64, limit=limit, query_data=query_data)
         
+        formatted_products = _format_search_results(results)
         return {
             "success": True,
             "products": formatted_products,
@@ -147,35 +227,16 @@ def get_product_details(product_id: int) -> Dict[str, Any]:
 
 def filter_products(categories: List[int] = None, vendors: List[str] = None, 
                    min_price: float = None, max_price: float = None, 
-                   in_stock: bool = True, limit: int = 20) -> Dict[str, Any]:
-    """Filter products by various criteria"""
+                   in_stock: bool = True, limit: int = 20, product_types: List[str] = None) -> Dict[str, Any]:
+    """Filter products by various criteria; product_types are names like 'shirt' or 'jeans'"""
     try:
         from models.sku import SKU
-        from sqlalchemy import and_
-        
-        query = SKU.query
-        
-        filters = []
-        
-        if categories:
-            filters.append(SKU.category_id.in_(categories))
+        from services.product_query import ProductFilterSpec, ProductQueryEngine
         
-        if vendors:
-            filters.append(SKU.vendor.in_(vendors))
-        
-        if min_price is not None:
-            filters.append(SKU.price >= min_price)
-        
-        if max_price is not None:
-            filters.append(SKU.price <= max_price)
-        
-        if in_stock:
-            filters.append(SKU.quantity > 0)
-        
-        if filters:
-            query = query.filter(and_(*filters))
-        
-        products = query.limit(limit).all()
+        spec = ProductFilterSpec(categories=categories, vendors=vendors, min_price=min_price,
+                                 max_price=max_price, stock='in_stock' if in_stock else 'all',
+                                 canonical_types=product_types)
+        products = ProductQueryEngine().find(spec, limit=limit, relations=[SKU.images])
         
         return {
             "success": True,
@@ -211,13 +272,39 @@ def get_similar_products(product_id: int, limit: int = 5) -> Dict[str, Any]:
                 "products": []
             }
         
-        # Use text search with the product title to find similar items
-        from services.weaviate_service import WeaviateService
-        weaviate_service = WeaviateService()
-        results = weaviate_service.search_by_text(product.title, limit=limit+1)  # +1 to exclude the original
+        # Precomputed nearest neighbours (vector_neighbors job)
+        from services.recommendations import get_neighbors
+        neighbors = get_neighbors([product_id], limit=limit, source='vector')
+        if neighbors:
+            skus = {sku.id: sku for sku in SKU.query.filter(SKU.id.in_([other_id for other_id, _ in neighbors])).all()}
+            similar = []
+            for other_id, score in neighbors:
+                sku = skus.get(other_id)
+                if sku is None:
+                    continue
+                similar.append({
+                    "id": sku.id,
+                    "title": sku.title,
+                    "description": sku.description,
+                    "price": float(sku.price) if sku.price else None,
+                    "vendor": sku.vendor,
+                    "quantity": sku.quantity,
+                    "score": score,
+                    "images": [{"url": img.url} for img in sku.images] if sku.images else []
+                })
+            return {
+                "success": True,
+                "products": similar,
+                "count": len(similar)
+            }
+        
+        # No list yet: search with the product title to find similar items
+        results = get_weaviate_service().search_by_text(product.title, limit=limit+1)  # +1 to exclude the original
         
         # Remove the original product from results
-        filtered_results = [p for p in results if p.get('id') != product_id][:limit]
+        filtered_results = _format_search_results(
+            [p for p in results if p.get('product_id') != product_id][:limit]
+        )
         
         return {
             "success": True,
@@ -240,6 +327,8 @@ class ShoppingAgent:
         self.temperature = kwargs.get('temperature', 0.7)
         self.max_tokens = kwargs.get('max_tokens', 500)
         self.conversation_manager = ConversationManager()  # Keep for backward compatibility
+        # Reuse the search service's MiniLM model for local intent classification
+        self.intent_router = IntentRouter(model_loader=lambda: get_weaviate_service().sentence_model)
         self.agent = None
         self._setup_agent()
     
@@ -273,7 +362,7 @@ IMPORTANT INSTRUCTIONS:
 Available tools:
 - search_products_by_text(query, limit): Search products by text
 - search_products_by_image(image_base64, limit): Search by image similarity  
-- filter_products(categories, vendors, min_price, max_price, in_stock, limit): Filter with specific criteria
+- filter_products(categories, vendors, min_price, max_price, in_stock, limit, product_types): Filter with specific criteria
 - get_product_details(product_id): Get detailed product info
 - get_similar_products(product_id, limit): Find similar products""",
             tools=[
@@ -295,11 +384,29 @@ Available tools:
         """
         Process a user message using Google ADK's intelligent agent system
         """
+        response = None
+        async for event in self.process_message_stream(message, session_id, image_data, context):
+            if event["type"] == "done":
+                response = event["response"]
+        return response
+    
+    async def process_message_stream(
+        self,
+        message: str,
+        session_id: str,
+        image_data: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a user message, yielding events as each stage completes:
+        status (after intent analysis), products, text, suggestions and finally
+        done with the same response dict process_message returns
+        """
         try:
             print(f"ShoppingAgent.process_message called with: {message}")
             
             # Get conversation history for context
-            history = self.conversation_manager.get_history(session_id)
+            history = await self.conversation_manager.get_history_async(session_id)
             
             # Build context-aware message for the LLM
             if len(history) > 0:
@@ -317,10 +424,27 @@ Available tools:
             
             print(f"[AGENT] Full context message: {full_message}")
             
+            # Embed an uploaded image while the intent is being analyzed
+            image_embedding_task = None
+            if image_data:
+                image_embedding_task = asyncio.create_task(embed_query_image_async(image_data))
+            
             # Implement intelligent tool selection using LLM reasoning
-            tool_choice, params = await self._analyze_intent_and_choose_tool(full_message, session_id)
+            try:
+                tool_choice, params = await self._analyze_intent_and_choose_tool(
+                    full_message, session_id, message=message, has_image=bool(image_data)
+                )
+            except BaseException:
+                if image_embedding_task:
+                    image_embedding_task.cancel()
+                raise
             print(f"[AGENT] Tool choice: {tool_choice}, Params: {params}")
             
+            if image_embedding_task and tool_choice != "search_products_by_image":
+                image_embedding_task.cancel()
+            
+            yield {"type": "status", "tool": tool_choice, "message": self._describe_action(tool_choice, params, bool(image_data))}
+            
             # Handle image data for image search
             if tool_choice == "search_products_by_image":
                 if image_data:
@@ -338,7 +462,7 @@ Available tools:
                     if not params.get("product_types_filter"):
                         # Get conversation history to extract product types from previous searches
                         try:
-                            history = self.conversation_manager.get_history(session_id)
+                            history = await self.conversation_manager.get_history_async(session_id)
                             for msg in reversed(history[-6:]):  # Check last 6 messages
                                 if msg.get('role') == 'assistant':
                                     # First check metadata for explicit product types
@@ -367,123 +491,9 @@ Available tools:
                             pass
             
             # Execute the chosen tool
-            if tool_choice == "filter_products":
-                # Remove product_types_filter from params before calling filter_products
-                product_types_filter = params.pop("product_types_filter", None)
-                
-                # Clean params to only include valid filter_products parameters
-                valid_params = {
-                    "categories": params.get("categories"),
-                    "vendors": params.get("vendors"),
-                    "min_price": params.get("min_price"),
-                    "max_price": params.get("max_price"),
-                    "in_stock": params.get("in_stock", False),
-                    "limit": params.get("limit", 20)
-                }
-                # Remove None values
-                valid_params = {k: v for k, v in valid_params.items() if v is not None}
-                
-                result = filter_products(**valid_params)
-                products = result.get('products', []) if result.get('success') else []
-                
-                # Post-process for product type filtering if needed
-                if product_types_filter and products:
-                    original_count = len(products)
-                    filtered_products = []
-                    for product in products:
-                        title_lower = product.get('title', '').lower()
-                        # Check if the product title contains any of the product types
-                        product_type_keywords = {
-                            "shirt": ["shirt", "blouse", "top", "tee", "t-shirt", "tshirt"],
-                            "pants": ["pant", "pants", "jean", "jeans", "trouser", "trousers", "slack", "slacks", "legging", "leggings"],
-                            "shoes": ["shoe", "shoes", "sneaker", "sneakers", "boot", "boots", "sandal", "sandals", "heel", "heels"],
-                            "dress": ["dress", "dresses", "gown", "frock"],
-                            "jacket": ["jacket", "coat", "blazer", "hoodie", "cardigan", "sweater"]
-                        }
-                        
-                        # Check if product matches ANY of the requested product types
-                        matches_any_type = False
-                        for product_type in product_types_filter:
-                            keywords = product_type_keywords.get(product_type, [product_type])
-                            if any(keyword in title_lower for keyword in keywords):
-                                matches_any_type = True
-                                break
-                        
-                        if matches_any_type:
-                            filtered_products.append(product)
-                    
-                    products = filtered_products
-                    print(f"[AGENT] Filtered {original_count} products down to {len(products)} for product types {product_types_filter}")
-                
-                if products:
-                    filter_desc = []
-                    if params.get('categories'): filter_desc.append("categories")
-                    if params.get('min_price'): filter_desc.append(f"price above ${params['min_price']}")
-                    if params.get('max_price'): filter_desc.append(f"price below ${params['max_price']}")
-                    if params.get('vendors'): filter_desc.append(f"vendors: {', '.join(params['vendors'])}")
-                    if product_types_filter: 
-                        if len(product_types_filter) == 1:
-                            filter_desc.append(f"product type: {product_types_filter[0]}")
-                        else:
-                            filter_desc.append(f"product types: {' and '.join(product_types_filter)}")
-                    
-                    response_text = f"I found {len(products)} products" + (f" with {', '.join(filter_desc)}" if filter_desc else "") + ". Here are some great options:"
-                else:
-                    response_text = "I couldn't find any products matching your criteria. Try adjusting your filters."
-                    
-            elif tool_choice == "search_products_by_text":
-                result = search_products_by_text(params['query'], params.get('limit', 10))
-                products = result.get('products', []) if result.get('success') else []
-                
-                if products:
-                    response_text = f"I found {len(products)} products for '{params['query']}'. Here are some great options:"
-                else:
-                    response_text = f"I couldn't find any products for '{params['query']}'. Try a different search term."
-                    
-            elif tool_choice == "search_products_by_image":
-                result = search_products_by_image(params['image_base64'], params.get('limit', 20))
-                products = result.get('products', []) if result.get('success') else []
-                
-                # Apply price filters if specified
-                if params.get('apply_price_filter') and products:
-                    min_price = params.get('min_price')
-                    max_price = params.get('max_price')
-                    
-                    if min_price is not None or max_price is not None:
-                        filtered_products = []
-                        for product in products:
-                            price = product.get('price')
-                            if price is not None:
-                                try:
-                                    price_val = float(price)
-                                    if min_price is not None and price_val < min_price:
-                                        continue
-                                    if max_price is not None and price_val > max_price:
-                                        continue
-                                    filtered_products.append(product)
-                                except (ValueError, TypeError):
-                                    continue
-                        
-                        products = filtered_products
-                        print(f"[AGENT] Applied price filter: {len(result.get('products', []))} -> {len(products)} products")
-                
-                if products:
-                    filter_desc = ""
-                    if params.get('min_price'): filter_desc += f" above ${params['min_price']}"
-                    if params.get('max_price'): filter_desc += f" below ${params['max_price']}"
-                    
-                    response_text = f"I found {len(products)} similar products based on your image"
-                    if filter_desc:
-                        response_text += f" with prices{filter_desc}"
-                    response_text += ". Here are some great options:"
-                else:
-                    response_text = "I couldn't find similar products for your image that match your criteria. Try adjusting your filters."
-                    
-            else:
-                # Default to basic search
-                result = search_products_by_text(message, limit=10)
-                products = result.get('products', []) if result.get('success') else []
-                response_text = f"I found {len(products)} products for you." if products else "I couldn't find any products matching your request."
+            products, response_text = await self._execute_tool(tool_choice, params, message, image_embedding_task)
+            yield {"type": "products", "products": products}
+            yield {"type": "text", "content": response_text}
             
             print(f"[AGENT] Final response: {response_text}")
             print(f"[AGENT] Products found: {len(products)}")
@@ -504,13 +514,13 @@ Available tools:
                             detected_product_types.append('shoes')
             
             # Save to conversation history
-            self.conversation_manager.add_message(
+            await self.conversation_manager.add_message_async(
                 session_id, 
                 "user", 
                 message,
                 metadata={"has_image": bool(image_data)}
             )
-            self.conversation_manager.add_message(
+            await self.conversation_manager.add_message_async(
                 session_id,
                 "assistant",
                 response_text,
@@ -521,24 +531,136 @@ Available tools:
                 }
             )
             
-            return {
+            suggestions = self._generate_suggestions(None, products)
+            yield {"type": "suggestions", "suggestions": suggestions}
+            
+            yield {"type": "done", "response": {
                 "success": True,
                 "response": response_text,
                 "products": products,
                 "session_id": session_id,
-                "suggestions": self._generate_suggestions(None, products)
-            }
+                "suggestions": suggestions,
+                "tool_used": tool_choice,
+                "product_types": detected_product_types
+            }}
             
         except Exception as e:
             print(f"[AGENT] Error: {e}")
             import traceback
             traceback.print_exc()
-            return {
+            yield {"type": "done", "response": {
                 "success": False,
                 "error": str(e),
                 "response": "I apologize, but I encountered an error. Please try again.",
                 "products": []
+            }}
+    
+    async def _execute_tool(self, tool_choice: str, params: Dict[str, Any], message: str,
+                            image_embedding_task: Optional[asyncio.Task] = None) -> tuple:
+        """Run the chosen tool; returns (products, response_text)"""
+        if tool_choice == "filter_products":
+            # Product types are filtered in the query through the canonical type taxonomy
+            product_types_filter = params.pop("product_types_filter", None)
+            
+            # Clean params to only include valid filter_products parameters
+            valid_params = {
+                "categories": params.get("categories"),
+                "vendors": params.get("vendors"),
+                "product_types": product_types_filter or None,
+                "min_price": params.get("min_price"),
+                "max_price": params.get("max_price"),
+                "in_stock": params.get("in_stock", False),
+                "limit": params.get("limit", 20)
             }
+            # Remove None values
+            valid_params = {k: v for k, v in valid_params.items() if v is not None}
+            
+            result = await run_blocking(filter_products, **valid_params)
+            products = result.get('products', []) if result.get('success') else []
+            
+            if products:
+                filter_desc = []
+                if params.get('categories'): filter_desc.append("categories")
+                if params.get('min_price'): filter_desc.append(f"price above ${params['min_price']}")
+                if params.get('max_price'): filter_desc.append(f"price below ${params['max_price']}")
+                if params.get('vendors'): filter_desc.append(f"vendors: {', '.join(params['vendors'])}")
+                if product_types_filter: 
+                    if len(product_types_filter) == 1:
+                        filter_desc.append(f"product type: {product_types_filter[0]}")
+                    else:
+                        filter_desc.append(f"product types: {' and '.join(product_types_filter)}")
+                
+                response_text = f"I found {len(products)} products" + (f" with {', '.join(filter_desc)}" if filter_desc else "") + ". Here are some great options:"
+            else:
+                response_text = "I couldn't find any products matching your criteria. Try adjusting your filters."
+                
+        elif tool_choice == "search_products_by_text":
+            result = await search_products_by_text_async(params['query'], params.get('limit', 10))
+            products = result.get('products', []) if result.get('success') else []
+            
+            if products:
+                response_text = f"I found {len(products)} products for '{params['query']}'. Here are some great options:"
+            else:
+                response_text = f"I couldn't find any products for '{params['query']}'. Try a different search term."
+                
+        elif tool_choice == "search_products_by_image":
+            query_data = await image_embedding_task if image_embedding_task else None
+            result = await search_products_by_image_async(params['image_base64'], params.get('limit', 20),
+                                                          query_data=query_data)
+            products = result.get('products', []) if result.get('success') else []
+            
+            # Apply price filters if specified
+            if params.get('apply_price_filter') and products:
+                min_price = params.get('min_price')
+                max_price = params.get('max_price')
+                
+                if min_price is not None or max_price is not None:
+                    filtered_products = []
+                    for product in products:
+                        price = product.get('price')
+                        if price is not None:
+                            try:
+                                price_val = float(price)
+                                if min_price is not None and price_val < min_price:
+                                    continue
+                                if max_price is not None and price_val > max_price:
+                                    continue
+                                filtered_products.append(product)
+                            except (ValueError, TypeError):
+                                continue
+                    
+                    products = filtered_products
+                    print(f"[AGENT] Applied price filter: {len(result.get('products', []))} -> {len(products)} products")
+            
+            if products:
+                filter_desc = ""
+                if params.get('min_price'): filter_desc += f" above ${params['min_price']}"
+                if params.get('max_price'): filter_desc += f" below ${params['max_price']}"
+                
+                response_text = f"I found {len(products)} similar products based on your image"
+                if filter_desc:
+                    response_text += f" with prices{filter_desc}"
+                response_text += ". Here are some great options:"
+            else:
+                response_text = "I couldn't find similar products for your image that match your criteria. Try adjusting your filters."
+                
+        else:
+            # Default to basic search
+            result = await search_products_by_text_async(message, limit=10)
+            products = result.get('products', []) if result.get('success') else []
+            response_text = f"I found {len(products)} products for you." if products else "I couldn't find any products matching your request."
+        
+        return products, response_text
+    
+    def _describe_action(self, tool_choice: str, params: Dict[str, Any], has_image: bool) -> str:
+        """Short progress message shown while the chosen tool runs"""
+        if tool_choice == "search_products_by_image" and has_image:
+            return "Looking for products similar to your image..."
+        if tool_choice == "filter_products":
+            return "Filtering products for you..."
+        if tool_choice == "search_products_by_text" and params.get("query"):
+            return f"Searching for '{params['query']}'..."
+        return "Searching products..."
     
     def _generate_suggestions(self, response: Any, products: List[Dict]) -> List[str]:
         """Generate follow-up suggestions based on the conversation"""
@@ -567,7 +689,7 @@ Available tools:
         """Get personalized product recommendations"""
         try:
             # Get user context from conversation history
-            history = self.conversation_manager.get_history(session_id)
+            history = await self.conversation_manager.get_history_async(session_id)
             
             # Extract preferences from conversation
             extracted_prefs = self._extract_preferences(history)
@@ -575,14 +697,15 @@ Available tools:
             # Merge with provided preferences
             all_preferences = {**extracted_prefs, **(preferences or {})}
             
-            # Generate recommendations using filter_products tool
-            response = await self.agent.generate(
-                f"Generate product recommendations based on these preferences: {all_preferences}"
+            # Products that co-occur in other sessions with what this session was shown or clicked
+            from services.recommendations import recommend_for_session
+            skus = await run_blocking(
+                lambda: [sku.to_dict() for sku in recommend_for_session(session_id, all_preferences)]
             )
             
             return {
                 "success": True,
-                "recommendations": [],
+                "recommendations": skus,
                 "preferences_used": all_preferences
             }
             
@@ -610,20 +733,15 @@ Available tools:
                     if price_match:
                         preferences['price_range'] = {'max': float(price_match.group(1))}
                 
-                # Extract category preferences
-                categories_keywords = {
-                    'shoes': [1, 2],  # Shoe category IDs
-                    'clothing': [3, 4],  # Clothing category IDs
-                    'electronics': [5, 6]  # Electronics category IDs
-                }
-                
-                for keyword, cat_ids in categories_keywords.items():
-                    if keyword in content_lower:
-                        preferences.setdefault('categories', []).extend(cat_ids)
+                # Extract category preferences; names are matched against real categories when filtering
+                for keyword in ('shoes', 'clothing', 'electronics'):
+                    if keyword in content_lower and keyword not in preferences.get('category_names', []):
+                        preferences.setdefault('category_names', []).append(keyword)
         
         return preferences
     
-    async def _analyze_intent_and_choose_tool(self, full_message: str, session_id: str = None) -> tuple:
+    async def _analyze_intent_and_choose_tool(self, full_message: str, session_id: str = None,
+                                              message: str = None, has_image: bool = False) -> tuple:
         """
         Hybrid approach: Use rule-based for simple cases, LLM for complex queries
         """
@@ -643,7 +761,7 @@ Available tools:
                     
                     if has_price_filter or has_specific_request:
                         # Use LLM to handle complex image + text query
-                        return await self._llm_analyze_intent(full_message, session_id)
+                        return await self._routed_intent(full_message, session_id, message, has_image)
                 
                 # Simple image-only search
                 return "search_products_by_image", {
@@ -672,7 +790,7 @@ Available tools:
             
             # COMPLEX QUERIES: Use LLM for context understanding
             # This includes follow-ups, multiple filters, contextual references
-            return await self._llm_analyze_intent(full_message, session_id)
+            return await self._routed_intent(full_message, session_id, message, has_image)
             
         except Exception as e:
             print(f"[AGENT] Error in intent analysis: {e}")
@@ -682,17 +800,66 @@ Available tools:
                 "limit": 20
             }
     
+    async def _routed_intent(self, full_message: str, session_id: str = None,
+                             message: str = None, has_image: bool = False) -> tuple:
+        """
+        Resolve an intent from the cache, then the local classifier, then the LLM
+        """
+        if message is None:
+            return await self._llm_analyze_intent(full_message, session_id)
+
+        recent_messages = []
+        if session_id:
+            recent_messages = (await self.conversation_manager.get_full_history_async(session_id))[-6:]
+        cache_key = self.intent_router.cache_key(
+            message, self.intent_router.context_fingerprint(recent_messages), has_image
+        )
+
+        cached = self.intent_router.cache.get(cache_key)
+        if cached:
+            print(f"[AGENT] Intent cache hit: {cached[0]}")
+            return cached
+
+        # The local classifier only handles text turns; image + text queries need the LLM
+        if not has_image:
+            try:
+                routed = await run_blocking(self.intent_router.classify, message, bool(recent_messages))
+            except Exception as e:
+                print(f"[AGENT] Intent classifier failed: {e}")
+                routed = None
+            if routed:
+                self.intent_router.cache.put(cache_key, *routed)
+                return routed
+
+        result = await self._llm_intent(full_message, session_id)
+        if result is None:
+            return self._fallback_rule_based_analysis(full_message)
+        # The LLM reads the history text, which the cache key doesn't cover; only first turns are shareable
+        if not recent_messages:
+            self.intent_router.cache.put(cache_key, *result)
+        return result
+    
     async def _llm_analyze_intent(self, full_message: str, session_id: str = None) -> tuple:
         """
         Use LLM to analyze complex queries with context
         """
+        result = await self._llm_intent(full_message, session_id)
+        if result is None:
+            # Fallback to rule-based extraction
+            return self._fallback_rule_based_analysis(full_message)
+        return result
+    
+    async def _llm_intent(self, full_message: str, session_id: str = None) -> Optional[tuple]:
+        """
+        Ask the LLM for (tool, params); None when no provider is configured or the call fails
+        """
         try:
             # Get conversation history if available
             history_context = ""
             had_previous_image_search = False
             
             if session_id and hasattr(self, 'conversation_manager'):
-                history = self.conversation_manager.get_history(session_id)
+                history = await self.conversation_manager.get_history_async(session_id)
                 if history:
                     # Include last 3 exchanges for context
                     recent_history = history[-6:]  # 3 user + 3 assistant messages
@@ -709,82 +876,36 @@ Available tools:
             if had_previous_image_search and "[image provided]" not in full_message.lower():
                 history_context += "\nNOTE: Previous messages involved image searches. For follow-up queries without new images, use filter_products to refine the results."
             
-            # Create prompt for LLM
-            analysis_prompt = f"""Analyze this shopping query and return a JSON response.
+            # Create prompt for LLM; the output format comes from INTENT_SCHEMA
+            analysis_prompt = f"""Analyze this shopping query and choose a tool.
 
 {history_context}
 
 Current query: {full_message}
 
-Determine:
-1. What products the user is looking for (use context if this is a follow-up)
-2. Any price constraints (min_price, max_price)
-3. Any vendor/brand preferences
-4. Which tool to use
-
-Available tools:
-- search_products_by_text: For general product searches
-- search_products_by_image: For image-based searches (use when image is provided)
-- filter_products: When specific price/vendor filters are needed
-- get_product_details: For specific product ID
-- get_similar_products: For finding similar items
+Determine what products the user wants (use context for follow-ups), any price or vendor constraints, and the tool:
+- search_products_by_text: general product searches (query, limit)
+- search_products_by_image: image-based searches (limit, apply_price_filter, min_price, max_price)
+- filter_products: specific price/vendor/product type filters (min_price, max_price, vendors, product_types_filter, limit)
+- get_product_details: a specific product ID
+- get_similar_products: items similar to a product
 
-IMPORTANT: 
+Rules:
 - If "[Image provided]" is in the query, use search_products_by_image with any price filters
-- If NO image is provided but the previous conversation had image searches, use filter_products to filter by the new criteria
-- For follow-up queries without images (like "anything below 500?"), use filter_products NOT search_products_by_image
+- If NO image is provided but the previous conversation had image searches, use filter_products
+- Only set parameters relevant to the chosen tool"""
 
-Return ONLY valid JSON in this format:
-{{
-    "tool": "tool_name",
-    "params": {{
-        "query": "search query (only for search_products_by_text)",
-        "min_price": null or number,
-        "max_price": null or number,
-        "vendors": [] or ["vendor1", "vendor2"],
-        "product_types_filter": [] or ["shirt", "pants", etc],
-        "limit": 20,
-        "image_base64": "provided_in_context" (only for search_products_by_image),
-        "apply_price_filter": true (only for search_products_by_image with price filters)
-    }},
-    "reasoning": "brief explanation"
-}}
-
-IMPORTANT: Only include relevant parameters for each tool:
-- search_products_by_text: query, limit
-- search_products_by_image: image_base64, limit, apply_price_filter, min_price, max_price (if filtering)
-- filter_products: min_price, max_price, vendors, product_types_filter, limit"""
-
-            # Get LLM provider configuration from database
-            llm_provider = "openai"  # default
-            llm_model = "gpt-4-turbo-preview"  # default
-            api_key = None
-            
-            try:
-                from models.agent import AgentConfig
-                config = AgentConfig.get_current_config()
-                if config:
-                    llm_provider = config.llm_provider or "openai"
-                    llm_model = config.llm_model or "gpt-4-turbo-preview"
-                    
-                    # Get the appropriate API key based on provider
-                    if llm_provider.lower() == "openai":
-                        api_key = config.openai_api_key or os.getenv("OPENAI_API_KEY")
-                    elif llm_provider.lower() == "anthropic":
-                        api_key = config.anthropic_api_key or os.getenv("ANTHROPIC_API_KEY")
-                    elif llm_provider.lower() == "google":
-                        api_key = config.google_api_key or os.getenv("GOOGLE_API_KEY")
-            except Exception as e:
-                print(f"[AGENT] Error getting config: {e}")
-                # Fallback to environment variables
-                api_key = os.getenv("OPENAI_API_KEY")
+            # LLM provider configuration, cached until the config changes
+            settings = get_provider_pool().get_config(_load_llm_settings)
+            llm_provider = settings["llm_provider"]
+            api_key = settings["api_key"]
             
             if not api_key:
                 print(f"[AGENT] No API key found for provider '{llm_provider}', falling back to rule-based analysis")
-                return self._fallback_rule_based_analysis(full_message)
+                return None
             
-            # Use LLM to analyze
-            provider = LLMProviderFactory.create_provider(llm_provider, api_key)
+            # Use LLM to analyze, reusing the pooled client for this provider and key
+            provider = get_provider_pool().get_provider(llm_provider, api_key)
             messages = [{"role": "user", "content": analysis_prompt}]
             
             # Use appropriate model for the provider
@@ -795,32 +916,25 @@ IMPORTANT: Only include relevant parameters for each tool:
             else:  # google
                 model = "gemini-1.5-flash"  # Fast model for analysis
             
-            response = provider.chat_completion(
+            # Native function/tool calling returns parsed arguments - no JSON scraping
+            result = await provider.structured_completion_async(
                 messages=messages,
+                schema=INTENT_SCHEMA,
+                name="choose_tool",
+                description="Select the shopping tool and its parameters for the user's query",
                 model=model,
-                temperature=0.1,  # Low temp for consistent JSON
-                max_tokens=300
+                temperature=0.1,
+                max_tokens=200
             )
             
-            # Parse LLM response
-            response_text = response.content.strip()
-            # Extract JSON from response (handle markdown code blocks)
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            
-            result = json.loads(response_text)
-            
             print(f"[AGENT] LLM Analysis: {result.get('reasoning', 'No reasoning provided')}")
             
             # Validate and clean params
             tool = result.get("tool", "search_products_by_text")
-            params = result.get("params", {})
+            params = {key: value for key, value in result.items()
+                      if key not in ("tool", "reasoning") and value is not None}
+            if tool == "search_products_by_image":
+                params["image_base64"] = "provided_in_context"
             
             # Ensure required params based on tool
             if tool == "filter_products":
@@ -835,8 +949,7 @@ IMPORTANT: Only include relevant parameters for each tool:
             
         except Exception as e:
             print(f"[AGENT] LLM analysis failed: {e}")
-            # Fallback to rule-based extraction
-            return self._fallback_rule_based_analysis(full_message)
+            return None
     
     def _fallback_rule_based_analysis(self, full_message: str) -> tuple:
         """
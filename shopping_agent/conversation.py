@@ -6,7 +6,9 @@ Handles conversation history, context, and state management
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
-from collections import defaultdict
+
+from services.async_utils import run_blocking
+from .session_store import create_session_store
 
 
 class Message:
@@ -38,33 +40,61 @@ class Message:
         )
 
 
+def load_session_history(session_id: str, limit: int) -> List[Message]:
+    """Rebuild a session's recent messages from the agent_conversations table"""
+    from flask import has_app_context
+    if not has_app_context():
+        return []
+    
+    from models.agent import AgentConversation
+    from .write_buffer import get_write_buffer
+    
+    buffer = get_write_buffer()
+    if buffer.has_pending(session_id):
+        buffer.flush()
+    
+    rows = AgentConversation.get_session_history(session_id, limit=limit)
+    return [Message(
+        row.role,
+        row.content,
+        timestamp=row.created_at,
+        metadata=json.loads(row.message_metadata) if row.message_metadata else {}
+    ) for row in rows]
+
+
 class ConversationManager:
     """Manages conversation history and context"""
     
-    def __init__(self, max_history_length: int = 20):
-        self.conversations = defaultdict(list)
+    def __init__(self, max_history_length: int = 20, store=None):
         self.max_history_length = max_history_length
-        self.contexts = defaultdict(dict)
+        self.store = store or create_session_store(
+            loader=lambda session_id: load_session_history(session_id, max_history_length)
+        )
     
     def add_message(self, session_id: str, role: str, content: str, metadata: Optional[Dict] = None):
         """Add a message to the conversation"""
         message = Message(role, content, metadata=metadata)
-        self.conversations[session_id].append(message)
         
-        # Trim history if it exceeds max length
-        if len(self.conversations[session_id]) > self.max_history_length:
-            # Keep system messages and recent messages
-            system_msgs = [m for m in self.conversations[session_id] if m.role == "system"]
-            other_msgs = [m for m in self.conversations[session_id] if m.role != "system"]
+        def append(entry):
+            entry.messages.append(message)
             
-            # Keep last N messages plus system messages
-            keep_count = self.max_history_length - len(system_msgs)
-            self.conversations[session_id] = system_msgs + other_msgs[-keep_count:]
+            # Trim history if it exceeds max length
+            if len(entry.messages) > self.max_history_length:
+                # Keep system messages and recent messages
+                system_msgs = [m for m in entry.messages if m.role == "system"]
+                other_msgs = [m for m in entry.messages if m.role != "system"]
+                
+                # Keep last N messages plus system messages
+                keep_count = self.max_history_length - len(system_msgs)
+                entry.messages = system_msgs + other_msgs[-keep_count:]
+        
+        # Read-modify-write in one step, so a concurrent turn on another worker isn't overwritten
+        self.store.update(session_id, append)
     
     def get_history(self, session_id: str) -> List[Dict[str, str]]:
         """Get conversation history in format suitable for LLM"""
         history = []
-        for message in self.conversations[session_id]:
+        for message in self.store.get(session_id).messages:
             history.append({
                 "role": message.role,
                 "content": message.content
@@ -73,30 +103,46 @@ class ConversationManager:
     
     def get_full_history(self, session_id: str) -> List[Message]:
         """Get full conversation history with metadata"""
-        return self.conversations[session_id]
+        return self.store.get(session_id).messages
+    
+    async def get_history_async(self, session_id: str) -> List[Dict[str, str]]:
+        """get_history() for async callers; a store miss rehydrates from the database off the event loop"""
+        return await run_blocking(self.get_history, session_id)
+    
+    async def get_full_history_async(self, session_id: str) -> List[Message]:
+        """get_full_history() for async callers, with store I/O off the event loop"""
+        return await run_blocking(self.get_full_history, session_id)
+    
+    async def add_message_async(self, session_id: str, role: str, content: str, metadata: Optional[Dict] = None):
+        """add_message() for async callers, with store I/O off the event loop"""
+        await run_blocking(self.add_message, session_id, role, content, metadata)
     
     def clear_history(self, session_id: str):
         """Clear conversation history for a session"""
-        if session_id in self.conversations:
-            del self.conversations[session_id]
-        if session_id in self.contexts:
-            del self.contexts[session_id]
+        self.store.discard(session_id)
     
     def set_context(self, session_id: str, key: str, value: Any):
         """Set context value for a session"""
-        self.contexts[session_id][key] = value
+        def set_value(entry):
+            entry.context[key] = value
+        
+        self.store.update(session_id, set_value)
     
     def get_context(self, session_id: str, key: str, default: Any = None) -> Any:
         """Get context value for a session"""
-        return self.contexts[session_id].get(key, default)
+        return self.store.get(session_id).context.get(key, default)
     
     def get_all_context(self, session_id: str) -> Dict[str, Any]:
         """Get all context for a session"""
-        return self.contexts[session_id].copy()
+        return self.store.get(session_id).context.copy()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Memory usage of the session store"""
+        return self.store.stats()
     
     def get_summary(self, session_id: str) -> Dict[str, Any]:
         """Get conversation summary"""
-        messages = self.conversations[session_id]
+        messages = self.store.get(session_id).messages
         
         if not messages:
             return {
@@ -123,7 +169,7 @@ class ConversationManager:
         """Export conversation as JSON string"""
         data = {
             "session_id": session_id,
-            "messages": [msg.to_dict() for msg in self.conversations[session_id]],
+            "messages": [msg.to_dict() for msg in self.store.get(session_id).messages],
             "context": self.get_all_context(session_id),
             "summary": self.get_summary(session_id)
         }
@@ -137,13 +183,14 @@ class ConversationManager:
         # Clear existing data
         self.clear_history(session_id)
         
-        # Import messages
-        for msg_data in parsed_data["messages"]:
-            message = Message.from_dict(msg_data)
-            self.conversations[session_id].append(message)
+        def replace(entry):
+            # Import messages
+            entry.messages = [Message.from_dict(msg_data) for msg_data in parsed_data["messages"]]
+            
+            # Import context
+            if "context" in parsed_data:
+                entry.context = parsed_data["context"]
         
-        # Import context
-        if "context" in parsed_data:
-            self.contexts[session_id] = parsed_data["context"]
+        self.store.update(session_id, replace)
         
         return session_id
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""
+Intent routing for the shopping agent without an LLM call per message
+
+Two layers sit in front of the LLM intent analysis:
+1. A small LRU/TTL cache of resolved intents keyed by the normalized message
+   plus a short fingerprint of the conversation state the LLM would look at.
+2. A nearest-neighbour classifier over labeled example queries, using the
+   same sentence-transformer model as product search. Confident predictions
+   are turned into tool parameters with the rule-based extractors; anything
+   ambiguous or context-dependent goes to the LLM.
+"""
+
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Labeled example queries per tool
+INTENT_EXAMPLES = {
+    "search_products_by_text": [
+        "show me red running shoes",
+        "i need a winter jacket",
+        "do you have leather wallets",
+        "looking for a summer dress",
+        "find me wireless headphones",
+        "i want a cotton t-shirt",
+        "black jeans for men",
+        "waterproof hiking boots",
+        "something for a wedding",
+        "gift ideas for my dad",
+        "casual shirts",
+        "a warm sweater",
+    ],
+    "filter_products": [
+        "shirts under $50",
+        "shoes below 100 dollars",
+        "show me jackets between $50 and $150",
+        "anything cheaper than $30",
+        "products over $200",
+        "pants less than 40",
+        "dresses above $80",
+        "show me everything under 25 dollars",
+        "items in stock under $60",
+        "budget options below $20",
+    ],
+}
+
+# Structured output schema for LLM intent analysis (flat so every provider's tool calling accepts it)
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tool": {
+            "type": "string",
+            "enum": ["search_products_by_text", "search_products_by_image", "filter_products",
+                     "get_product_details", "get_similar_products"]
+        },
+        "query": {"type": "string", "description": "Search query (search_products_by_text only)"},
+        "min_price": {"type": "number"},
+        "max_price": {"type": "number"},
+        "vendors": {"type": "array", "items": {"type": "string"}},
+        "product_types_filter": {"type": "array", "items": {"type": "string"}},
+        "apply_price_filter": {"type": "boolean", "description": "Image search with price limits"},
+        "limit": {"type": "integer"},
+        "reasoning": {"type": "string", "description": "Brief explanation"}
+    },
+    "required": ["tool"]
+}
+
+PRODUCT_TYPE_KEYWORDS = {
+    "shirt": ["shirt", "blouse", "top", "tee"],
+    "pants": ["pant", "jean", "trouser", "slack", "legging"],
+    "shoes": ["shoe", "sneaker", "boot", "sandal", "heel"],
+    "dress": ["dress", "gown", "frock"],
+    "jacket": ["jacket", "coat", "blazer", "hoodie", "sweater"]
+}
+
+# Leading phrases stripped to build a search query
+QUERY_PREFIX = re.compile(
+    r"^(?:please\s+)?(?:can you\s+)?(?:show me|find me|find|search for|i want|i need|i'm looking for|"
+    r"im looking for|looking for|do you have|get me)\s+(?:some\s+|a\s+|an\s+)?"
+)
+
+# Messages that only make sense with the previous turn ("cheaper ones", "what about those")
+REFERENTIAL = re.compile(r"\b(these|those|them|ones|that one|it|same|similar|cheaper|more expensive|another|else|more)\b")
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, keep words, numbers and prices, collapse whitespace"""
+    message = message.lower().strip()
+    message = re.sub(r"[^\w\s$.']", " ", message)
+    message = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", message)
+    return re.sub(r"\s+", " ", message).strip()
+
+
+def extract_price_range(message: str) -> Tuple[Optional[float], Optional[float]]:
+    """Pull min/max prices out of a message"""
+    min_price = max_price = None
+    between = re.search(r"between\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to|-)\s*\$?(\d+(?:\.\d+)?)", message)
+    if between:
+        return float(between.group(1)), float(between.group(2))
+
+    above = re.search(r"(?:above|over|more than|at least|from)\s*\$?(\d+(?:\.\d+)?)", message)
+    below = re.search(r"(?:below|under|less than|cheaper than|up to|max|within)\s*\$?(\d+(?:\.\d+)?)", message)
+    if above:
+        min_price = float(above.group(1))
+    if below:
+        max_price = float(below.group(1))
+    return min_price, max_price
+
+
+def extract_product_types(message: str) -> List[str]:
+    """Product types mentioned in a message"""
+    return [product_type for product_type, keywords in PRODUCT_TYPE_KEYWORDS.items()
+            if any(keyword in message for keyword in keywords)]
+
+
+class IntentCache:
+    """LRU cache of (tool, params) with a time-to-live"""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            tool, params = entry[1]
+        # Callers mutate params, so hand out a copy
+        return tool, copy.deepcopy(params)
+
+    def put(self, key: str, tool: str, params: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), (tool, copy.deepcopy(params)))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class IntentClassifier:
+    """Nearest-neighbour intent classifier over INTENT_EXAMPLES"""
+
+    def __init__(self, model_loader: Callable, examples: Dict[str, List[str]] = None,
+                 threshold: float = None, margin: float = 0.05, k: int = 3):
+        self.model_loader = model_loader
+        self.examples = examples or INTENT_EXAMPLES
+        self.threshold = threshold if threshold is not None else float(os.getenv('INTENT_CLASSIFIER_THRESHOLD', 0.6))
+        self.margin = margin
+        self.k = k
+        self._model = None
+        self._matrix = None
+        self._labels = []
+        self._lock = threading.Lock()
+
+    def _ensure_index(self) -> bool:
+        """Embed the labeled examples once"""
+        if self._matrix is not None:
+            return True
+        with self._lock:
+            if self._matrix is None:
+                model = self.model_loader()
+                if model is None:
+                    return False
+                texts, labels = [], []
+                for tool, examples in self.examples.items():
+                    for example in examples:
+                        texts.append(normalize_message(example))
+                        labels.append(tool)
+                self._model = model
+                self._labels = labels
+                self._matrix = np.asarray(model.encode(texts, normalize_embeddings=True))
+        return True
+
+    def predict(self, message: str) -> Optional[Tuple[str, float]]:
+        """Return (tool, confidence) or None when the prediction is not confident"""
+        if not self._ensure_index():
+            return None
+
+        query = np.asarray(self._model.encode([normalize_message(message)], normalize_embeddings=True))[0]
+        similarities = self._matrix @ query
+        top = np.argsort(-similarities)[:self.k]
+
+        # Similarity-weighted vote among the nearest examples
+        votes = {}
+        for index in top:
+            votes[self._labels[index]] = votes.get(self._labels[index], 0.0) + float(similarities[index])
+        ranked = sorted(votes.items(), key=lambda item: item[1], reverse=True)
+        tool = ranked[0][0]
+
+        best = max(float(similarities[index]) for index in top if self._labels[index] == tool)
+        runner_up = max((float(similarities[index]) for index in top if self._labels[index] != tool), default=0.0)
+        if best < self.threshold or best - runner_up < self.margin:
+            return None
+        return tool, best
+
+
+class IntentRouter:
+    """Cache + local classifier in front of the LLM intent analysis"""
+
+    def __init__(self, model_loader: Callable, cache: IntentCache = None, classifier: IntentClassifier = None):
+        self.cache = cache or IntentCache(
+            max_entries=int(os.getenv('INTENT_CACHE_SIZE', 2048)),
+            ttl=float(os.getenv('INTENT_CACHE_TTL', 600))
+        )
+        self.classifier = classifier or IntentClassifier(model_loader)
+        self.classifier_hits = 0
+
+    def cache_key(self, message: str, fingerprint: str, has_image: bool) -> str:
+        raw = f"{normalize_message(message)}|{fingerprint}|{int(has_image)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def context_fingerprint(recent_messages: List[Any]) -> str:
+        """Summarize the conversation state the intent depends on
+
+        Uses whether there is any history, the last assistant turn's tool and
+        product types, and whether an image search happened recently, rather
+        than the full history text. That is only enough for intents derived
+        from the message itself, so LLM results for turns with history must
+        not be cached.
+        """
+        last_tool, product_types, had_image = "", "", False
+        for msg in reversed(recent_messages):
+            metadata = getattr(msg, 'metadata', None) or {}
+            if msg.role == 'assistant' and not last_tool:
+                last_tool = metadata.get('tool_used') or ''
+                product_types = ",".join(sorted(metadata.get('product_types') or []))
+            if 'image' in (msg.content or '').lower() or metadata.get('has_image'):
+                had_image = True
+        return f"{int(bool(recent_messages))}:{last_tool}:{product_types}:{int(had_image)}"
+
+    def classify(self, message: str, has_history: bool) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Resolve common intents locally; None when the LLM should decide"""
+        normalized = normalize_message(message)
+        product_types = extract_product_types(normalized)
+
+        # Follow-ups ("cheaper ones?") depend on the previous turn - leave them to the LLM
+        if has_history and (not product_types or REFERENTIAL.search(normalized)):
+            return None
+
+        prediction = self.classifier.predict(message)
+        if prediction is None:
+            return None
+        tool, confidence = prediction
+        min_price, max_price = extract_price_range(normalized)
+
+        if tool == "filter_products":
+            if min_price is None and max_price is None:
+                return None
+            params = {
+                "min_price": min_price,
+                "max_price": max_price,
+                "product_types_filter": product_types,
+                "limit": 30,
+                "in_stock": False
+            }
+        else:
+            if min_price is not None or max_price is not None:
+                return None  # Price constraints the classifier did not pick up on
+            query = QUERY_PREFIX.sub("", normalized).strip(" ?")
+            if not query:
+                return None
+            params = {"query": query, "limit": 20}
+
+        self.classifier_hits += 1
+        print(f"[INTENT] Classified '{message}' as {tool} (confidence {confidence:.2f})")
+        return tool, params
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "classifier_hits": self.classifier_hits
+        }
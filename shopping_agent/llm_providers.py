@@ -4,20 +4,26 @@ Supports OpenAI, Anthropic, and Google Gemini
 """
 
 import os
-from typing import List, Dict, Any, Optional
+import asyncio
+import hashlib
+import threading
+import time
+from typing import List, Dict, Any, Optional, Callable
 from abc import ABC, abstractmethod
 import json
 
 # Import LLM libraries
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     OpenAI = None
+    AsyncOpenAI = None
 
 try:
-    from anthropic import Anthropic
+    from anthropic import Anthropic, AsyncAnthropic
 except ImportError:
     Anthropic = None
+    AsyncAnthropic = None
 
 try:
     import google.generativeai as genai
@@ -40,12 +46,56 @@ class BaseLLMProvider(ABC):
         """Generate chat completion from messages"""
         pass
     
+    async def chat_completion_async(self, messages: List[Dict[str, str]], **kwargs) -> LLMResponse:
+        """Generate chat completion without blocking the event loop
+        
+        Providers with a native async client override this; the default runs
+        the blocking call in a worker thread.
+        """
+        return await asyncio.to_thread(self.chat_completion, messages, **kwargs)
+    
+    def structured_completion(self, messages: List[Dict[str, str]], schema: Dict[str, Any],
+                              name: str = "respond", description: str = "", **kwargs) -> Dict[str, Any]:
+        """Return a dict matching a JSON schema
+        
+        Providers with native tool calling override this; the default asks for
+        JSON in the prompt and parses the reply.
+        """
+        response = self.chat_completion(self._json_prompt_messages(messages, schema), **kwargs)
+        return parse_json_content(response.content)
+    
+    async def structured_completion_async(self, messages: List[Dict[str, str]], schema: Dict[str, Any],
+                                          name: str = "respond", description: str = "", **kwargs) -> Dict[str, Any]:
+        """Async version of structured_completion"""
+        response = await self.chat_completion_async(self._json_prompt_messages(messages, schema), **kwargs)
+        return parse_json_content(response.content)
+    
+    @staticmethod
+    def _json_prompt_messages(messages: List[Dict[str, str]], schema: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Append JSON output instructions to the last message"""
+        messages = [dict(msg) for msg in messages]
+        messages[-1]["content"] = (
+            f"{messages[-1].get('content', '')}\n\n"
+            f"Return ONLY a JSON object matching this JSON schema:\n{json.dumps(schema)}"
+        )
+        return messages
+    
     @abstractmethod
     def is_available(self) -> bool:
         """Check if the provider is properly configured and available"""
         pass
 
 
+def parse_json_content(content: str) -> Dict[str, Any]:
+    """Parse a JSON object from model output, tolerating markdown code fences"""
+    text = (content or "").strip()
+    if "```" in text:
+        start = text.find("```json") + 7 if "```json" in text else text.find("```") + 3
+        end = text.find("```", start)
+        text = text[start:end if end != -1 else None].strip()
+    return json.loads(text)
+
+
 class OpenAIProvider(BaseLLMProvider):
     """OpenAI GPT models provider"""
     
@@ -53,22 +103,22 @@ class OpenAIProvider(BaseLLMProvider):
         if not OpenAI:
             raise ImportError("openai package not installed. Run: pip install openai")
         self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key) if AsyncOpenAI else None
         self.api_key = api_key
     
+    def _format_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Ensure messages are in OpenAI format"""
+        return [{
+            "role": msg.get("role", "user"),
+            "content": msg.get("content", "")
+        } for msg in messages]
+    
     def chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-4-turbo-preview", **kwargs) -> LLMResponse:
         """Generate chat completion using OpenAI"""
         try:
-            # Ensure messages are in OpenAI format
-            formatted_messages = []
-            for msg in messages:
-                formatted_messages.append({
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                })
-            
             response = self.client.chat.completions.create(
                 model=model,
-                messages=formatted_messages,
+                messages=self._format_messages(messages),
                 temperature=kwargs.get("temperature", 0.7),
                 max_tokens=kwargs.get("max_tokens", 500),
                 stream=kwargs.get("stream", False)
@@ -83,6 +133,78 @@ class OpenAIProvider(BaseLLMProvider):
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}")
     
+    async def chat_completion_async(self, messages: List[Dict[str, str]], model: str = "gpt-4-turbo-preview", **kwargs) -> LLMResponse:
+        """Generate chat completion using the async OpenAI client"""
+        if not self.async_client:
+            return await super().chat_completion_async(messages, model=model, **kwargs)
+        
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=self._format_messages(messages),
+                temperature=kwargs.get("temperature", 0.7),
+                max_tokens=kwargs.get("max_tokens", 500),
+                stream=kwargs.get("stream", False)
+            )
+            
+            if kwargs.get("stream", False):
+                return response  # Return async iterator for streaming
+            
+            content = response.choices[0].message.content
+            return LLMResponse(content=content, raw_response=response)
+            
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+    
+    def _structured_params(self, messages: List[Dict[str, str]], schema: Dict[str, Any], name: str,
+                           description: str, model: str, **kwargs) -> Dict[str, Any]:
+        """Request parameters forcing a single function call with the schema as its arguments"""
+        return {
+            "model": model,
+            "messages": self._format_messages(messages),
+            "temperature": kwargs.get("temperature", 0.7),
+            "max_tokens": kwargs.get("max_tokens", 500),
+            "tools": [{
+                "type": "function",
+                "function": {"name": name, "description": description, "parameters": schema}
+            }],
+            "tool_choice": {"type": "function", "function": {"name": name}}
+        }
+    
+    @staticmethod
+    def _tool_arguments(response) -> Dict[str, Any]:
+        tool_calls = response.choices[0].message.tool_calls
+        if not tool_calls:
+            raise ValueError("response contained no function call")
+        return json.loads(tool_calls[0].function.arguments)
+    
+    def structured_completion(self, messages: List[Dict[str, str]], schema: Dict[str, Any], name: str = "respond",
+                              description: str = "", model: str = "gpt-4-turbo-preview", **kwargs) -> Dict[str, Any]:
+        """Structured output through OpenAI function calling"""
+        try:
+            response = self.client.chat.completions.create(
+                **self._structured_params(messages, schema, name, description, model, **kwargs)
+            )
+            return self._tool_arguments(response)
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+    
+    async def structured_completion_async(self, messages: List[Dict[str, str]], schema: Dict[str, Any],
+                                          name: str = "respond", description: str = "",
+                                          model: str = "gpt-4-turbo-preview", **kwargs) -> Dict[str, Any]:
+        """Structured output through OpenAI function calling (async client)"""
+        if not self.async_client:
+            return await asyncio.to_thread(self.structured_completion, messages, schema, name, description,
+                                           model=model, **kwargs)
+        
+        try:
+            response = await self.async_client.chat.completions.create(
+                **self._structured_params(messages, schema, name, description, model, **kwargs)
+            )
+            return self._tool_arguments(response)
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+    
     def is_available(self) -> bool:
         """Check if OpenAI is properly configured"""
         return bool(self.api_key and OpenAI)
@@ -95,53 +217,112 @@ class AnthropicProvider(BaseLLMProvider):
         if not Anthropic:
             raise ImportError("anthropic package not installed. Run: pip install anthropic")
         self.client = Anthropic(api_key=api_key)
+        self.async_client = AsyncAnthropic(api_key=api_key) if AsyncAnthropic else None
         self.api_key = api_key
     
+    def _create_params(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Dict[str, Any]:
+        """Convert messages to Anthropic request parameters"""
+        # Anthropic expects a system message separately
+        system_message = None
+        anthropic_messages = []
+        
+        for msg in messages:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            
+            if role == "system":
+                system_message = content
+            elif role == "assistant":
+                anthropic_messages.append({
+                    "role": "assistant",
+                    "content": content
+                })
+            else:  # user
+                anthropic_messages.append({
+                    "role": "user",
+                    "content": content
+                })
+        
+        create_params = {
+            "model": model,
+            "messages": anthropic_messages,
+            "max_tokens": kwargs.get("max_tokens", 500),
+            "temperature": kwargs.get("temperature", 0.7)
+        }
+        
+        if system_message:
+            create_params["system"] = system_message
+        
+        return create_params
+    
     def chat_completion(self, messages: List[Dict[str, str]], model: str = "claude-3-sonnet-20240229", **kwargs) -> LLMResponse:
         """Generate chat completion using Anthropic"""
         try:
-            # Convert messages to Anthropic format
-            # Anthropic expects a system message separately
-            system_message = None
-            anthropic_messages = []
-            
-            for msg in messages:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                if role == "system":
-                    system_message = content
-                elif role == "assistant":
-                    anthropic_messages.append({
-                        "role": "assistant",
-                        "content": content
-                    })
-                else:  # user
-                    anthropic_messages.append({
-                        "role": "user",
-                        "content": content
-                    })
+            response = self.client.messages.create(**self._create_params(messages, model, **kwargs))
             
-            # Create the message
-            create_params = {
-                "model": model,
-                "messages": anthropic_messages,
-                "max_tokens": kwargs.get("max_tokens", 500),
-                "temperature": kwargs.get("temperature", 0.7)
-            }
-            
-            if system_message:
-                create_params["system"] = system_message
+            # Extract content from response
+            content = response.content[0].text if response.content else ""
+            return LLMResponse(content=content, raw_response=response)
             
-            response = self.client.messages.create(**create_params)
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+    
+    async def chat_completion_async(self, messages: List[Dict[str, str]], model: str = "claude-3-sonnet-20240229", **kwargs) -> LLMResponse:
+        """Generate chat completion using the async Anthropic client"""
+        if not self.async_client:
+            return await super().chat_completion_async(messages, model=model, **kwargs)
+        
+        try:
+            response = await self.async_client.messages.create(**self._create_params(messages, model, **kwargs))
             
-            # Extract content from response
             content = response.content[0].text if response.content else ""
             return LLMResponse(content=content, raw_response=response)
             
         except Exception as e:
             raise Exception(f"Anthropic API error: {str(e)}")
     
+    def _structured_params(self, messages: List[Dict[str, str]], schema: Dict[str, Any], name: str,
+                           description: str, model: str, **kwargs) -> Dict[str, Any]:
+        """Request parameters forcing a single tool_use block with the schema as its input"""
+        create_params = self._create_params(messages, model, **kwargs)
+        create_params["tools"] = [{"name": name, "description": description, "input_schema": schema}]
+        create_params["tool_choice"] = {"type": "tool", "name": name}
+        return create_params
+    
+    @staticmethod
+    def _tool_input(response) -> Dict[str, Any]:
+        for block in response.content or []:
+            if block.type == "tool_use":
+                return block.input
+        raise ValueError("response contained no tool_use block")
+    
+    def structured_completion(self, messages: List[Dict[str, str]], schema: Dict[str, Any], name: str = "respond",
+                              description: str = "", model: str = "claude-3-sonnet-20240229", **kwargs) -> Dict[str, Any]:
+        """Structured output through Anthropic tool use"""
+        try:
+            response = self.client.messages.create(
+                **self._structured_params(messages, schema, name, description, model, **kwargs)
+            )
+            return self._tool_input(response)
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+    
+    async def structured_completion_async(self, messages: List[Dict[str, str]], schema: Dict[str, Any],
+                                          name: str = "respond", description: str = "",
+                                          model: str = "claude-3-sonnet-20240229", **kwargs) -> Dict[str, Any]:
+        """Structured output through Anthropic tool use (async client)"""
+        if not self.async_client:
+            return await asyncio.to_thread(self.structured_completion, messages, schema, name, description,
+                                           model=model, **kwargs)
+        
+        try:
+            response = await self.async_client.messages.create(
+                **self._structured_params(messages, schema, name, description, model, **kwargs)
+            )
+            return self._tool_input(response)
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+    
     def is_available(self) -> bool:
         """Check if Anthropic is properly configured"""
         return bool(self.api_key and Anthropic)
@@ -157,62 +338,102 @@ class GeminiProvider(BaseLLMProvider):
         self.api_key = api_key
         self.model = None
     
+    def _prepare_chat(self, messages: List[Dict[str, str]], model: str):
+        """Build a Gemini chat session from the history; returns (chat, content of the message to send)"""
+        # Initialize model if needed
+        if not self.model or self.model.model_name != f"models/{model}":
+            self.model = genai.GenerativeModel(model)
+        
+        # Convert messages to Gemini format
+        # Gemini uses a chat session approach
+        chat = self.model.start_chat(history=[])
+        
+        # Process messages
+        for msg in messages[:-1]:  # All but the last message as history
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            
+            if role == "system":
+                # Gemini doesn't have explicit system messages
+                # We'll prepend it to the first user message
+                continue
+            elif role == "assistant":
+                # Add as model response in history
+                chat.history.append({
+                    "role": "model",
+                    "parts": [content]
+                })
+            else:  # user
+                chat.history.append({
+                    "role": "user",
+                    "parts": [content]
+                })
+        
+        # Build the last message
+        last_msg = messages[-1]
+        
+        # Handle system message if it's the only message
+        if len(messages) == 1 and last_msg.get("role") == "system":
+            return chat, last_msg.get("content", "")
+        
+        # Prepend system message if exists
+        system_content = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user_content = last_msg.get("content", "")
+        
+        if system_content and last_msg.get("role") == "user":
+            return chat, f"{system_content}\n\n{user_content}"
+        return chat, user_content
+    
     def chat_completion(self, messages: List[Dict[str, str]], model: str = "gemini-pro", **kwargs) -> LLMResponse:
         """Generate chat completion using Gemini"""
         try:
-            # Initialize model if needed
-            if not self.model or self.model.model_name != f"models/{model}":
-                self.model = genai.GenerativeModel(model)
-            
-            # Convert messages to Gemini format
-            # Gemini uses a chat session approach
-            chat = self.model.start_chat(history=[])
-            
-            # Process messages
-            for msg in messages[:-1]:  # All but the last message as history
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                if role == "system":
-                    # Gemini doesn't have explicit system messages
-                    # We'll prepend it to the first user message
-                    continue
-                elif role == "assistant":
-                    # Add as model response in history
-                    chat.history.append({
-                        "role": "model",
-                        "parts": [content]
-                    })
-                else:  # user
-                    chat.history.append({
-                        "role": "user",
-                        "parts": [content]
-                    })
-            
-            # Send the last message
-            if messages:
-                last_msg = messages[-1]
-                
-                # Handle system message if it's the only message
-                if len(messages) == 1 and last_msg.get("role") == "system":
-                    response = chat.send_message(last_msg.get("content", ""))
-                else:
-                    # Prepend system message if exists
-                    system_content = next((m["content"] for m in messages if m.get("role") == "system"), "")
-                    user_content = last_msg.get("content", "")
-                    
-                    if system_content and last_msg.get("role") == "user":
-                        full_content = f"{system_content}\n\n{user_content}"
-                    else:
-                        full_content = user_content
-                    
-                    response = chat.send_message(full_content)
+            chat, content = self._prepare_chat(messages, model)
+            response = chat.send_message(content)
+            return LLMResponse(content=response.text, raw_response=response)
             
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+    
+    async def chat_completion_async(self, messages: List[Dict[str, str]], model: str = "gemini-pro", **kwargs) -> LLMResponse:
+        """Generate chat completion using Gemini's async API"""
+        try:
+            chat, content = self._prepare_chat(messages, model)
+            response = await chat.send_message_async(content)
             return LLMResponse(content=response.text, raw_response=response)
             
         except Exception as e:
             raise Exception(f"Gemini API error: {str(e)}")
     
+    @staticmethod
+    def _json_generation_config(**kwargs) -> Dict[str, Any]:
+        """Constrain the reply to JSON (the schema itself is given in the prompt)"""
+        return {
+            "response_mime_type": "application/json",
+            "temperature": kwargs.get("temperature", 0.7),
+            "max_output_tokens": kwargs.get("max_tokens", 500)
+        }
+    
+    def structured_completion(self, messages: List[Dict[str, str]], schema: Dict[str, Any], name: str = "respond",
+                              description: str = "", model: str = "gemini-pro", **kwargs) -> Dict[str, Any]:
+        """Structured output through Gemini's JSON response mode"""
+        try:
+            chat, content = self._prepare_chat(self._json_prompt_messages(messages, schema), model)
+            response = chat.send_message(content, generation_config=self._json_generation_config(**kwargs))
+            return parse_json_content(response.text)
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+    
+    async def structured_completion_async(self, messages: List[Dict[str, str]], schema: Dict[str, Any],
+                                          name: str = "respond", description: str = "",
+                                          model: str = "gemini-pro", **kwargs) -> Dict[str, Any]:
+        """Structured output through Gemini's JSON response mode (async API)"""
+        try:
+            chat, content = self._prepare_chat(self._json_prompt_messages(messages, schema), model)
+            response = await chat.send_message_async(content, generation_config=self._json_generation_config(**kwargs))
+            return parse_json_content(response.text)
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+    
     def is_available(self) -> bool:
         """Check if Gemini is properly configured"""
         return bool(self.api_key and genai)
@@ -250,4 +471,68 @@ class LLMProviderFactory:
     @classmethod
     def get_providers(cls) -> List[str]:
         """Get list of all supported providers"""
-        return list(cls.PROVIDERS.keys())
\ No newline at end of file
+        return list(cls.PROVIDERS.keys())
+
+
+class LLMProviderPool:
+    """Shares provider instances (and their HTTP connection pools) across requests
+
+    Providers are keyed by (provider name, API key hash). The pool also holds a
+    snapshot of the agent's LLM settings so callers do not query AgentConfig on
+    every message; both are dropped by invalidate() when the config changes.
+    """
+    
+    def __init__(self, config_ttl: float = None):
+        self.config_ttl = config_ttl if config_ttl is not None else float(os.getenv('LLM_CONFIG_TTL', 300))
+        self._providers = {}
+        self._config = None
+        self._config_loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(provider_name: str, api_key: str) -> tuple:
+        return provider_name, hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    
+    def get_provider(self, provider_name: str, api_key: str) -> BaseLLMProvider:
+        """Return the pooled provider for this name and key, creating it on first use"""
+        key = self._key(provider_name, api_key)
+        provider = self._providers.get(key)
+        if provider is None:
+            with self._lock:
+                provider = self._providers.get(key)
+                if provider is None:
+                    provider = LLMProviderFactory.create_provider(provider_name, api_key)
+                    self._providers[key] = provider
+        return provider
+    
+    def get_config(self, loader: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the cached config snapshot, calling loader when it is missing or stale"""
+        with self._lock:
+            if self._config is not None and time.monotonic() - self._config_loaded_at < self.config_ttl:
+                return self._config
+        
+        config = loader()
+        with self._lock:
+            self._config = config
+            self._config_loaded_at = time.monotonic()
+        return config
+    
+    def invalidate(self):
+        """Forget the config snapshot and all pooled providers"""
+        with self._lock:
+            self._providers.clear()
+            self._config = None
+
+
+_provider_pool = None
+_provider_pool_lock = threading.Lock()
+
+
+def get_provider_pool() -> LLMProviderPool:
+    """Get the process-wide provider pool"""
+    global _provider_pool
+    if _provider_pool is None:
+        with _provider_pool_lock:
+            if _provider_pool is None:
+                _provider_pool = LLMProviderPool()
+    return _provider_pool
@@ -16,6 +16,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from services.weaviate_service import WeaviateService
 from services.openai_service import OpenAIService
+from services.product_query import ProductFilterSpec, ProductQueryEngine
 from models import SKU, Category
 from database import db
 from sqlalchemy import or_, and_
@@ -179,7 +180,8 @@ class ProductMCPServer:
             min_price: Optional[float] = None,
             max_price: Optional[float] = None,
             in_stock: bool = True,
-            limit: int = 20
+            limit: int = 20,
+            product_types: Optional[List[str]] = None
         ) -> str:
             """
             Filter products based on various criteria
@@ -191,29 +193,16 @@ class ProductMCPServer:
                 max_price: Maximum price filter
                 in_stock: Only show in-stock items
                 limit: Maximum number of results
+                product_types: Product types such as "shirt" or "jeans" (synonyms are normalized)
                 
             Returns:
                 JSON string with filtered products
             """
             try:
-                query = SKU.query
-                
-                if categories:
-                    query = query.join(SKU.categories).filter(Category.id.in_(categories))
-                
-                if vendors:
-                    query = query.filter(SKU.vendor.in_(vendors))
-                
-                if min_price is not None:
-                    query = query.filter(SKU.price >= min_price)
-                
-                if max_price is not None:
-                    query = query.filter(SKU.price <= max_price)
-                
-                if in_stock:
-                    query = query.filter(SKU.quantity > 0)
-                
-                results = query.limit(limit).all()
+                spec = ProductFilterSpec(categories=categories, vendors=vendors, min_price=min_price,
+                                         max_price=max_price, stock='in_stock' if in_stock else 'all',
+                                         canonical_types=product_types)
+                results = ProductQueryEngine().find(spec, limit=limit)
                 
                 return json.dumps({
                     "success": True,
@@ -249,7 +238,19 @@ class ProductMCPServer:
                         "error": "Product not found"
                     })
                 
-                # Find similar products based on:
+                # Precomputed nearest neighbours from the product vectors, when available
+                from services.recommendations import get_neighbors
+                neighbors = get_neighbors([product_id], limit=limit, source='vector')
+                if neighbors:
+                    skus = {s.id: s for s in SKU.query.filter(SKU.id.in_([other_id for other_id, _ in neighbors])).all()}
+                    results = [skus[other_id] for other_id, _ in neighbors if other_id in skus]
+                    return json.dumps({
+                        "success": True,
+                        "count": len(results),
+                        "products": [r.to_dict() for r in results]
+                    })
+                
+                # Otherwise find similar products based on:
                 # 1. Same categories
                 # 2. Similar price range
                 # 3. Same vendor
@@ -306,7 +307,8 @@ class ProductMCPServer:
         @self.server.tool()
         async def get_product_recommendations(
             user_preferences: Dict[str, Any],
-            limit: int = 10
+            limit: int = 10,
+            session_id: Optional[str] = None
         ) -> str:
             """
             Get personalized product recommendations based on user preferences
@@ -314,12 +316,27 @@ class ProductMCPServer:
             Args:
                 user_preferences: Dictionary containing user preferences like categories, price range, etc.
                 limit: Maximum number of recommendations
+                session_id: Agent session whose shown/clicked products seed co-occurrence recommendations
                 
             Returns:
                 JSON string with recommended products
             """
             try:
+                # Products that co-occur with the session's products first, then preference matches
+                recommended = []
+                if session_id:
+                    from services.recommendations import recommend_for_session
+                    recommended = recommend_for_session(session_id, user_preferences, limit)
+                if len(recommended) >= limit:
+                    return json.dumps({
+                        "success": True,
+                        "count": len(recommended),
+                        "products": [sku.to_dict() for sku in recommended]
+                    })
+                
                 query = SKU.query
+                if recommended:
+                    query = query.filter(SKU.id.notin_([sku.id for sku in recommended]))
                 
                 # Apply preference filters
                 if 'categories' in user_preferences:
@@ -342,7 +359,7 @@ class ProductMCPServer:
                 query = query.filter(SKU.quantity > 0)
                 
                 # Order by some relevance (could be improved with ML)
-                results = query.limit(limit).all()
+                results = recommended + query.limit(limit - len(recommended)).all()
                 
                 return json.dumps({
                     "success": True,
@@ -0,0 +1,129 @@
+"""
+Long-lived event loop for the shopping agent
+
+Flask handles requests on ordinary threads. Instead of creating an event loop
+per chat message, coroutines are submitted to one loop running in a daemon
+thread, so async HTTP sessions, provider clients and caches created on that
+loop are reused across requests and concurrent chats interleave their I/O.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+
+
+class AgentRuntime:
+    """An asyncio event loop running forever in a background thread"""
+    
+    def __init__(self, name: str = "agent-event-loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+    
+    def start(self):
+        """Start the loop thread (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+    
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+    
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive() and self.loop and self.loop.is_running())
+    
+    def submit(self, coro: Coroutine, app=None) -> Future:
+        """Schedule a coroutine on the loop; with ``app`` it runs inside a fresh app context"""
+        if not self.is_running:
+            self.start()
+        if app is not None:
+            coro = _in_app_context(app, coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def run(self, coro: Coroutine, app=None, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop and wait for its result from a synchronous caller"""
+        future = self.submit(coro, app=app)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            future.cancel()
+            raise
+    
+    def stop(self):
+        """Stop the loop thread"""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+async def _in_app_context(app, coro: Coroutine):
+    """Await a coroutine inside its own application context (and database session)"""
+    with app.app_context():
+        return await coro
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_agent_runtime() -> AgentRuntime:
+    """Process-wide agent event loop, started on first use (after any worker fork)"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AgentRuntime()
+        _runtime.start()
+    return _runtime
+
+
+def run_agent_coroutine(coro: Coroutine, app=None, timeout: Optional[float] = None) -> Any:
+    """Run a coroutine on the shared agent loop and return its result"""
+    if timeout is None:
+        timeout = float(os.getenv('AGENT_REQUEST_TIMEOUT', 120))
+    return get_agent_runtime().run(coro, app=app, timeout=timeout)
+
+
+def iterate_agent_stream(stream: AsyncIterator, app=None, timeout: Optional[float] = None) -> Iterator:
+    """Consume an async generator on the shared agent loop, yielding its items to a synchronous caller
+
+    Used to stream agent events from a Flask response generator. If the caller
+    stops early (client disconnected) the producer is cancelled.
+    """
+    if timeout is None:
+        timeout = float(os.getenv('AGENT_REQUEST_TIMEOUT', 120))
+    
+    items = queue.Queue()
+    done = object()
+    
+    async def pump():
+        try:
+            async for item in stream:
+                items.put(item)
+        finally:
+            items.put(done)
+    
+    future = get_agent_runtime().submit(pump(), app=app)
+    try:
+        while True:
+            item = items.get(timeout=timeout)
+            if item is done:
+                break
+            yield item
+        future.result()  # re-raise producer errors
+    finally:
+        future.cancel()
@@ -0,0 +1,489 @@
+"""
+Session stores for conversation state
+
+AGENT_SESSION_BACKEND selects where sessions live:
+
+- memory (default): a bounded in-process store. Sessions are kept in LRU order
+  and evicted when idle for longer than AGENT_SESSION_IDLE_TTL seconds, or when
+  the store holds more than AGENT_SESSION_MAX sessions / AGENT_SESSION_MAX_MB
+  of message data.
+- sqlite: a SQLite file shared by every worker on the host (AGENT_SESSION_DB).
+- redis: a Redis server (AGENT_SESSION_REDIS_URL), for workers on several
+  hosts. Falls back to sqlite when the redis package or server is unavailable.
+
+The shared backends store each session as compact zlib-compressed JSON, so
+any worker can serve any turn. Changes go through update(), an optimistic
+read-modify-write: SQLite checks a version column and Redis WATCHes the key,
+and the change is re-applied to the fresh state when another worker wrote the
+session in between, so concurrent turns never drop each other's messages.
+A session missing from the store is rebuilt from the agent_conversations
+table the next time it is used.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+UPDATE_RETRIES = 10
+
+
+class SessionEntry:
+    """Messages and context for one session"""
+
+    __slots__ = ('messages', 'context', 'last_access', 'size', 'version')
+
+    def __init__(self, messages: List = None):
+        self.messages = messages or []
+        self.context = {}
+        self.last_access = time.monotonic()
+        self.size = 0
+        self.version = None  # Shared stores: version read with the entry, None if it wasn't stored
+
+
+def message_size(message) -> int:
+    """Approximate memory used by a message's content and metadata, in bytes"""
+    size = len(message.content or '')
+    if message.metadata:
+        size += len(json.dumps(message.metadata, default=str))
+    return size
+
+
+def _load_messages(loader: Optional[Callable[[str], List]], session_id: str) -> List:
+    """Rebuild a session's messages with the store's loader"""
+    if not loader:
+        return []
+    try:
+        return loader(session_id) or []
+    except Exception as e:
+        print(f"[SESSIONS] Could not rehydrate session {session_id}: {e}")
+        return []
+
+
+class SessionStore:
+    """LRU + idle-TTL session store with memory accounting"""
+
+    def __init__(self, loader: Optional[Callable[[str], List]] = None, max_sessions: int = None,
+                 idle_ttl: float = None, max_bytes: int = None):
+        self.loader = loader
+        self.max_sessions = max_sessions or int(os.getenv('AGENT_SESSION_MAX', 10000))
+        self.idle_ttl = idle_ttl or float(os.getenv('AGENT_SESSION_IDLE_TTL', 3600))
+        self.max_bytes = max_bytes or int(os.getenv('AGENT_SESSION_MAX_MB', 256)) * 1024 * 1024
+        self._sessions: 'OrderedDict[str, SessionEntry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.rehydrated = 0
+        self.evicted = 0
+
+    def get(self, session_id: str) -> SessionEntry:
+        """Return the session, loading it from the database (or creating it) on a miss"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                entry.last_access = time.monotonic()
+                self.hits += 1
+                self._evict()
+                return entry
+            self.misses += 1
+
+        messages = _load_messages(self.loader, session_id)
+
+        with self._lock:
+            # Another thread may have created the session while we were loading
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = SessionEntry(messages)
+                self._sessions[session_id] = entry
+                self.resize(entry)
+                if messages:
+                    self.rehydrated += 1
+            entry.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._evict(keep=session_id)
+            return entry
+
+    def resize(self, entry: SessionEntry):
+        """Recompute an entry's size after its messages changed"""
+        with self._lock:
+            size = sum(message_size(message) for message in entry.messages)
+            self._bytes += size - entry.size
+            entry.size = size
+
+    def update(self, session_id: str, mutate: Callable[[SessionEntry], None]) -> SessionEntry:
+        """Apply mutate(entry) to the session atomically and record the change"""
+        entry = self.get(session_id)
+        with self._lock:
+            mutate(entry)
+            self.put(session_id, entry)
+        return entry
+
+    def put(self, session_id: str, entry: SessionEntry):
+        """Record changes to a session's messages or context"""
+        with self._lock:
+            if self._sessions.get(session_id) is not entry:
+                self.discard(session_id)
+                self._sessions[session_id] = entry
+                entry.size = 0
+            self.resize(entry)
+
+    def discard(self, session_id: str):
+        """Drop a session from memory"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def _evict(self, keep: str = None):
+        """Evict idle sessions, then least recently used ones while over the limits (lock held)"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            over_limit = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_limit and now - entry.last_access <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= entry.size
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Session, message and byte counts plus cache counters"""
+        with self._lock:
+            self._evict()
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'messages': sum(len(entry.messages) for entry in self._sessions.values()),
+                'bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_ttl': self.idle_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'rehydrated': self.rehydrated,
+                'evicted': self.evicted
+            }
+
+
+ROLE_CODES = {'user': 'u', 'assistant': 'a', 'system': 's'}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+
+def encode_session(entry: SessionEntry) -> bytes:
+    """Serialize a session as compressed JSON: [[role code, content, epoch seconds, metadata?], ...]"""
+    messages = []
+    for message in entry.messages:
+        item = [ROLE_CODES.get(message.role, message.role), message.content, round(message.timestamp.timestamp(), 3)]
+        if message.metadata:
+            item.append(message.metadata)
+        messages.append(item)
+    payload = {'m': messages}
+    if entry.context:
+        payload['c'] = entry.context
+    return zlib.compress(json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+def decode_session(data: bytes) -> SessionEntry:
+    """Inverse of encode_session"""
+    from datetime import datetime
+    from .conversation import Message
+
+    payload = json.loads(zlib.decompress(data).decode('utf-8'))
+    entry = SessionEntry([Message(
+        CODE_ROLES.get(item[0], item[0]),
+        item[1],
+        timestamp=datetime.fromtimestamp(item[2]),
+        metadata=item[3] if len(item) > 3 else None
+    ) for item in payload.get('m', [])])
+    entry.context = payload.get('c', {})
+    return entry
+
+
+class SharedSessionStore:
+    """Base for stores that keep serialized sessions outside the process
+
+    Every get() reads the current state, so a turn served by another worker is
+    visible immediately; callers write their changes with update().
+    """
+
+    backend = None
+
+    def __init__(self, loader: Optional[Callable[[str], List]] = None, idle_ttl: float = None):
+        self.loader = loader
+        self.idle_ttl = idle_ttl or float(os.getenv('AGENT_SESSION_IDLE_TTL', 3600))
+        self.hits = 0
+        self.misses = 0
+        self.rehydrated = 0
+        self.conflicts = 0
+
+    def get(self, session_id: str) -> SessionEntry:
+        data, version = None, None
+        try:
+            data, version = self._read(session_id)
+        except Exception as e:
+            print(f"[SESSIONS] Error reading session {session_id} from {self.backend}: {e}")
+        return self._entry(session_id, data, version)
+
+    def _entry(self, session_id: str, data: Optional[bytes], version: Optional[int]) -> SessionEntry:
+        """Decode stored data, or rebuild the session from the database when there is none"""
+        if data is not None:
+            self.hits += 1
+            entry = decode_session(data)
+        else:
+            self.misses += 1
+            entry = SessionEntry(_load_messages(self.loader, session_id))
+            if entry.messages:
+                self.rehydrated += 1
+        entry.version = version
+        return entry
+
+    def update(self, session_id: str, mutate: Callable[[SessionEntry], None]) -> SessionEntry:
+        """Apply mutate(entry) to the stored session, re-applying it if another worker wrote first
+
+        Conflicts and backend errors (a locked SQLite file, a dropped Redis
+        connection) are retried, every attempt versioned. If none succeeds the
+        stored copy is dropped instead of overwritten, so the next turn
+        rebuilds the session from agent_conversations, which has every
+        worker's messages.
+        """
+        for attempt in range(UPDATE_RETRIES):
+            try:
+                result = self._update_once(session_id, mutate)
+            except Exception as e:
+                print(f"[SESSIONS] Error updating session {session_id} in {self.backend} (attempt {attempt + 1}): {e}")
+                result = None
+            else:
+                if result is None:
+                    self.conflicts += 1
+            if result is not None:
+                return result
+            time.sleep(0.005 * (attempt + 1))
+
+        print(f"[SESSIONS] Could not update session {session_id}; it will be rebuilt from the database")
+        self.discard(session_id)
+        entry = self._entry(session_id, None, None)
+        mutate(entry)
+        return entry
+
+    def put(self, session_id: str, entry: SessionEntry):
+        """Write a session unconditionally (last writer wins)"""
+        try:
+            self._write(session_id, encode_session(entry))
+        except Exception as e:
+            print(f"[SESSIONS] Error writing session {session_id} to {self.backend}: {e}")
+
+    def resize(self, entry: SessionEntry):
+        pass  # Sizes are tracked by the backend
+
+    def discard(self, session_id: str):
+        try:
+            self._delete(session_id)
+        except Exception as e:
+            print(f"[SESSIONS] Error deleting session {session_id} from {self.backend}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            'backend': self.backend,
+            'idle_ttl': self.idle_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rehydrated': self.rehydrated,
+            'conflicts': self.conflicts
+        }
+        try:
+            stats.update(self._backend_stats())
+        except Exception as e:
+            print(f"[SESSIONS] Error reading {self.backend} stats: {e}")
+        return stats
+
+    def _read(self, session_id: str) -> Tuple[Optional[bytes], Optional[int]]:
+        """(data, version); data is None when the session is missing or idle"""
+        raise NotImplementedError
+
+    def _update_once(self, session_id: str, mutate: Callable[[SessionEntry], None]) -> Optional[SessionEntry]:
+        """One read-modify-write attempt; None when the session changed since it was read"""
+        raise NotImplementedError
+
+    def _write(self, session_id: str, data: bytes):
+        raise NotImplementedError
+
+    def _delete(self, session_id: str):
+        raise NotImplementedError
+
+    def _backend_stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class SQLiteSessionStore(SharedSessionStore):
+    """Sessions in a SQLite file shared by the workers on one host"""
+
+    backend = 'sqlite'
+
+    def __init__(self, loader: Optional[Callable[[str], List]] = None, idle_ttl: float = None, path: str = None):
+        super().__init__(loader, idle_ttl)
+        self.path = path or os.getenv(
+            'AGENT_SESSION_DB',
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'agent_sessions.db')
+        )
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+        if 'version' not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_updated_at ON sessions (updated_at)")
+        self._conn.commit()
+
+    def _read(self, session_id: str) -> Tuple[Optional[bytes], Optional[int]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, version, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None, None
+        # An idle session reads as missing, but its version still guards the next write
+        data = row[0] if row[2] > time.time() - self.idle_ttl else None
+        return data, row[1]
+
+    def _update_once(self, session_id: str, mutate: Callable[[SessionEntry], None]) -> Optional[SessionEntry]:
+        data, version = self._read(session_id)
+        entry = self._entry(session_id, data, version)
+        mutate(entry)
+        with self._lock:
+            if version is None:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, data, updated_at, version) VALUES (?, ?, ?, 1)",
+                    (session_id, encode_session(entry), time.time())
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, updated_at = ?, version = version + 1 "
+                    "WHERE session_id = ? AND version = ?",
+                    (encode_session(entry), time.time(), session_id, version)
+                )
+            self._conn.commit()
+            if cursor.rowcount == 0:
+                return None
+            self._writes += 1
+            self._prune()
+        entry.version = (version or 0) + 1
+        return entry
+
+    def _write(self, session_id: str, data: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, data, updated_at, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, "
+                "updated_at = excluded.updated_at, version = version + 1",
+                (session_id, data, time.time())
+            )
+            self._writes += 1
+            self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        """Prune idle sessions now and then rather than on every write (lock held)"""
+        if self._writes % 500 == 0:
+            self._conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.idle_ttl,))
+            self._conn.commit()
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def _backend_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions WHERE updated_at > ?",
+                (time.time() - self.idle_ttl,)
+            ).fetchone()
+        return {'sessions': sessions, 'bytes': size, 'path': self.path}
+
+
+class RedisSessionStore(SharedSessionStore):
+    """Sessions in Redis, expiring after the idle TTL"""
+
+    backend = 'redis'
+
+    def __init__(self, loader: Optional[Callable[[str], List]] = None, idle_ttl: float = None,
+                 url: str = None, prefix: str = 'agent:session:'):
+        super().__init__(loader, idle_ttl)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url or os.getenv('AGENT_SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+        self.client.ping()
+
+    def _read(self, session_id: str) -> Tuple[Optional[bytes], Optional[int]]:
+        return self.client.get(self.prefix + session_id), None
+
+    def _update_once(self, session_id: str, mutate: Callable[[SessionEntry], None]) -> Optional[SessionEntry]:
+        key = self.prefix + session_id
+        with self.client.pipeline() as pipe:
+            try:
+                # WATCH makes the MULTI/EXEC fail if another worker writes the key in between
+                pipe.watch(key)
+                entry = self._entry(session_id, pipe.get(key), None)
+                mutate(entry)
+                pipe.multi()
+                pipe.set(key, encode_session(entry), ex=int(self.idle_ttl))
+                pipe.execute()
+                return entry
+            except redis.WatchError:
+                return None
+
+    def _write(self, session_id: str, data: bytes):
+        self.client.set(self.prefix + session_id, data, ex=int(self.idle_ttl))
+
+    def _delete(self, session_id: str):
+        self.client.delete(self.prefix + session_id)
+
+    def _backend_stats(self) -> Dict[str, Any]:
+        sessions = sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000))
+        return {'sessions': sessions}
+
+
+def create_session_store(loader: Optional[Callable[[str], List]] = None):
+    """Build the session store selected by AGENT_SESSION_BACKEND"""
+    backend = os.getenv('AGENT_SESSION_BACKEND', 'memory').lower()
+
+    if backend == 'redis':
+        if redis is None:
+            print("[SESSIONS] redis package not installed, using the SQLite session store")
+        else:
+            try:
+                return RedisSessionStore(loader)
+            except Exception as e:
+                print(f"[SESSIONS] Redis unavailable ({e}), using the SQLite session store")
+        backend = 'sqlite'
+
+    if backend == 'sqlite':
+        return SQLiteSessionStore(loader)
+
+    return SessionStore(loader)
@@ -0,0 +1,214 @@
+"""
+Write-behind buffer for shopping agent persistence
+
+Chat turns, product interactions and analytics events are queued in memory
+and written by a background thread in one transaction per batch, every
+CHAT_WRITE_FLUSH_INTERVAL seconds or as soon as CHAT_WRITE_BATCH_SIZE rows
+are pending. Request handlers only append to the queue, so SQLite write
+contention stays off the chat latency path. Readers of the same tables call
+flush() first to see everything written so far.
+
+Set CHAT_WRITE_BEHIND=0 to write synchronously instead.
+"""
+
+import atexit
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ChatWriteBuffer:
+    """Batches AgentConversation, AgentProductInteraction and AgentAnalytics rows"""
+
+    def __init__(self, flush_interval: float = None, batch_size: int = None, enabled: bool = None):
+        self.flush_interval = flush_interval or float(os.getenv('CHAT_WRITE_FLUSH_INTERVAL', 1.0))
+        self.batch_size = batch_size or int(os.getenv('CHAT_WRITE_BATCH_SIZE', 100))
+        self.enabled = enabled if enabled is not None else os.getenv('CHAT_WRITE_BEHIND', '1') != '0'
+        self.app = None
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, app):
+        """Start the flush thread (idempotent)"""
+        self.app = app
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="chat-write-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread after writing everything pending"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _enqueue(self, kind: str, record: Dict[str, Any]):
+        record.setdefault('created_at', datetime.utcnow())
+        with self._lock:
+            self._pending.append((kind, record))
+            pending = len(self._pending)
+
+        if not self.enabled:
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wakeup.set()
+
+    def add_chat_turn(self, session_id: str, message: str, image_data: Optional[str], response: Dict[str, Any]):
+        """Queue a user message, the assistant's response and its product impressions"""
+        self._enqueue('turn', {
+            'session_id': session_id,
+            'message': message,
+            'has_image': bool(image_data),
+            'response': response
+        })
+
+    def add_interaction(self, conversation_id: int, product_id, interaction_type: str, position: int = 0):
+        """Queue a product interaction for an existing conversation message"""
+        self._enqueue('interaction', {
+            'conversation_id': conversation_id,
+            'product_id': product_id,
+            'interaction_type': interaction_type,
+            'position': position
+        })
+
+    def log_event(self, session_id: str, event_type: str, event_data: Optional[Dict] = None):
+        """Queue an analytics event (buffered AgentAnalytics.log_event)"""
+        self._enqueue('event', {
+            'session_id': session_id,
+            'event_type': event_type,
+            'event_data': event_data
+        })
+
+    def has_pending(self, session_id: str) -> bool:
+        """Whether any queued record belongs to a session"""
+        with self._lock:
+            return any(record.get('session_id') == session_id for _, record in self._pending)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Write all pending records; returns the number of records written"""
+        if self.app is None:
+            return 0
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            with self.app.app_context():
+                return self._write(batch)
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """Insert a batch in one transaction, falling back to one record at a time on error"""
+        from database import db
+
+        try:
+            for kind, record in batch:
+                db.session.add_all(self._build_rows(kind, record))
+            db.session.commit()
+            return len(batch)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[CHAT WRITE] Batch of {len(batch)} failed ({e}), retrying records individually")
+
+        written = 0
+        for kind, record in batch:
+            try:
+                db.session.add_all(self._build_rows(kind, record))
+                db.session.commit()
+                written += 1
+            except Exception as e:
+                db.session.rollback()
+                print(f"[CHAT WRITE] Dropping {kind} record for session {record.get('session_id')}: {e}")
+        return written
+
+    @staticmethod
+    def _build_rows(kind: str, record: Dict[str, Any]) -> list:
+        from models import AgentConversation, AgentProductInteraction, AgentAnalytics
+
+        created_at = record['created_at']
+        if kind == 'event':
+            return [AgentAnalytics(
+                session_id=record['session_id'],
+                event_type=record['event_type'],
+                event_data=json.dumps(record['event_data']) if record['event_data'] else None,
+                created_at=created_at
+            )]
+
+        if kind == 'interaction':
+            return [AgentProductInteraction(
+                conversation_id=record['conversation_id'],
+                product_id=record['product_id'],
+                interaction_type=record['interaction_type'],
+                position=record['position'],
+                created_at=created_at
+            )]
+
+        response = record['response']
+        products = response.get('products', [])
+        user_msg = AgentConversation(
+            session_id=record['session_id'],
+            role='user',
+            content=record['message'],
+            message_metadata=json.dumps({'has_image': record['has_image']}),
+            created_at=created_at
+        )
+        assistant_msg = AgentConversation(
+            session_id=record['session_id'],
+            role='assistant',
+            content=response['response'],
+            message_metadata=json.dumps({
+                'products_shown': len(products),
+                'product_refs': AgentConversation.product_refs(products),  # Hydrated on read
+                'suggestions': response.get('suggestions', []),
+                # Read back by the intent router when the session is rebuilt from these rows
+                'tool_used': response.get('tool_used'),
+                'product_types': response.get('product_types', [])
+            }),
+            # Keep the reply after the message when history is ordered by created_at
+            created_at=created_at + timedelta(microseconds=1)
+        )
+        # Linked through the relationship, so the assistant row's id is assigned in the same flush
+        interactions = [AgentProductInteraction(
+            conversation=assistant_msg,
+            product_id=product.get('id'),
+            interaction_type='shown',
+            position=idx + 1,
+            created_at=created_at
+        ) for idx, product in enumerate(products)]
+        return [user_msg, assistant_msg] + interactions
+
+
+_write_buffer = None
+_write_buffer_lock = threading.Lock()
+
+
+def get_write_buffer(app=None) -> ChatWriteBuffer:
+    """Process-wide write buffer; started on first use with an app (after any worker fork)"""
+    global _write_buffer
+    with _write_buffer_lock:
+        if _write_buffer is None:
+            _write_buffer = ChatWriteBuffer()
+            atexit.register(_write_buffer.stop)
+        if app is not None:
+            _write_buffer.start(app)
+    return _write_buffer
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for the incremental co-occurrence matrix (uses an in-memory SQLite database)
+"""
+
+import random
+from collections import defaultdict, namedtuple
+
+from flask import Flask
+
+from database import db
+import models  # noqa: F401  (registers every table for create_all)
+from models.recommendation import CooccurrenceSession
+from services.recommendations import MAX_SESSION_ITEMS, _fold_sessions, pair_deltas, session_items
+
+
+Row = namedtuple('Row', 'product_id interaction_type')
+
+
+def random_sessions(seed, sessions=20, rows_per_session=40, products=30):
+    rng = random.Random(seed)
+    return {
+        f'session-{index}': [Row(rng.randint(1, products), rng.choice(['shown', 'shown', 'clicked']))
+                             for _ in range(rng.randint(1, rows_per_session))]
+        for index in range(sessions)
+    }
+
+
+def full_recompute(rows_by_session):
+    """The matrix from scratch: sum over sessions of w_a * w_b for every ordered pair, w_a ** 2 on the diagonal"""
+    matrix = defaultdict(float)
+    for rows in rows_by_session.values():
+        items = session_items(rows)
+        for product_id, weight in items.items():
+            for other_id, other_weight in items.items():
+                matrix[(product_id, other_id)] += weight * other_weight
+    return matrix
+
+
+def assert_same(expected, actual):
+    for key in set(expected) | set(actual):
+        assert abs(expected.get(key, 0) - actual.get(key, 0)) < 1e-9, f"{key}: {expected.get(key)} != {actual.get(key)}"
+
+
+def fold_in_chunks(rows_by_session, seed):
+    """Sum of pair_deltas over each session's rows split into random chunks"""
+    rng = random.Random(seed)
+    matrix = defaultdict(float)
+    for rows in rows_by_session.values():
+        items, start = {}, 0
+        while start < len(rows):
+            end = start + rng.randint(1, 8)
+            new = session_items(rows[start:end], items)
+            for key, delta in pair_deltas(items, new).items():
+                matrix[key] += delta
+            items, start = new, end
+    return matrix
+
+
+def test_pair_deltas_match_full_recompute():
+    for seed in range(5):
+        rows_by_session = random_sessions(seed)
+        assert_same(full_recompute(rows_by_session), fold_in_chunks(rows_by_session, seed))
+
+
+def test_session_item_cap():
+    """Only a session's first MAX_SESSION_ITEMS distinct products count, and a click upgrades a shown product"""
+    rows = [Row(product_id, 'shown') for product_id in range(MAX_SESSION_ITEMS + 10)] + [Row(0, 'clicked')]
+    items = session_items(rows)
+    assert list(items) == list(range(MAX_SESSION_ITEMS))
+    assert items[0] == 3.0 and items[1] == 1.0
+
+
+def test_fold_sessions_match_full_recompute():
+    """Folding batches through cooccurrence_sessions gives the same matrix as a recount"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    rows_by_session = random_sessions(42, sessions=15)
+    rng = random.Random(42)
+    positions = {session_id: 0 for session_id in rows_by_session}
+    matrix = defaultdict(float)
+
+    with app.app_context():
+        db.create_all()
+        while any(positions[session_id] < len(rows) for session_id, rows in rows_by_session.items()):
+            batch = {}
+            for session_id, rows in rows_by_session.items():
+                start = positions[session_id]
+                if start < len(rows) and rng.random() < 0.6:
+                    positions[session_id] = start + rng.randint(1, 10)
+                    batch[session_id] = rows[start:positions[session_id]]
+            if not batch:
+                continue
+            for key, delta in _fold_sessions(batch).items():
+                matrix[key] += delta
+            db.session.commit()
+
+        stored = {state.session_id: state.get_items() for state in CooccurrenceSession.query.all()}
+        assert stored == {session_id: session_items(rows) for session_id, rows in rows_by_session.items()}
+
+    assert_same(full_recompute(rows_by_session), matrix)
+
+
+if __name__ == "__main__":
+    tests = [test_pair_deltas_match_full_recompute, test_session_item_cap, test_fold_sessions_match_full_recompute]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\n{len(tests) - failed} of {len(tests)} passed")
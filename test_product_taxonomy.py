@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test script for the product type taxonomy (no server or database needed)
+"""
+
+from services.product_taxonomy import canonical_product_type, normalize_product_type, normalize_product_types
+
+
+def test_compound_garments():
+    """Compound names that whole-word matching must still recognise"""
+    cases = {
+        "Sweatpants": "pants",
+        "Grey Fleece Sweatpant": "pants",
+        "Skinny Jeggings": "pants",
+        "Trackpants": "pants",
+        "Sweatshirt": "shirt",
+        "Flannel Overshirt": "shirt",
+        "Thermal Undershirt": "shirt",
+        "Floral Sundress": "dress",
+        "Denim Shirtdress": "dress",
+        "Waterproof Raincoat": "jacket",
+        "Wool Overcoat": "jacket",
+        "Red Stilettos": "shoes",
+        "Snowboots": "shoes",
+    }
+    for title, expected in cases.items():
+        assert canonical_product_type(title=title) == expected, title
+
+
+def test_whole_words_only():
+    """Synonyms inside unrelated words must not match"""
+    for title in ["Laptop Stand", "Desktop Organizer", "Coffee Table", "Steel Wheel"]:
+        assert canonical_product_type(title=title) is None, title
+
+
+def test_last_match_wins():
+    assert canonical_product_type(title="Shirt Jacket") == "jacket"
+    assert canonical_product_type(title="Hooded Sweatshirt Dress") == "dress"
+
+
+def test_source_precedence():
+    """Product type beats title, title beats tags"""
+    assert canonical_product_type(product_type="Jeans", title="Relaxed Tee") == "pants"
+    assert canonical_product_type(product_type="Accessories", title="Canvas Sneakers") == "shoes"
+    assert canonical_product_type(title="Gift Card", tags="boots, winter") == "shoes"
+    assert canonical_product_type() is None
+
+
+def test_normalize_requested_types():
+    assert normalize_product_type("Sweatpants") == "pants"
+    assert normalize_product_type("sneakers") == "shoes"
+    assert normalize_product_type("watch") is None
+    assert normalize_product_types(["Jeans", "pants", "Sweatpants", "Watch"]) == ["pants", "watch"]
+
+
+if __name__ == "__main__":
+    tests = [test_compound_garments, test_whole_words_only, test_last_match_wins,
+             test_source_precedence, test_normalize_requested_types]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\n{len(tests) - failed} of {len(tests)} passed")
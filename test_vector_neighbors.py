@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script for the precomputed vector neighbour lists (uses an in-memory SQLite database, no Weaviate)
+"""
+
+import random
+import time
+
+import numpy as np
+from flask import Flask
+
+from database import db
+import models  # noqa: F401  (registers every table for create_all)
+from models.recommendation import ProductNeighborList
+from models.sku import SKU
+from services.vector_neighbors import load_vectors, pending_changes, rebuild_all, refresh_changed
+
+
+PRODUCTS = 300
+DIMENSIONS = 16
+K = 5
+
+
+class FakeWeaviate:
+    """Serves product vectors the way WeaviateService.iter_product_vectors does"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def iter_product_vectors(self, class_name=None):
+        yield from self.vectors.items()
+
+
+def stored_lists():
+    return {row.product_id: row.get_neighbors() for row in ProductNeighborList.query.filter_by(source='vector').all()}
+
+
+def assert_same_lists(expected, actual):
+    assert set(expected) == set(actual), f"products differ: {set(expected) ^ set(actual)}"
+    for product_id, neighbors in expected.items():
+        assert [other_id for other_id, _ in neighbors] == [other_id for other_id, _ in actual[product_id]], product_id
+        for (_, score), (_, other_score) in zip(neighbors, actual[product_id]):
+            assert abs(score - other_score) < 1e-3, product_id
+
+
+def test_refresh_changed_matches_rebuild_all():
+    """An incremental refresh after vectors change or disappear gives the lists of a full rebuild"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    rng = np.random.default_rng(0)
+    vectors = {product_id: rng.normal(size=DIMENSIONS).tolist() for product_id in range(1, PRODUCTS + 1)}
+    weaviate = FakeWeaviate(vectors)
+
+    with app.app_context():
+        db.create_all()
+        for product_id in vectors:
+            db.session.add(SKU(id=product_id, title=f'Product {product_id}', handle=f'product-{product_id}',
+                               price=1, quantity=1, weaviate_id=f'uuid-{product_id}'))
+        db.session.commit()
+
+        ids, matrix = load_vectors(weaviate)
+        assert rebuild_all(ids, matrix, k=K) == PRODUCTS
+        assert pending_changes() == (set(), set())
+
+        time.sleep(0.01)  # SKU.updated_at must be later than the lists
+        for product_id in random.Random(1).sample(sorted(vectors), 10):
+            vectors[product_id] = rng.normal(size=DIMENSIONS).tolist()
+            db.session.get(SKU, product_id).title += ' (updated)'
+        for product_id in (7, 8, 9):
+            vectors.pop(product_id, None)
+        db.session.commit()
+
+        ids, matrix = load_vectors(weaviate)
+        assert refresh_changed(ids, matrix, k=K) > 0
+        incremental = stored_lists()
+        assert refresh_changed(ids, matrix, k=K) == 0
+
+        rebuild_all(ids, matrix, k=K)
+        assert_same_lists(stored_lists(), incremental)
+
+
+if __name__ == "__main__":
+    tests = [test_refresh_changed_matches_rebuild_all]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\n{len(tests) - failed} of {len(tests)} passed")